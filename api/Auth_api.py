@@ -1,11 +1,14 @@
-from .client import Client
+import httpx
+import asyncio
+import functools
+from .client import Client, AsyncClient
 from .consts import *
 
 
 class AuthAPI(Client):
 
-    def __init__(self, api_key, api_secret, proxy=None):
-        Client.__init__(self, api_key=api_key, api_secret=api_secret, proxy=proxy)
+    def __init__(self, api_key, api_secret, proxy=None, base_url=None, limits=None):
+        Client.__init__(self, api_key=api_key, api_secret=api_secret, proxy=proxy, base_url=base_url, limits=limits)
 
     # Get account
     def get_account(self):
@@ -179,6 +182,58 @@ class AuthAPI(Client):
     def place_batch_orders(self, orders):
         return self._request_with_params(EXEC_ORDERS.instruction, EXEC_ORDERS.method, EXEC_ORDERS.path, orders)
 
+    # Submits any number of orders in batches of at most chunk_size, returns one result per order in input order;
+    # a chunk that fails becomes one error entry per order (see _chunk_error), the other chunks keep their results
+    def place_batch_orders_chunked(self, orders, chunk_size=BATCH_ORDER_LIMIT):
+        chunks = [orders[start:start + chunk_size] for start in range(0, len(orders), chunk_size)]
+        if len(chunks) == 1:
+            return self._place_batch_chunk(chunks[0])
+        # Chunks go out concurrently on the shared connection
+        results = self.gather(*[functools.partial(self._place_batch_chunk, chunk) for chunk in chunks])
+        return [each for chunk_result in results for each in chunk_result]
+
+    def _place_batch_chunk(self, orders):
+        try:
+            return self.place_batch_orders(orders)
+        except httpx.HTTPStatusError as e:
+            # Only a batch rejected for its size is split in halves
+            if len(orders) > 1 and self._batch_too_large(e, orders):
+                self._count_batch_split()
+                half = len(orders) // 2
+                return self._place_batch_chunk(orders[:half]) + self._place_batch_chunk(orders[half:])
+            return self._chunk_error(orders, e)
+        except httpx.HTTPError as e:
+            return self._chunk_error(orders, e)
+
+    # One error entry per order of a failed chunk: code is the HTTP status (None for network errors),
+    # error the exception type; whether the orders reached the exchange is unknown unless code is 429
+    @staticmethod
+    def _chunk_error(orders, error):
+        response = getattr(error, 'response', None) if isinstance(error, httpx.HTTPStatusError) else None
+        code = response.status_code if response is not None else None
+        message = response.text if response is not None else str(error)
+        return [{'code': code, 'message': message, 'error': type(error).__name__} for _ in orders]
+
+    # True when the exchange rejected the batch for its size (413, or a 400 whose message names the batch size)
+    @staticmethod
+    def _batch_too_large(error, orders):
+        response = error.response
+        if response.status_code == 413:
+            return True
+        if response.status_code != 400:
+            return False
+        if len(orders) > BATCH_ORDER_LIMIT:
+            return True
+        try:
+            message = response.json().get('message') or ''
+        except (ValueError, AttributeError):
+            message = response.text
+        return 'batch' in str(message).lower()
+
+    def _count_batch_split(self):
+        if self.metrics is not None:
+            self.metrics.inc('retries_total', endpoint=EXEC_ORDERS.method + ' ' + EXEC_ORDERS.path, reason='batch_split')
+
     # Retrieves all open orders
     def get_open_orders(self, symbol=None, marketType=None):
         params = {'symbol': symbol, 'marketType': marketType}
@@ -213,4 +268,91 @@ class AuthAPI(Client):
     # Submit a quote in response to an RFQ
     def submit_quote(self, rfqId, askPrice, bidPrice, clientId=None):
         params = {'rfqId': rfqId, 'askPrice': askPrice, 'bidPrice': bidPrice, 'clientId': clientId}
-        return self._request_with_params(SUBMIT_QUOTE.instruction, SUBMIT_QUOTE.method, SUBMIT_QUOTE.path, params)
\ No newline at end of file
+        return self._request_with_params(SUBMIT_QUOTE.instruction, SUBMIT_QUOTE.method, SUBMIT_QUOTE.path, params)
+
+    # Paginated history: generators (async generators on AsyncAuthAPI) walking every page,
+    # keyword arguments are those of the page method plus the paging options of pagination.paginate
+
+    # Iterates over the whole deposit history
+    def iter_deposits(self, **kwargs):
+        return self._paginate(self.get_deposits, **kwargs)
+
+    # Iterates over the whole withdrawal history
+    def iter_withdrawals(self, **kwargs):
+        return self._paginate(self.get_withdrawals, **kwargs)
+
+    # Iterates over the whole borrow and lend history
+    def iter_borrow_lend_history(self, **kwargs):
+        return self._paginate(self.get_borrow_lend_history, **kwargs)
+
+    # Iterates over the whole interest payment history
+    def iter_interest_history(self, **kwargs):
+        return self._paginate(self.get_interest_history, **kwargs)
+
+    # Iterates over the whole borrow and lend position history
+    def iter_borrow_lend_position_history(self, **kwargs):
+        return self._paginate(self.get_borrow_lend_position_history, **kwargs)
+
+    # Iterates over the whole dust conversion history
+    def iter_dust_convert_history(self, **kwargs):
+        return self._paginate(self.get_dust_convert_history, **kwargs)
+
+    # Iterates over the whole fill history
+    def iter_fill_history(self, **kwargs):
+        return self._paginate(self.get_fill_history, **kwargs)
+
+    # Iterates over the whole funding payment history
+    def iter_fundings(self, **kwargs):
+        return self._paginate(self.get_fundings, **kwargs)
+
+    # Iterates over the whole order history
+    def iter_orders(self, **kwargs):
+        return self._paginate(self.get_orders, **kwargs)
+
+    # Iterates over the whole profit and loss history
+    def iter_pnls(self, **kwargs):
+        return self._paginate(self.get_pnls, **kwargs)
+
+    # Iterates over the whole rfq history
+    def iter_rfqs(self, **kwargs):
+        return self._paginate(self.get_rfqs, **kwargs)
+
+    # Iterates over the whole quote history
+    def iter_quotes(self, **kwargs):
+        return self._paginate(self.get_quotes, **kwargs)
+
+    # Iterates over the whole settlement history
+    def iter_settlements(self, **kwargs):
+        return self._paginate(self.get_settlements, **kwargs)
+
+    # Iterates over the whole strategy history
+    def iter_strategies(self, **kwargs):
+        return self._paginate(self.get_strategies, **kwargs)
+
+
+class AsyncAuthAPI(AsyncClient, AuthAPI):
+    '''
+    Same methods as AuthAPI, each one returns an awaitable.
+    '''
+
+    def __init__(self, api_key, api_secret, proxy=None, base_url=None, limits=None):
+        AsyncClient.__init__(self, api_key=api_key, api_secret=api_secret, proxy=proxy, base_url=base_url, limits=limits)
+
+    # Methods with their own control flow need a real coroutine version
+
+    async def place_batch_orders_chunked(self, orders, chunk_size=BATCH_ORDER_LIMIT):
+        chunks = [orders[start:start + chunk_size] for start in range(0, len(orders), chunk_size)]
+        results = await asyncio.gather(*[self._place_batch_chunk(chunk) for chunk in chunks])
+        return [each for chunk_result in results for each in chunk_result]
+
+    async def _place_batch_chunk(self, orders):
+        try:
+            return await self.place_batch_orders(orders)
+        except httpx.HTTPStatusError as e:
+            if len(orders) > 1 and self._batch_too_large(e, orders):
+                self._count_batch_split()
+                half = len(orders) // 2
+                return await self._place_batch_chunk(orders[:half]) + await self._place_batch_chunk(orders[half:])
+            return self._chunk_error(orders, e)
+        except httpx.HTTPError as e:
+            return self._chunk_error(orders, e)
@@ -1,11 +1,11 @@
-from .client import Client
+from .client import Client, AsyncClient
 from .consts import *
 
 
 class PublicAPI(Client):
 
-    def __init__(self, proxy=None):
-        Client.__init__(self, proxy=proxy)
+    def __init__(self, proxy=None, base_url=None, limits=None):
+        Client.__init__(self, proxy=proxy, base_url=base_url, limits=limits)
 
     # Get assets
     def get_assets(self):
@@ -90,4 +90,23 @@ class PublicAPI(Client):
     # Retrieves all historical trades for the given symbol
     def get_historical_trades(self, symbol, limit=100, offset=0):
         params = {'symbol': symbol, 'limit': limit, 'offset': offset}
-        return self._request_with_params(HISTORICAL_TRADES.instruction, HISTORICAL_TRADES.method, HISTORICAL_TRADES.path, params)
\ No newline at end of file
+        return self._request_with_params(HISTORICAL_TRADES.instruction, HISTORICAL_TRADES.method, HISTORICAL_TRADES.path, params)
+
+    # Paginated history, see pagination.paginate for the paging options
+
+    # Iterates over the whole funding interval rate history
+    def iter_funding_rate(self, **kwargs):
+        return self._paginate(self.get_funding_rate, **kwargs)
+
+    # Iterates over all historical trades
+    def iter_historical_trades(self, **kwargs):
+        return self._paginate(self.get_historical_trades, **kwargs)
+
+
+class AsyncPublicAPI(AsyncClient, PublicAPI):
+    '''
+    Same methods as PublicAPI, each one returns an awaitable.
+    '''
+
+    def __init__(self, proxy=None, base_url=None, limits=None):
+        AsyncClient.__init__(self, proxy=proxy, base_url=base_url, limits=limits)
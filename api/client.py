@@ -1,62 +1,139 @@
-import json
+import asyncio
+import concurrent.futures
+import threading
+import time
 import httpx
+from . import codec
 from . import utils
+from . import metrics
+from . import models
+from . import pagination
 from . import consts as c
 
 
+DEFAULT_LIMITS = httpx.Limits(max_connections=c.MAX_CONNECTIONS, max_keepalive_connections=c.MAX_KEEPALIVE_CONNECTIONS,
+                              keepalive_expiry=c.KEEPALIVE_EXPIRY)
+
+
 class Client(object):
 
-    def __init__(self, api_key=None, api_secret=None, proxy=None):
+    def __init__(self, api_key=None, api_secret=None, proxy=None, base_url=None, limits=None):
 
         self.API_KEY = api_key
         self.API_SECRET = api_secret
+        self.base_url = base_url or c.API_URL  # e.g. a local mock_exchange.MockExchange
         self.window = c.DEFAULT_WINDOW
-        self.client = httpx.Client(http2=True, proxy=proxy)
+        self.signer = utils.Signer(api_key, api_secret, self.window) if api_secret else None
+        self.clock = None  # Optional clock.ClockSync for server-corrected timestamps
+        self.metrics = metrics.registry  # None disables the per-endpoint instrumentation
+        self.rate_limiter = None  # Optional rate_limit.RateLimiter (AsyncRateLimiter for AsyncClient)
+        self.typed = False  # True returns api.models objects (Order, Fill, Balance, ...) instead of raw dicts
+        self.codec = codec.default  # JSON for request bodies and responses, e.g. codec.Codec('json') to force stdlib
+        self.limits = limits or DEFAULT_LIMITS  # httpx.Limits of the connection pool
+        self.client = self._create_http_client(proxy)
+        self.last_used = time.monotonic()  # Time of the last request, keepalive pings only an idle connection
+        self._executor = None
+        self._keepalive = None
 
-    def _request(self, instruction, method, request_path, params):
+    def _create_http_client(self, proxy):
+        return httpx.Client(http2=True, proxy=proxy, limits=self.limits)
 
-        url = c.API_URL + request_path
+    def _prepare(self, instruction, request_path, params, endpoint=None):
+
+        started = time.perf_counter()
+        url = self.base_url + request_path
         if isinstance(params, dict):
             params = utils.clean_dict_none(params)
         else:  # For batch orders execution
             params = [utils.clean_dict_none(each) for each in params]
+        cleaned = time.perf_counter()
 
-        timestamp = utils.get_timestamp()  # local time
-        # timestamp = self._get_timestamp()  # server time
+        if self.clock is not None:
+            timestamp = self.clock.timestamp()  # server time, from the background offset estimate
+        else:
+            timestamp = utils.get_timestamp()  # local time
 
         if instruction:  # Authenticated Endpoints
             if isinstance(params, dict):
                 str_to_sign = utils.pre_hash(instruction, params, timestamp, self.window)
             else:  # For batch orders execution
                 str_to_sign = utils.pre_hash_batch_orders(instruction, params, timestamp, self.window)
-            sign = utils.sign(str_to_sign, self.API_SECRET)
-            header = utils.get_header(self.API_KEY, sign, timestamp, self.window)
+            sign = self.signer.sign(str_to_sign)
+            header = self.signer.get_header(sign, timestamp)
         else:  # Public Endpoints
             header = {}
 
-        # print("url:", url)
-        # print("headers:", header)
+        if self.metrics is not None:
+            self.metrics.observe('request_seconds', cleaned - started, endpoint=endpoint, stage='clean')
+            self.metrics.observe('request_seconds', time.perf_counter() - cleaned, endpoint=endpoint, stage='sign')
+
+        return url, header, params
 
+    # Query string for GET, body encoded with self.codec otherwise
+    def _request_kwargs(self, method, url, header, params):
         if method == c.GET:
-            response = self.client.request(method=method, url=url, headers=header, params=params)
-        else:
-            response = self.client.request(method=method, url=url, headers=header, json=params)
+            return {'method': method, 'url': url, 'headers': header, 'params': params}
+        header[c.CONTENT_TYPE] = c.APPLICATION_JSON
+        return {'method': method, 'url': url, 'headers': header, 'content': self.codec.dumps(params)}
 
-        # exception handle
-        # print(response.headers)
+    def _parse_response(self, response, endpoint=None):
 
-        response.raise_for_status()
+        if self.metrics is not None:
+            self.metrics.inc('responses_total', endpoint=endpoint, status=response.status_code)
+        started = time.perf_counter()
+        try:
+            response.raise_for_status()
 
-        if not response.content:
-            if str(response.status_code).startswith('2'):
-                return 'success'
+            if not response.content:
+                if str(response.status_code).startswith('2'):
+                    return 'success'
+                else:
+                    return None
             else:
-                return None
-        else:
+                try:
+                    return self.codec.loads(response.content)
+                except codec.DECODE_ERRORS:
+                    return response.text
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe('request_seconds', time.perf_counter() - started, endpoint=endpoint, stage='decode')
+
+    # On 429 the limiter stops every lane for Retry-After seconds (1 s when absent)
+    def _check_throttled(self, response):
+        if response.status_code == 429 and self.rate_limiter is not None:
             try:
-                return response.json()
-            except json.decoder.JSONDecodeError:
-                return response.text
+                retry_after = float(response.headers.get('Retry-After') or 1)
+            except ValueError:
+                retry_after = 1.0
+            self.rate_limiter.pause(retry_after)
+
+    # Times the network round trip and counts transport errors
+    def _observe_network(self, endpoint, started, error=None):
+        if self.metrics is None:
+            return
+        self.metrics.observe('request_seconds', time.perf_counter() - started, endpoint=endpoint, stage='network')
+        if error is not None:
+            self.metrics.inc('request_errors_total', endpoint=endpoint, error=type(error).__name__)
+
+    def _request(self, instruction, method, request_path, params):
+
+        endpoint = method + ' ' + request_path
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(method, request_path, params)  # before signing, so the timestamp is fresh
+        url, header, params = self._prepare(instruction, request_path, params, endpoint)
+
+        started = time.perf_counter()
+        self.last_used = time.monotonic()
+        try:
+            response = self.client.request(**self._request_kwargs(method, url, header, params))
+        except httpx.HTTPError as e:
+            self._observe_network(endpoint, started, e)
+            raise
+        self._observe_network(endpoint, started)
+        self._check_throttled(response)
+
+        result = self._parse_response(response, endpoint)
+        return models.parse(method, request_path, result) if self.typed else result
 
     def _request_without_params(self, instruction, method, request_path):
         return self._request(instruction, method, request_path, {})
@@ -64,10 +141,161 @@ class Client(object):
     def _request_with_params(self, instruction, method, request_path, params):
         return self._request(instruction, method, request_path, params)
 
+    def _paginate(self, method, **kwargs):
+        return pagination.paginate(method, **kwargs)
+
     def _get_timestamp(self):
-        url = c.API_URL + c.SYSTEM_TIME.path
+        url = self.base_url + c.SYSTEM_TIME.path
         response = self.client.get(url)
         if response.status_code == 200:
             return response.text
         else:
             return ""
+
+    # Runs zero-argument callables (e.g. functools.partial(api.get_orders, orderId=...)) concurrently, so the
+    # requests go out as parallel streams of the pooled HTTP/2 connection; returns the results in call order
+    def gather(self, *calls, return_exceptions=False):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=c.FANOUT_WORKERS,
+                                                                   thread_name_prefix='client-gather')
+        futures = [self._executor.submit(call) for call in calls]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    # Unsigned GET /api/v1/ping outside the rate limiter, timed as the network stage of its endpoint
+    def _ping(self):
+        endpoint = c.PING.method + ' ' + c.PING.path
+        started = time.perf_counter()
+        self.last_used = time.monotonic()
+        try:
+            self.client.get(self.base_url + c.PING.path)
+        except httpx.HTTPError as e:
+            self._observe_network(endpoint, started, e)
+            raise
+        self._observe_network(endpoint, started)
+
+    # Opens the connection (DNS, TCP, TLS, HTTP/2 settings) before the first real request needs it
+    def prewarm(self):
+        self._ping()
+
+    # Pings every `interval` seconds of idleness from a daemon thread, so the pooled connection is still
+    # open when a fill arrives after a quiet period
+    def start_keepalive(self, interval=c.KEEPALIVE_INTERVAL):
+        if self._keepalive is not None:
+            return
+        self._keepalive = threading.Event()
+        threading.Thread(target=self._keepalive_forever, args=(self._keepalive, interval), name='client-keepalive',
+                         daemon=True).start()
+
+    def stop_keepalive(self):
+        if self._keepalive is not None:
+            self._keepalive.set()
+            self._keepalive = None
+
+    def _keepalive_forever(self, stop, interval):
+        while not stop.wait(max(interval - (time.monotonic() - self.last_used), 0.1)):
+            if time.monotonic() - self.last_used < interval:
+                continue
+            try:
+                self._ping()
+            except httpx.HTTPError:
+                pass  # counted in request_errors_total, the next ping reconnects
+
+    def close(self):
+        self.stop_keepalive()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self.client.close()
+
+
+class AsyncClient(Client):
+    '''
+    asyncio twin of Client. Every endpoint method inherited from AuthAPI / PublicAPI
+    returns a coroutine, since they all end up in _request.
+    '''
+
+    def _create_http_client(self, proxy):
+        return httpx.AsyncClient(http2=True, proxy=proxy, limits=self.limits)
+
+    async def _request(self, instruction, method, request_path, params):
+
+        endpoint = method + ' ' + request_path
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(method, request_path, params)  # before signing, so the timestamp is fresh
+        url, header, params = self._prepare(instruction, request_path, params, endpoint)
+
+        started = time.perf_counter()
+        self.last_used = time.monotonic()
+        try:
+            response = await self.client.request(**self._request_kwargs(method, url, header, params))
+        except httpx.HTTPError as e:
+            self._observe_network(endpoint, started, e)
+            raise
+        self._observe_network(endpoint, started)
+        self._check_throttled(response)
+
+        result = self._parse_response(response, endpoint)
+        return models.parse(method, request_path, result) if self.typed else result
+
+    def _paginate(self, method, **kwargs):
+        return pagination.apaginate(method, **kwargs)
+
+    async def _get_timestamp(self):
+        url = self.base_url + c.SYSTEM_TIME.path
+        response = await self.client.get(url)
+        if response.status_code == 200:
+            return response.text
+        else:
+            return ""
+
+    # Awaits endpoint calls (coroutines, or zero-argument callables returning one) concurrently on the
+    # pooled HTTP/2 connection, results in call order
+    async def gather(self, *calls, return_exceptions=False):
+        return await asyncio.gather(*[call() if callable(call) else call for call in calls],
+                                    return_exceptions=return_exceptions)
+
+    async def _ping(self):
+        endpoint = c.PING.method + ' ' + c.PING.path
+        started = time.perf_counter()
+        self.last_used = time.monotonic()
+        try:
+            await self.client.get(self.base_url + c.PING.path)
+        except httpx.HTTPError as e:
+            self._observe_network(endpoint, started, e)
+            raise
+        self._observe_network(endpoint, started)
+
+    async def prewarm(self):
+        await self._ping()
+
+    # Same as Client.start_keepalive as a task of the running event loop
+    def start_keepalive(self, interval=c.KEEPALIVE_INTERVAL):
+        if self._keepalive is not None and not self._keepalive.done():
+            return
+        self._keepalive = asyncio.ensure_future(self._keepalive_forever(interval))
+
+    def stop_keepalive(self):
+        if self._keepalive is not None:
+            self._keepalive.cancel()
+            self._keepalive = None
+
+    async def _keepalive_forever(self, interval):
+        while True:
+            await asyncio.sleep(max(interval - (time.monotonic() - self.last_used), 0.1))
+            if time.monotonic() - self.last_used < interval:
+                continue
+            try:
+                await self._ping()
+            except httpx.HTTPError:
+                pass
+
+    async def close(self):
+        self.stop_keepalive()
+        await self.client.aclose()
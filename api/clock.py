@@ -0,0 +1,58 @@
+import time
+import threading
+from collections import deque
+
+
+class ClockSync(object):
+    '''
+    Estimates the offset between the local clock and the exchange clock from
+    /api/v1/time samples (NTP style: offset = server - (t0 + t1) / 2), keeping
+    the sample with the lowest round trip out of the recent ones.
+    timestamp() is a local read, so request signing pays nothing for it.
+    public_api must be a (sync) PublicAPI.
+    '''
+
+    def __init__(self, public_api, interval=60, samples=8):
+        self.public_api = public_api
+        self.interval = interval
+        self.offset = 0.0  # ms, server - local
+        self.rtt = None  # ms, round trip of the sample the offset comes from
+        self._samples = deque(maxlen=samples)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def timestamp(self):
+        return int(time.time() * 1000 + self.offset)
+
+    def sample(self):
+        t0 = time.time() * 1000
+        server_time = float(self.public_api.get_system_time())
+        t1 = time.time() * 1000
+        self._samples.append((t1 - t0, server_time - (t0 + t1) / 2))
+        self.rtt, self.offset = min(self._samples)
+        return self.offset
+
+    def sync(self, count=4):
+        # A short burst at startup so the first estimate is already a good one
+        for _ in range(count):
+            self.sample()
+        return self.offset
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='clock-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                print(f'Clock sync failed: {e}')
+            self._stop.wait(self.interval)
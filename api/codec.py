@@ -0,0 +1,70 @@
+import json
+from collections import namedtuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+# Installed backends, fastest first
+BACKENDS = tuple(name for name, module in (('orjson', orjson), ('msgspec', msgspec)) if module is not None) + ('json',)
+
+# Raised by loads() on invalid input, whichever backend is used
+DECODE_ERRORS = (ValueError,) + ((msgspec.DecodeError,) if msgspec is not None else ())
+
+# account.orderUpdate fields, in the exchange's one-letter keys
+ORDER_UPDATE_KEYS = ('e', 'E', 's', 'c', 'S', 'o', 'f', 'q', 'Q', 'p', 'P', 'X', 'i', 'z', 'Z',
+                     't', 'L', 'l', 'n', 'N', 'm', 'V', 'O', 'T')
+# Numbers stay strings as sent by the exchange, fields missing from the event are None
+OrderUpdate = namedtuple('OrderUpdate', ['event', 'event_time', 'symbol', 'client_id', 'side', 'order_type',
+                                         'time_in_force', 'quantity', 'quote_quantity', 'price', 'trigger_price',
+                                         'status', 'order_id', 'executed_quantity', 'executed_quote_quantity',
+                                         'trade_id', 'fill_price', 'fill_quantity', 'fee', 'fee_symbol', 'is_maker',
+                                         'self_trade_prevention', 'origin', 'engine_time'])
+
+
+def order_update(data):
+    return OrderUpdate(*[data.get(key) for key in ORDER_UPDATE_KEYS])
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+class Codec(object):
+    '''
+    JSON encoding for request bodies, responses and WebSocket frames, backed
+    by the fastest library installed (see BACKENDS) unless one is named.
+    dumps() returns bytes, loads() takes bytes or str.
+    '''
+
+    def __init__(self, backend=None):
+        self.name = backend or BACKENDS[0]
+        if self.name not in BACKENDS:
+            raise ValueError(f'JSON backend {self.name} is not installed, available: {", ".join(BACKENDS)}')
+        if self.name == 'orjson':
+            self.dumps, self.loads = orjson.dumps, orjson.loads
+        elif self.name == 'msgspec':
+            self.dumps, self.loads = msgspec.json.encode, msgspec.json.decode
+        else:
+            self.dumps, self.loads = _json_dumps, json.loads
+
+    # One WebSocket frame -> (stream, data), account.orderUpdate data as an OrderUpdate
+    def decode_frame(self, message):
+        frame = self.loads(message)
+        stream, data = frame.get('stream'), frame.get('data')
+        if data and stream and stream.startswith('account.orderUpdate'):
+            data = order_update(data)
+        return stream, data
+
+    def __repr__(self):
+        return f'Codec({self.name!r})'
+
+
+default = Codec()
@@ -2,6 +2,7 @@ from collections import namedtuple
 
 
 API_URL = 'https://api.backpack.exchange'
+WS_URL = 'wss://ws.backpack.exchange'
 
 CONTENT_TYPE = 'Content-Type'
 X_API_KEY = 'X-API-KEY'
@@ -12,6 +13,24 @@ DEFAULT_WINDOW = '5000'
 
 APPLICATION_JSON = 'application/json'
 
+# Max orders accepted by one batch order request
+BATCH_ORDER_LIMIT = 20
+# Max items per page of the history endpoints
+HISTORY_PAGE_LIMIT = 1000
+# Max bars returned by one k-lines request
+K_LINES_LIMIT = 1000
+# Connection pool: concurrent requests share HTTP/2 connections, idle ones are kept this many seconds
+MAX_CONNECTIONS = 10
+MAX_KEEPALIVE_CONNECTIONS = 5
+KEEPALIVE_EXPIRY = 120
+# Idle seconds between keepalive pings, below KEEPALIVE_EXPIRY and the server's idle timeout
+KEEPALIVE_INTERVAL = 30
+# Threads used by Client.gather
+FANOUT_WORKERS = 16
+# K-line interval lengths in seconds
+KLINE_INTERVALS = {'1m': 60, '3m': 180, '5m': 300, '15m': 900, '30m': 1800, '1h': 3600, '2h': 7200, '4h': 14400,
+                   '6h': 21600, '8h': 28800, '12h': 43200, '1d': 86400, '3d': 259200, '1w': 604800}
+
 # Endpoint Type
 PUBLIC = 'public'
 AUTH = 'Authenticated'
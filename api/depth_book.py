@@ -0,0 +1,256 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from sortedcontainers import SortedDict
+import websockets
+from . import codec
+from . import consts as c
+from . import metrics
+
+
+class SequenceGap(Exception):
+    '''
+    A depth update does not continue from the last applied update id.
+    '''
+
+
+class DepthBook(object):
+    '''
+    Local L2 order book of one symbol: a get_depth snapshot kept current by
+    the depth.<symbol> stream. Levels live in SortedDicts (price -> quantity),
+    so an update is O(log n) and the best bid/ask is O(1).
+    Every update carries the id range [U, u]; an update that does not start
+    right after the last applied id means events were lost, and the book is
+    rebuilt from a new snapshot. start() runs the subscriber in a daemon
+    thread with its own connection; a caller that already holds a connection
+    subscribes depth.<symbol> there instead, passes each event to on_event()
+    and awaits resync() after (re)subscribing and whenever on_event() asks
+    for it. All queries are safe to call from other threads.
+    A book without a snapshot, or without any event for stale_after seconds,
+    is stale: crosses() then answers False instead of trusting old prices.
+    '''
+
+    def __init__(self, symbol, public_api, ws_url=None, stale_after=30, proxy=None,
+                 metrics_registry=metrics.registry):
+        self.symbol = symbol
+        self.public_api = public_api
+        self.ws_url = ws_url or c.WS_URL
+        self.stale_after = stale_after
+        self.proxy = proxy
+        self.metrics = metrics_registry
+        self.bids = SortedDict()
+        self.asks = SortedDict()
+        self.last_update_id = None  # None until a snapshot is loaded
+        self.updated_at = None  # time.monotonic() of the last snapshot or event
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._loop = None
+        self._task = None
+        self._pending = None  # events received while a snapshot is loading, None when not resyncing
+
+    # True once a snapshot is loaded and no gap was seen since
+    @property
+    def synced(self):
+        return self.last_update_id is not None
+
+    # True when the book is not synced or has heard nothing for stale_after seconds
+    def is_stale(self):
+        updated_at = self.updated_at
+        return not self.synced or updated_at is None or time.monotonic() - updated_at > self.stale_after
+
+    def reset(self):
+        with self._lock:
+            self.bids.clear()
+            self.asks.clear()
+            self.last_update_id = None
+            self.updated_at = None
+
+    # Replaces the book with a get_depth response
+    def load_snapshot(self, snapshot):
+        with self._lock:
+            self.bids.clear()
+            self.asks.clear()
+            self._update(self.bids, snapshot.get('bids') or [])
+            self._update(self.asks, snapshot.get('asks') or [])
+            self.last_update_id = int(snapshot['lastUpdateId'])
+            self.updated_at = time.monotonic()
+
+    # Applies one depth event, returns False if the snapshot already contains it
+    def apply(self, data):
+        first, last = int(data['U']), int(data['u'])
+        with self._lock:
+            if self.last_update_id is None:
+                raise SequenceGap(f'{self.symbol} depth update {first}-{last} before a snapshot')
+            if last <= self.last_update_id:
+                self.updated_at = time.monotonic()  # already contained, but the stream is alive
+                return False
+            if first > self.last_update_id + 1:
+                expected = self.last_update_id + 1
+                self.last_update_id = None
+                raise SequenceGap(f'{self.symbol} depth update {first}-{last}, expected {expected}')
+            self._update(self.bids, data.get('b') or [])
+            self._update(self.asks, data.get('a') or [])
+            self.last_update_id = last
+            self.updated_at = time.monotonic()
+        return True
+
+    @staticmethod
+    def _update(levels, changes):
+        for price, quantity in changes:
+            price, quantity = float(price), float(quantity)
+            if quantity:
+                levels[price] = quantity
+            else:
+                levels.pop(price, None)
+
+    # Queries, prices and quantities are floats, None when the side is empty
+
+    def best_bid(self):
+        with self._lock:
+            return self.bids.peekitem(-1)[0] if self.bids else None
+
+    def best_ask(self):
+        with self._lock:
+            return self.asks.peekitem(0)[0] if self.asks else None
+
+    def spread(self):
+        with self._lock:
+            if not (self.bids and self.asks):
+                return None
+            return self.asks.peekitem(0)[0] - self.bids.peekitem(-1)[0]
+
+    def mid(self):
+        with self._lock:
+            if not (self.bids and self.asks):
+                return None
+            return (self.asks.peekitem(0)[0] + self.bids.peekitem(-1)[0]) / 2
+
+    # Top `limit` levels of a side ('Bid' or 'Ask') as (price, quantity), best first
+    def levels(self, side, limit=None):
+        with self._lock:
+            if side == 'Bid':
+                return list(self.bids.items()[::-1][:limit])
+            return list(self.asks.items()[:limit])
+
+    # Total quantity resting between the best price of `side` and `price` (inclusive)
+    def depth(self, side, price):
+        with self._lock:
+            if side == 'Bid':
+                return sum(self.bids[each] for each in self.bids.irange(minimum=price))
+            return sum(self.asks[each] for each in self.asks.irange(maximum=price))
+
+    # Price at which `quantity` is filled walking `side` from the best level, None if the side is too thin
+    def price_for(self, side, quantity):
+        with self._lock:
+            levels = reversed(self.bids.items()) if side == 'Bid' else iter(self.asks.items())
+            total = 0.0
+            for price, size in levels:
+                total += size
+                if total >= quantity:
+                    return price
+            return None
+
+    # True if a limit order of `side` at `price` would take liquidity instead of resting,
+    # False when the book is stale and cannot tell
+    def crosses(self, side, price):
+        if self.is_stale():
+            return False
+        with self._lock:
+            if side == 'Bid':
+                return bool(self.asks) and price >= self.asks.peekitem(0)[0]
+            return bool(self.bids) and price <= self.bids.peekitem(-1)[0]
+
+    # Feed
+
+    # Applies one event of the depth.<symbol> stream, returns True if the book must be resynced
+    def on_event(self, data):
+        if self._pending is not None:
+            self._pending.append(data)
+            return False
+        try:
+            self.apply(data)
+        except SequenceGap as e:
+            print(f'{e}, reloading snapshot')
+            return True
+        return False
+
+    # Loads a new snapshot, then replays the events that arrived meanwhile
+    async def resync(self, attempts=3):
+        if self._pending is not None:
+            return  # already resyncing
+        if self.metrics is not None:
+            self.metrics.inc('depth_resyncs_total', symbol=self.symbol)
+        self._pending = []
+        try:
+            for _ in range(attempts):
+                snapshot = await asyncio.get_running_loop().run_in_executor(None, self.public_api.get_depth,
+                                                                            self.symbol)
+                self.load_snapshot(snapshot)
+                try:
+                    for data in self._pending:
+                        self.apply(data)
+                    return
+                except SequenceGap as e:
+                    print(f'{e}, reloading snapshot')
+                finally:
+                    self._pending.clear()
+            self.reset()
+        finally:
+            self._pending = None
+
+    # Subscriber
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f'depth-{self.symbol}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._loop is not None and self._task is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        self._thread = None
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._task = self._loop.create_task(self._listen_forever())
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    async def _listen_forever(self):
+        delay = 1
+        while not self._stop.is_set():
+            try:
+                kwargs = {'proxy': self.proxy} if self.proxy else {}
+                async with websockets.connect(self.ws_url, **kwargs) as ws:
+                    await ws.send(json.dumps({'method': 'SUBSCRIBE', 'params': [f'depth.{self.symbol}']}))
+                    # Events arriving while the snapshot loads wait in the websocket's receive buffer
+                    await self.resync()
+                    delay = 1
+                    while not self._stop.is_set():
+                        message = await asyncio.wait_for(ws.recv(), self.stale_after)
+                        data = codec.default.loads(message).get('data')
+                        if not data or data.get('e') != 'depth':
+                            continue
+                        if self.on_event(data):
+                            await self.resync()
+            except asyncio.TimeoutError:
+                print(f'{self.symbol} depth silent for {self.stale_after}s, reconnecting')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f'{self.symbol} depth connection error: {e}')
+            self.reset()
+            if self._stop.is_set():
+                break
+            await asyncio.sleep(delay * (0.5 + random.random()))
+            delay = min(delay * 2, 30)
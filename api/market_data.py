@@ -0,0 +1,150 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import namedtuple
+import websockets
+from . import codec
+from . import consts as c
+
+
+# price: last trade (mid of the book until the first trade), event_time: exchange time in us, received: time.monotonic()
+Quote = namedtuple('Quote', ['price', 'bid', 'ask', 'event_time', 'received'])
+
+
+class MarketDataFeed(object):
+    '''
+    Subscriber for the public trade.<symbol> and bookTicker.<symbol> streams,
+    running its own event loop in a daemon thread so the sync bots can use it.
+    The latest values live in one immutable Quote that is replaced as a whole:
+    reading `quote` takes no lock and never sees a half-updated value.
+    wait() blocks until a newer quote arrives. The connection is re-opened
+    with backoff, and a feed silent for stale_after seconds is reported
+    through on_stale (and on_recover once data flows again).
+    '''
+
+    def __init__(self, symbol, ws_url=None, stale_after=30, on_stale=None, on_recover=None, proxy=None):
+        self.symbol = symbol
+        self.ws_url = ws_url or c.WS_URL
+        self.stale_after = stale_after
+        self.on_stale = on_stale
+        self.on_recover = on_recover
+        self.proxy = proxy
+        self.quote = None
+        self.version = 0
+        self.stale = None  # None until the first connect attempt ends either way
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._loop = None
+        self._task = None
+        self._handlers = {'trade': self._on_trade, 'bookTicker': self._on_book_ticker}  # event type (e) -> handler
+
+    @property
+    def price(self):
+        quote = self.quote
+        return quote.price if quote is not None else None
+
+    # True when nothing arrived for stale_after seconds (or nothing at all yet)
+    def is_stale(self):
+        quote = self.quote
+        return quote is None or time.monotonic() - quote.received > self.stale_after
+
+    # Blocks until version moves past `version` or timeout, returns the current version
+    def wait(self, version, timeout=None):
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != version or self._stop.is_set(), timeout)
+            return self.version
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f'market-data-{self.symbol}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._loop is not None and self._task is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        with self._condition:
+            self._condition.notify_all()
+        self._thread = None
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._task = self._loop.create_task(self._listen_forever())
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    async def _listen_forever(self):
+        delay = 1
+        while not self._stop.is_set():
+            try:
+                kwargs = {'proxy': self.proxy} if self.proxy else {}
+                async with websockets.connect(self.ws_url, **kwargs) as ws:
+                    params = [f'trade.{self.symbol}', f'bookTicker.{self.symbol}']
+                    await ws.send(json.dumps({'method': 'SUBSCRIBE', 'params': params}))
+                    delay = 1
+                    while not self._stop.is_set():
+                        message = await asyncio.wait_for(ws.recv(), self.stale_after)
+                        data = codec.default.loads(message).get('data')
+                        if data:
+                            self._on_message(data)
+            except asyncio.TimeoutError:
+                print(f'{self.symbol} market data silent for {self.stale_after}s, reconnecting')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f'{self.symbol} market data connection error: {e}')
+            self._set_stale(True)
+            if self._stop.is_set():
+                break
+            await asyncio.sleep(delay * (0.5 + random.random()))
+            delay = min(delay * 2, 30)
+
+    def _on_message(self, data):
+        handler = self._handlers.get(data.get('e'))
+        if handler is None:
+            return
+        previous = self.quote
+        price, bid, ask = (previous.price, previous.bid, previous.ask) if previous is not None else (None, None, None)
+        price, bid, ask = handler(data, price, bid, ask)
+        if price is None:
+            return
+        quote = Quote(price, bid, ask, int(data.get('E') or 0), time.monotonic())
+        with self._condition:
+            self.quote = quote
+            self.version += 1
+            self._condition.notify_all()
+        self._set_stale(False)
+
+    @staticmethod
+    def _on_trade(data, price, bid, ask):
+        return float(data['p']), bid, ask
+
+    @staticmethod
+    def _on_book_ticker(data, price, bid, ask):
+        bid = float(data['b']) if data.get('b') is not None else None
+        ask = float(data['a']) if data.get('a') is not None else None
+        if price is None and bid is not None and ask is not None:
+            price = (bid + ask) / 2
+        return price, bid, ask
+
+    def _set_stale(self, stale):
+        if stale == self.stale:
+            return
+        previous, self.stale = self.stale, stale
+        if previous is None and not stale:
+            return  # first data after start, nothing to recover from
+        callback = self.on_stale if stale else self.on_recover
+        if callback is not None:
+            try:
+                callback()
+            except Exception as e:
+                print(f'{self.symbol} market data callback error: {e}')
@@ -0,0 +1,118 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class MarketCache(object):
+    '''
+    Symbol -> market map built from PublicAPI.get_markets and kept in a local
+    JSON file, so startup reads tickSize / stepSize from disk instead of
+    waiting on the exchange. An entry older than ttl seconds is still served
+    and refreshed in the background; start() refreshes periodically and
+    on_change callbacks fire when a market's filters or state change.
+    public_api must be a (sync) PublicAPI.
+    '''
+
+    def __init__(self, public_api, path='.markets_cache.json', ttl=3600):
+        self.public_api = public_api
+        self.path = path
+        self.ttl = ttl
+        self.markets = {}
+        self.updated_at = 0.0  # time.time() of the last successful get_markets
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._stop = threading.Event()
+        self._thread = None
+        self.load()
+
+    # Reads the local copy, a missing or corrupt file leaves the cache empty
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.markets = data['markets']
+            self.updated_at = float(data['updatedAt'])
+        except (OSError, ValueError, KeyError, TypeError):
+            self.markets, self.updated_at = {}, 0.0
+        return self.markets
+
+    def is_stale(self):
+        return time.time() - self.updated_at > self.ttl
+
+    # Fetches all markets, writes the file atomically and notifies listeners of changed symbols
+    def refresh(self):
+        markets = {each['symbol']: each for each in self.public_api.get_markets()}
+        with self._lock:
+            previous, self.markets, self.updated_at = self.markets, markets, time.time()
+        self._save()
+        for symbol, market in markets.items():
+            old = previous.get(symbol)
+            if old is not None and (old.get('filters'), old.get('orderBookState')) != \
+                    (market.get('filters'), market.get('orderBookState')):
+                for callback in self._listeners:
+                    callback(symbol, old, market)
+        return markets
+
+    def _save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.markets-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'updatedAt': self.updated_at, 'markets': self.markets}, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    # Returns the market of symbol; only blocks when the symbol is not cached yet
+    def get(self, symbol):
+        market = self.markets.get(symbol)
+        if market is None:
+            self.refresh()
+            market = self.markets.get(symbol)
+            if market is None:
+                raise KeyError(f'Unknown market: {symbol}')
+        elif self.is_stale():
+            self.refresh_in_background()
+        return market
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_once, name='market-cache-refresh', daemon=True).start()
+
+    def _refresh_once(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f'Market cache refresh failed: {e}')
+        finally:
+            self._refreshing = False
+
+    # Registers callback(symbol, old_market, new_market)
+    def on_change(self, callback):
+        self._listeners.append(callback)
+
+    def start(self, interval=None):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval or self.ttl,), name='market-cache',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def _run(self, interval):
+        # First pass right away: a copy loaded from disk is validated against the exchange
+        while not self._stop.is_set():
+            self._refresh_once()
+            self._stop.wait(interval)
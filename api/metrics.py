@@ -0,0 +1,167 @@
+import bisect
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Latency buckets in seconds, 50us .. 10s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram(object):
+    '''
+    Fixed-bucket histogram: observe() is a bisect and two additions, the
+    quantiles reported by dump() are interpolated within the buckets.
+    '''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Estimates the q-quantile (0 < q < 1) from the bucket counts
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Metrics(object):
+    '''
+    Registry of histograms, counters and gauges keyed by (name, labels). The api
+    clients record into the module level `registry`; set Client.metrics to
+    None to turn instrumentation off for one client.
+    '''
+
+    def __init__(self, prefix='backpack'):
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    # Records one observation, e.g. observe('request_seconds', 0.12, endpoint='GET /api/v1/depth', stage='network')
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted((label, str(each)) for label, each in labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    # Increments a counter
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted((label, str(each)) for label, each in labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    # Sets a gauge to the current value of something, e.g. a queue length
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted((label, str(each)) for label, each in labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+    # Prometheus text exposition format
+    def to_prometheus(self):
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+        lines = []
+        typed = set()
+        for (name, labels), histogram in histograms:
+            metric = f'{self.prefix}_{name}'
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f'# TYPE {metric} histogram')
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{metric}_sum{_format_labels(labels)} {histogram.sum}')
+            lines.append(f'{metric}_count{_format_labels(labels)} {histogram.count}')
+        for (name, labels), value in counters:
+            metric = f'{self.prefix}_{name}'
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric}{_format_labels(labels)} {value}')
+        for (name, labels), value in gauges:
+            metric = f'{self.prefix}_{name}'
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    # Human readable summary: count, mean, p50 and p99 in ms per histogram, then the counters and gauges
+    def dump(self):
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(list(self.counters.items()) + list(self.gauges.items()))
+        lines = []
+        for (name, labels), histogram in histograms:
+            mean = histogram.sum / histogram.count * 1000 if histogram.count else 0.0
+            lines.append(f'{name}{_format_labels(labels)} count={histogram.count} mean={mean:.3f}ms '
+                         f'p50={histogram.quantile(0.5) * 1000:.3f}ms p99={histogram.quantile(0.99) * 1000:.3f}ms')
+        for (name, labels), value in counters:
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+        return '\n'.join(lines)
+
+    # Prints dump() whenever the process receives the signal (kill -USR1 <pid>), POSIX only
+    def dump_on_signal(self, signum=getattr(signal, 'SIGUSR1', None)):
+        if signum is None:
+            return
+        signal.signal(signum, lambda signum, frame: print(self.dump(), flush=True))
+
+    # Serves to_prometheus() on http://host:port/metrics from a daemon thread
+    def serve(self, port, host='0.0.0.0'):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                content = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+        return server
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+# Shared by every client unless one is given its own
+registry = Metrics()
@@ -0,0 +1,232 @@
+from decimal import Decimal
+from . import consts as c
+
+
+def _identity(value):
+    return value
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+def _int(value):
+    return int(value) if value is not None else None
+
+
+def _decimal(value):
+    return Decimal(value) if value is not None else None
+
+
+def _str(value):
+    return str(value) if value is not None else None
+
+
+def _number_str(value):
+    # float -> exchange style string without exponent: 150.5 -> '150.5', 1.0 -> '1', 1e-05 -> '0.00001'
+    if value is None:
+        return None
+    if isinstance(value, float):
+        return format(Decimal(repr(value)).normalize(), 'f')
+    return str(value)
+
+
+class Model(object):
+    '''
+    Base of the typed return models. FIELDS lists (attribute, key, parse),
+    every number is parsed once when the model is built and stored in a slot,
+    so a model holds no dict and no strings for its numbers.
+    to_dict() rebuilds the exchange's format for code that wants raw dicts.
+    '''
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init__(self, **kwargs):
+        for attribute, _, _ in self.FIELDS:
+            setattr(self, attribute, kwargs.get(attribute))
+
+    @classmethod
+    def from_dict(cls, data):
+        model = cls.__new__(cls)
+        for attribute, key, parse in cls.FIELDS:
+            setattr(model, attribute, parse(data.get(key)))
+        return model
+
+    def to_dict(self):
+        return {key: _number_str(getattr(self, attribute)) if parse in (_float, _decimal) else getattr(self, attribute)
+                for attribute, key, parse in self.FIELDS}
+
+    # Parsed value by the exchange's key, so code written for raw dicts (e.g. pagination cursors) keeps working
+    def get(self, key, default=None):
+        for attribute, each, _ in self.FIELDS:
+            if each == key:
+                value = getattr(self, attribute)
+                return default if value is None else value
+        return default
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, each[0]) == getattr(other, each[0]) for each in self.FIELDS)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{each[0]}={getattr(self, each[0])!r}' for each in self.FIELDS)})"
+
+
+class Order(Model):
+    '''
+    An order as returned by the order endpoints, prices and quantities as float.
+    '''
+
+    FIELDS = (('id', 'id', _str), ('client_id', 'clientId', _int), ('symbol', 'symbol', _identity),
+              ('side', 'side', _identity), ('order_type', 'orderType', _identity),
+              ('time_in_force', 'timeInForce', _identity), ('price', 'price', _float),
+              ('trigger_price', 'triggerPrice', _float), ('quantity', 'quantity', _float),
+              ('quote_quantity', 'quoteQuantity', _float), ('executed_quantity', 'executedQuantity', _float),
+              ('executed_quote_quantity', 'executedQuoteQuantity', _float), ('status', 'status', _identity),
+              ('post_only', 'postOnly', _identity), ('reduce_only', 'reduceOnly', _identity),
+              ('created_at', 'createdAt', _identity))
+    __slots__ = tuple(each[0] for each in FIELDS)
+
+    @property
+    def remaining_quantity(self):
+        return (self.quantity or 0.0) - (self.executed_quantity or 0.0)
+
+
+class Fill(Model):
+    '''
+    One fill of the fill history, timestamp kept as the exchange's ISO string.
+    '''
+
+    FIELDS = (('trade_id', 'tradeId', _int), ('order_id', 'orderId', _str), ('client_id', 'clientId', _int),
+              ('symbol', 'symbol', _identity), ('side', 'side', _identity), ('price', 'price', _float),
+              ('quantity', 'quantity', _float), ('fee', 'fee', _float), ('fee_symbol', 'feeSymbol', _identity),
+              ('is_maker', 'isMaker', _identity), ('system_order_type', 'systemOrderType', _identity),
+              ('timestamp', 'timestamp', _identity))
+    __slots__ = tuple(each[0] for each in FIELDS)
+
+
+class Balance(Model):
+    '''
+    Spot balance of one asset, get_balances returns {asset: Balance}.
+    '''
+
+    FIELDS = (('available', 'available', _float), ('locked', 'locked', _float), ('staked', 'staked', _float))
+    __slots__ = tuple(each[0] for each in FIELDS)
+
+    @property
+    def total(self):
+        return (self.available or 0.0) + (self.locked or 0.0)
+
+
+class CollateralAsset(Model):
+    '''
+    One asset line of get_collaterals.
+    '''
+
+    FIELDS = (('symbol', 'symbol', _identity), ('asset_mark_price', 'assetMarkPrice', _float),
+              ('total_quantity', 'totalQuantity', _float), ('available_quantity', 'availableQuantity', _float),
+              ('lend_quantity', 'lendQuantity', _float), ('open_order_quantity', 'openOrderQuantity', _float),
+              ('balance_notional', 'balanceNotional', _float), ('collateral_weight', 'collateralWeight', _float),
+              ('collateral_value', 'collateralValue', _float))
+    __slots__ = tuple(each[0] for each in FIELDS)
+
+
+class Collateral(Model):
+    '''
+    Account margin summary of get_collaterals, assets maps symbol -> CollateralAsset.
+    '''
+
+    FIELDS = (('assets_value', 'assetsValue', _float), ('borrow_liability', 'borrowLiability', _float),
+              ('liabilities_value', 'liabilitiesValue', _float), ('imf', 'imf', _float), ('mmf', 'mmf', _float),
+              ('margin_fraction', 'marginFraction', _float), ('net_equity', 'netEquity', _float),
+              ('net_equity_available', 'netEquityAvailable', _float), ('net_equity_locked', 'netEquityLocked', _float),
+              ('net_exposure_futures', 'netExposureFutures', _float), ('pnl_unrealized', 'pnlUnrealized', _float),
+              ('unsettled_equity', 'unsettledEquity', _float))
+    __slots__ = tuple(each[0] for each in FIELDS) + ('assets',)
+
+    def __init__(self, assets=None, **kwargs):
+        Model.__init__(self, **kwargs)
+        self.assets = assets or {}
+
+    @classmethod
+    def from_dict(cls, data):
+        model = super(Collateral, cls).from_dict(data)
+        model.assets = {each['symbol']: CollateralAsset.from_dict(each) for each in data.get('collateral') or []}
+        return model
+
+    def to_dict(self):
+        data = Model.to_dict(self)
+        data['collateral'] = [each.to_dict() for each in self.assets.values()]
+        return data
+
+
+class Market(Model):
+    '''
+    A market with its price / quantity filters flattened, filters as Decimal
+    since order prices and sizes must be exact multiples of them.
+    '''
+
+    FIELDS = (('symbol', 'symbol', _identity), ('base_symbol', 'baseSymbol', _identity),
+              ('quote_symbol', 'quoteSymbol', _identity), ('market_type', 'marketType', _identity),
+              ('order_book_state', 'orderBookState', _identity), ('created_at', 'createdAt', _identity),
+              ('tick_size', 'tickSize', _decimal), ('min_price', 'minPrice', _decimal),
+              ('max_price', 'maxPrice', _decimal), ('step_size', 'stepSize', _decimal),
+              ('min_quantity', 'minQuantity', _decimal), ('max_quantity', 'maxQuantity', _decimal))
+    __slots__ = tuple(each[0] for each in FIELDS)
+    FILTER_KEYS = {'price': ('tickSize', 'minPrice', 'maxPrice'), 'quantity': ('stepSize', 'minQuantity', 'maxQuantity')}
+
+    @classmethod
+    def from_dict(cls, data):
+        flat = dict(data)
+        for group in (data.get('filters') or {}).values():
+            flat.update(group or {})
+        return super(Market, cls).from_dict(flat)
+
+    def to_dict(self):
+        flat = Model.to_dict(self)
+        flat['filters'] = {name: {key: flat.pop(key) for key in keys} for name, keys in self.FILTER_KEYS.items()}
+        return flat
+
+
+# Converters for results, exchange error entries of batch orders stay dicts
+
+def _one(cls):
+    def parse(result):
+        return cls.from_dict(result) if isinstance(result, dict) else result
+    return parse
+
+
+def _many(cls):
+    def parse(result):
+        if not isinstance(result, list):
+            return result
+        return [cls.from_dict(each) if isinstance(each, dict) and 'code' not in each else each for each in result]
+    return parse
+
+
+def _balances(result):
+    if not isinstance(result, dict):
+        return result
+    return {asset: Balance.from_dict(each) for asset, each in result.items()}
+
+
+# (method, path) -> converter, used by Client when typed is set
+PARSERS = {
+    (c.OPEN_ORDER.method, c.OPEN_ORDER.path): _one(Order),
+    (c.EXEC_ORDER.method, c.EXEC_ORDER.path): _one(Order),
+    (c.CANCEL_ORDER.method, c.CANCEL_ORDER.path): _one(Order),
+    (c.EXEC_ORDERS.method, c.EXEC_ORDERS.path): _many(Order),
+    (c.OPEN_ORDERS.method, c.OPEN_ORDERS.path): _many(Order),
+    (c.CANCEL_ORDERS.method, c.CANCEL_ORDERS.path): _many(Order),
+    (c.ORDERS.method, c.ORDERS.path): _many(Order),
+    (c.FILLS.method, c.FILLS.path): _many(Fill),
+    (c.BALANCES.method, c.BALANCES.path): _balances,
+    (c.COLLATERALS.method, c.COLLATERALS.path): _one(Collateral),
+    (c.MARKET.method, c.MARKET.path): _one(Market),
+    (c.MARKETS.method, c.MARKETS.path): _many(Market),
+}
+
+
+def parse(method, path, result):
+    parser = PARSERS.get((method, path))
+    return parser(result) if parser is not None else result
@@ -0,0 +1,65 @@
+import asyncio
+import concurrent.futures
+from . import consts as c
+
+
+def _windows(params, window):
+    # Splits [fromTime, toTime) into consecutive windows of `window` ms
+    if not window or params.get('fromTime') is None or params.get('toTime') is None:
+        yield params
+        return
+    start, end = int(params['fromTime']), int(params['toTime'])
+    while start < end:
+        yield dict(params, fromTime=start, toTime=min(start + window, end))
+        start += window
+
+def paginate(method, page_size=c.HISTORY_PAGE_LIMIT, stop_at=None, cursor_key='id', window=None, **params):
+    '''
+    Yields every item of a limit/offset endpoint, one page in memory at a time.
+    The next page is requested in the background while the caller consumes the
+    current one. Iteration stops before the first item whose cursor_key equals
+    stop_at. With window (ms) and both fromTime and toTime set, the time range
+    is walked in consecutive windows to keep offsets small.
+    '''
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    try:
+        for window_params in _windows(params, window):
+            offset = window_params.pop('offset', 0)
+            future = executor.submit(method, limit=page_size, offset=offset, **window_params)
+            while future is not None:
+                page = future.result()
+                if not page:
+                    break
+                offset += len(page)
+                future = executor.submit(method, limit=page_size, offset=offset, **window_params) if len(page) >= page_size else None
+                for item in page:
+                    if stop_at is not None and item.get(cursor_key) == stop_at:
+                        return
+                    yield item
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+async def apaginate(method, page_size=c.HISTORY_PAGE_LIMIT, stop_at=None, cursor_key='id', window=None, **params):
+    '''
+    Async version of paginate for AsyncAuthAPI / AsyncPublicAPI methods.
+    '''
+    task = None
+    try:
+        for window_params in _windows(params, window):
+            offset = window_params.pop('offset', 0)
+            task = asyncio.ensure_future(method(limit=page_size, offset=offset, **window_params))
+            while task is not None:
+                page = await task
+                task = None
+                if not page:
+                    break
+                offset += len(page)
+                if len(page) >= page_size:
+                    task = asyncio.ensure_future(method(limit=page_size, offset=offset, **window_params))
+                for item in page:
+                    if stop_at is not None and item.get(cursor_key) == stop_at:
+                        return
+                    yield item
+    finally:
+        if task is not None:
+            task.cancel()
@@ -0,0 +1,71 @@
+from decimal import Decimal, ROUND_FLOOR
+
+
+def _unit(size):
+    # tickSize / stepSize -> (mantissa, places) with size == mantissa / 10**places
+    size = Decimal(str(size)).normalize()
+    if size <= 0:
+        raise ValueError(f'Invalid tick or step size: {size}')
+    _, digits, exponent = size.as_tuple()
+    if exponent >= 0:
+        return int(size), 0
+    return int(''.join(map(str, digits))), -exponent
+
+
+def _render(units, mantissa, places):
+    value = units * mantissa
+    sign, digits = ('-', str(-value)) if value < 0 else ('', str(value))
+    if not places:
+        return sign + digits
+    digits = digits.rjust(places + 1, '0')
+    return f'{sign}{digits[:-places]}.{digits[-places:]}'
+
+
+class Precision(object):
+    '''
+    Integer tick / lot arithmetic for one market. A price is converted once to
+    a whole number of ticks (tickSize) and a quantity to lots (stepSize); grid
+    math is then plain int arithmetic, and price_str / qty_str render the
+    exact decimal string the exchange expects only when an order is sent.
+    Conversions take str, float or Decimal and round down unless told otherwise.
+    '''
+
+    def __init__(self, tick_size, step_size):
+        self.tick_size = Decimal(str(tick_size))
+        self.step_size = Decimal(str(step_size))
+        self._price_unit = _unit(tick_size)
+        self._qty_unit = _unit(step_size)
+
+    @classmethod
+    def from_market(cls, market):
+        # api.models.Market or the raw get_market(s) dict
+        if isinstance(market, dict):
+            return cls(market['filters']['price']['tickSize'], market['filters']['quantity']['stepSize'])
+        return cls(market.tick_size, market.step_size)
+
+    def to_ticks(self, price, rounding=ROUND_FLOOR):
+        return int((Decimal(str(price)) / self.tick_size).to_integral_value(rounding))
+
+    def to_lots(self, quantity, rounding=ROUND_FLOOR):
+        return int((Decimal(str(quantity)) / self.step_size).to_integral_value(rounding))
+
+    # Exact strings for the wire
+
+    def price_str(self, ticks):
+        return _render(ticks, *self._price_unit)
+
+    def qty_str(self, lots):
+        return _render(lots, *self._qty_unit)
+
+    # Floats for balance checks, int division keeps them the closest float to the exact value
+
+    def price(self, ticks):
+        mantissa, places = self._price_unit
+        return ticks * mantissa / 10 ** places
+
+    def qty(self, lots):
+        mantissa, places = self._qty_unit
+        return lots * mantissa / 10 ** places
+
+    def __repr__(self):
+        return f'Precision({str(self.tick_size)!r}, {str(self.step_size)!r})'
@@ -0,0 +1,151 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from . import consts as c
+from . import metrics
+
+
+# Priority lanes, lower goes first
+CANCEL = 0
+PLACE = 1
+QUERY = 2
+
+LANE_NAMES = {CANCEL: 'cancel', PLACE: 'place', QUERY: 'query'}
+
+CANCEL_INSTRUCTIONS = ('orderCancel', 'orderCancelAll', 'rfqCancel')
+PLACE_INSTRUCTIONS = ('orderExecute', 'rfqSubmit', 'rfqRefresh', 'quoteAccept', 'quoteSubmit')
+
+# (method, path) -> Endpoint, for every endpoint declared in consts
+ENDPOINTS = {(each.method, each.path): each for each in vars(c).values() if isinstance(each, c.Endpoint)}
+
+
+def lane_of(endpoint):
+    if endpoint.instruction in CANCEL_INSTRUCTIONS:
+        return CANCEL
+    if endpoint.instruction in PLACE_INSTRUCTIONS:
+        return PLACE
+    return QUERY
+
+
+class _TokenBucket(object):
+    '''
+    Shared bookkeeping of RateLimiter and AsyncRateLimiter: `rate` tokens per
+    second up to `burst`, a request of endpoint E costs weights.get(E, 1)
+    (per order for batch orders). Waiting requests are served strictly by
+    (lane, arrival), so a cancel never queues behind a balance read.
+    '''
+
+    def __init__(self, rate, burst=None, weights=None, metrics_registry=metrics.registry):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.weights = weights or {}
+        self.metrics = metrics_registry
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters = []  # heap of [lane, seq, weight, waiter]
+        self._seq = itertools.count()
+
+    # Lane and cost of a request
+    def classify(self, method, path, params=None):
+        endpoint = ENDPOINTS.get((method, path))
+        if endpoint is None:
+            return QUERY, 1
+        weight = self.weights.get(endpoint, 1)
+        if isinstance(params, list):  # batch orders
+            weight *= max(len(params), 1)
+        return lane_of(endpoint), min(weight, self.burst)
+
+    # Stops handing out tokens for `seconds`, e.g. after a 429 with Retry-After
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+    def _refill(self, now):
+        if now < self._paused_until:
+            self._updated = now
+            return
+        self.tokens = min(self.burst, self.tokens + (now - max(self._updated, self._paused_until)) * self.rate)
+        self._updated = now
+
+    # Hands tokens to the head waiters, returns the delay until the next one can go (or None)
+    def _grant(self):
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiters:
+            weight = self._waiters[0][2]
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self.tokens < weight:
+                return (weight - self.tokens) / self.rate
+            self.tokens -= weight
+            self._release(heapq.heappop(self._waiters)[3])
+        return None
+
+    def _observe(self, lane, started):
+        if self.metrics is not None:
+            self.metrics.observe('rate_limit_wait_seconds', time.monotonic() - started, lane=LANE_NAMES[lane])
+
+
+class RateLimiter(_TokenBucket):
+    '''
+    Thread-safe limiter for Client: acquire() blocks the calling thread.
+    '''
+
+    def __init__(self, rate, burst=None, weights=None, metrics_registry=metrics.registry):
+        _TokenBucket.__init__(self, rate, burst, weights, metrics_registry)
+        self._condition = threading.Condition()
+
+    def _release(self, waiter):
+        waiter.set()
+
+    def acquire(self, method, path, params=None):
+        lane, weight = self.classify(method, path, params)
+        started = time.monotonic()
+        waiter = threading.Event()
+        with self._condition:
+            heapq.heappush(self._waiters, [lane, next(self._seq), weight, waiter])
+            while True:
+                delay = self._grant()
+                self._condition.notify_all()
+                if waiter.is_set():
+                    break
+                self._condition.wait(delay)
+        self._observe(lane, started)
+
+
+class AsyncRateLimiter(_TokenBucket):
+    '''
+    asyncio limiter for AsyncClient: acquire() is a coroutine, one timer
+    handle wakes the queue when the head request can afford its tokens.
+    '''
+
+    def __init__(self, rate, burst=None, weights=None, metrics_registry=metrics.registry):
+        _TokenBucket.__init__(self, rate, burst, weights, metrics_registry)
+        self._timer = None
+
+    def _release(self, waiter):
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def _wake(self):
+        self._timer = None
+        # Drop waiters whose caller was cancelled
+        self._waiters = [each for each in self._waiters if not each[3].cancelled()]
+        heapq.heapify(self._waiters)
+        delay = self._grant()
+        if delay is not None:
+            self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+
+    async def acquire(self, method, path, params=None):
+        lane, weight = self.classify(method, path, params)
+        started = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [lane, next(self._seq), weight, waiter])
+        if self._timer is not None:
+            self._timer.cancel()
+        self._wake()
+        await waiter
+        self._observe(lane, started)
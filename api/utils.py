@@ -56,5 +56,32 @@ def get_header(api_key, sign, timestamp, window):
     header[c.X_WINDOW] = window
     return header
 
+class Signer(object):
+    '''
+    Holds the decoded Ed25519 key and a header template, so a request only
+    fills in the signature and timestamp.
+    '''
+
+    def __init__(self, api_key, api_secret, window=c.DEFAULT_WINDOW):
+        self.api_key = api_key
+        self.window = window
+        self._signing_key = nacl.signing.SigningKey(base64.b64decode(api_secret))
+        self._header = {c.CONTENT_TYPE: c.APPLICATION_JSON, c.X_API_KEY: api_key, c.X_WINDOW: window}
+
+    def sign(self, message):
+        signed = self._signing_key.sign(message.encode())
+        return base64.b64encode(signed.signature).decode()
+
+    def get_header(self, sign, timestamp):
+        header = self._header.copy()
+        header[c.X_SIGNATURE] = sign
+        header[c.X_TIMESTAMP] = str(timestamp)
+        return header
+
+    def ws_signature(self, timestamp):
+        # [api_key, signature, timestamp, window] for WebSocket private streams
+        str_to_sign = f'instruction=subscribe&timestamp={timestamp}&window={self.window}'
+        return [self.api_key, self.sign(str_to_sign), str(timestamp), self.window]
+
 def get_timestamp():
     return int(time.time()*1000)
\ No newline at end of file
@@ -0,0 +1,24 @@
+'''
+account.orderUpdate frames decoded per second with every installed
+api.codec backend, from raw text to an OrderUpdate.
+
+    python -m benchmarks.bench_codec
+'''
+import json
+import timeit
+from api import codec
+
+
+def main(number=50000):
+    frame = json.dumps({'stream': 'account.orderUpdate.SOL_USDC', 'data': {
+        'e': 'orderFill', 'E': 1694687692980000, 's': 'SOL_USDC', 'c': 123, 'S': 'Bid', 'o': 'LIMIT', 'f': 'GTC',
+        'q': '32123', 'Q': '32123', 'p': '20', 'X': 'PartiallyFilled', 'i': '1111343026172067', 'z': '123',
+        'Z': '123', 't': 567, 'L': '20', 'l': '14', 'n': '0.01', 'N': 'USDC', 'm': True, 'V': 'RejectTaker',
+        'T': 1694687692989999}})
+    for name in codec.BACKENDS:
+        each = codec.Codec(name)
+        seconds = min(timeit.repeat(lambda: each.decode_frame(frame), number=number, repeat=3))
+        print(f'{name:<10}{number / seconds:>12,.0f} frames/s')
+
+if __name__ == '__main__':
+    main()
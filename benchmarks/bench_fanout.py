@@ -0,0 +1,46 @@
+'''
+Independent REST calls one after another versus Client.gather, against the
+local mock exchange with a simulated round trip.
+
+    python -m benchmarks.bench_fanout
+'''
+import base64
+import functools
+import time
+import nacl.signing
+from api.Auth_api import AuthAPI
+from mock_exchange import MockExchange
+
+
+def main(latency=0.02, rounds=20):
+    exchange = MockExchange(latency=latency).start()
+    signing_key = nacl.signing.SigningKey.generate()
+    api_key = base64.b64encode(bytes(signing_key.verify_key)).decode()
+    api_secret = base64.b64encode(bytes(signing_key)).decode()
+    exchange.engine.deposit(api_key, 'USDC', 10 ** 5)
+    client = AuthAPI(api_key, api_secret, base_url=exchange.api_url)
+    calls = [functools.partial(client.get_open_orders, symbol='SOL_USDC'),
+             functools.partial(client.get_fill_history, symbol='SOL_USDC'),
+             client.get_balances, client.get_collaterals]
+    client.prewarm()
+
+    def sequential():
+        return [call() for call in calls]
+
+    def gather():
+        return client.gather(*calls)
+
+    assert sequential() == gather()
+    print(f'simulated round trip {latency * 1000:.0f} ms, {len(calls)} calls')
+    for name, func in [('sequential', sequential), ('gather', gather)]:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            func()
+        elapsed = time.perf_counter() - start
+        print(f'{name:<12}{elapsed / rounds * 1000:>10.1f} ms')
+    client.close()
+    exchange.stop()
+
+
+if __name__ == '__main__':
+    main()
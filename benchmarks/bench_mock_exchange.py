@@ -0,0 +1,41 @@
+'''
+Ladder placement against the local mock exchange: one place_order per level
+versus a single chunked batch request.
+
+    python -m benchmarks.bench_mock_exchange
+'''
+import base64
+import time
+import nacl.signing
+from api.Auth_api import AuthAPI
+from mock_exchange import MockExchange
+
+
+def main(levels=20, rounds=20):
+    exchange = MockExchange().start()
+    signing_key = nacl.signing.SigningKey.generate()
+    api_key = base64.b64encode(bytes(signing_key.verify_key)).decode()
+    api_secret = base64.b64encode(bytes(signing_key)).decode()
+    client = AuthAPI(api_key, api_secret, base_url=exchange.api_url)
+    ladder = [{'symbol': 'SOL_USDC', 'side': 'Bid', 'orderType': 'Limit', 'price': f'{100 - i:.2f}', 'quantity': '0.1',
+               'timeInForce': 'GTC'} for i in range(levels)]
+
+    def sequential():
+        for order in ladder:
+            client.place_order(**order)
+
+    def batch():
+        client.place_batch_orders_chunked(ladder)
+
+    for name, func in [('place_order x levels', sequential), ('place_batch_orders_chunked', batch)]:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            func()
+            client.cancel_open_orders(symbol='SOL_USDC')
+        elapsed = time.perf_counter() - start
+        print(f'{name:<28}{elapsed / rounds * 1000:>10.1f} ms per {levels}-level ladder')
+    exchange.stop()
+
+
+if __name__ == '__main__':
+    main()
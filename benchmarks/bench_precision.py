@@ -0,0 +1,45 @@
+'''
+Rendering a grid ladder to order strings: Decimal(str(...)) quantize and
+floor per level (the previous GridStrategy.format_price / format_qty)
+versus integer ticks and lots from api.precision.
+
+    python -m benchmarks.bench_precision
+'''
+import timeit
+from decimal import Decimal, ROUND_HALF_UP
+from api.precision import Precision
+from gridbot.ladder import build_ladder
+
+
+def format_decimal(value, unit_value):
+    return str(Decimal(str(value)).quantize(Decimal(str(unit_value)), rounding=ROUND_HALF_UP))
+
+
+def main(levels=200, number=200):
+    tick, step, price_step = Decimal('0.01'), Decimal('0.001'), 0.05
+    precision = Precision(tick, step)
+    step_ticks = precision.to_ticks(price_step, ROUND_HALF_UP)
+    lots = [precision.to_lots(each, ROUND_HALF_UP) for each in (0.1, 0.01, 0.1, 0.0)]
+
+    def before():
+        bids, asks = build_ladder('Bid', 0.1, 150.37, price_step, levels, 0.1, 0.01, 0.1, 0.0)
+        result = []
+        for side, price, qty in bids + asks:
+            price = Decimal(format_decimal(price, tick)) // Decimal(str(price_step)) * Decimal(str(price_step))
+            qty = Decimal(format_decimal(qty, step)) // step * step
+            result.append((side, str(price), str(qty)))
+        return result
+
+    def after():
+        anchor = precision.to_ticks(150.37, ROUND_HALF_UP) // step_ticks * step_ticks
+        bids, asks = build_ladder('Bid', precision.to_lots(0.1, ROUND_HALF_UP), anchor, step_ticks, levels, *lots)
+        return [(side, precision.price_str(ticks), precision.qty_str(lots)) for side, ticks, lots in bids + asks]
+
+    assert [(s, Decimal(p), Decimal(q)) for s, p, q in before()] == [(s, Decimal(p), Decimal(q)) for s, p, q in after()]
+    for name, func in [('Decimal per level', before), ('integer ticks', after)]:
+        seconds = min(timeit.repeat(func, number=number, repeat=3))
+        print(f'{name:<20}{seconds / number * 1e6:>10,.0f} us per {2 * levels}-level ladder')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+'''
+Signs per second: utils.sign + utils.get_header (key decoded per call)
+versus a cached utils.Signer.
+
+    python -m benchmarks.bench_signer
+'''
+import base64
+import timeit
+import nacl.signing
+from api import utils
+from api import consts as c
+
+
+def main(number=20000):
+    secret = base64.b64encode(bytes(nacl.signing.SigningKey.generate())).decode()
+    api_key = 'benchmark-key'
+    params = {'symbol': 'SOL_USDC', 'side': 'Bid', 'orderType': 'Limit', 'price': '150.50',
+              'quantity': '0.01', 'timeInForce': 'GTC'}
+    timestamp = utils.get_timestamp()
+    message = utils.pre_hash('orderExecute', params, timestamp, c.DEFAULT_WINDOW)
+    signer = utils.Signer(api_key, secret)
+
+    def before():
+        sign = utils.sign(message, secret)
+        return utils.get_header(api_key, sign, timestamp, c.DEFAULT_WINDOW)
+
+    def after():
+        return signer.get_header(signer.sign(message), timestamp)
+
+    assert before() == after()
+    for name, func in [('utils.sign + get_header', before), ('Signer', after)]:
+        seconds = min(timeit.repeat(func, number=number, repeat=3))
+        print(f'{name:<26}{number / seconds:>12,.0f} signs/s')
+
+
+if __name__ == '__main__':
+    main()
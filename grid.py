@@ -1,10 +1,23 @@
 import os
 import math
+import functools
+import queue
 import time
 import traceback
+from decimal import ROUND_HALF_UP
 from dotenv import load_dotenv
 from api.Public_api import PublicAPI
 from api.Auth_api import AuthAPI
+from api.clock import ClockSync
+from api.depth_book import DepthBook
+from api.markets import MarketCache
+from api.market_data import MarketDataFeed
+from api.metrics import registry as metrics
+from api.models import Market, Order
+from api.precision import Precision
+from api.rate_limit import RateLimiter
+from gridbot.journal import Journal
+from gridbot.ledger import Ledger
 
 
 use_proxy = True
@@ -13,7 +26,9 @@ if use_proxy == True:
 else:
     proxy = None
 
-public_api_client = PublicAPI(proxy=proxy)
+load_dotenv()
+api_url = os.getenv('BACKPACK_API_URL')  # 为空时使用官方地址，离线测试时可指向 mock_exchange
+public_api_client = PublicAPI(proxy=proxy, base_url=api_url)
 
 # 配置参数
 initialBuyQuantity=0.01
@@ -32,22 +47,43 @@ elif marketType == 'PERP':
     pair_name = baseAsset + '_' + quoteAsset + '_PERP'
 else:
     raise ValueError('Invalid market type. It should be SPOT or PERP.')
-marketInfo = public_api_client.get_market(pair_name)
-if marketInfo['orderBookState'] != 'Open':
+market_cache = MarketCache(public_api_client)  # 交易对信息缓存在本地文件，重启时不必等待交易所返回
+marketInfo = Market.from_dict(market_cache.get(pair_name))
+if marketInfo.order_book_state != 'Open':
     raise ValueError('Invalid trade pair.')
-unitPrice = float(marketInfo['filters']['price']['tickSize'])
-unitQuantity = float(marketInfo['filters']['quantity']['stepSize'])
+unitPrice = float(marketInfo.tick_size)
+unitQuantity = float(marketInfo.step_size)
 if unitPrice > priceStep:
     raise ValueError(f'Grid price step should be greater than the minimum price: {unitPrice}.')
 for each in [initialBuyQuantity, buyIncrement, initialSellQuantity, sellIncrement]:
     if (each > 0) and (each < unitQuantity):
         raise ValueError(f'All quantity related params should be greater the minimum quantity: {unitQuantity}.')
+# 价格和数量换算为整数 tick/lot，网格计算全部用整数，下单时再转换为字符串
+precision = Precision.from_market(marketInfo)
+stepTicks = precision.to_ticks(priceStep, ROUND_HALF_UP)
+initialBuyLots, buyIncrementLots, initialSellLots, sellIncrementLots = [
+    precision.to_lots(each) for each in [initialBuyQuantity, buyIncrement, initialSellQuantity, sellIncrement]]
 
 # 初始化Backpack API客户端
-load_dotenv()
 api_key = os.getenv('API_KEY')
 api_secret = os.getenv('API_SECRET')
-auth_api_client = AuthAPI(api_key=api_key, api_secret=api_secret, proxy=proxy)
+auth_api_client = AuthAPI(api_key=api_key, api_secret=api_secret, proxy=proxy, base_url=api_url)
+clock = ClockSync(public_api_client)  # 校准本地与交易所的时间偏差，签名使用交易所时间
+auth_api_client.clock = clock
+auth_api_client.typed = True  # 余额、订单、成交返回 api.models 对象，数字只解析一次
+# 客户端限速(每秒请求数/突发上限)，排队时撤单优先于挂单，挂单优先于查询
+auth_api_client.rate_limiter = RateLimiter(rate=20, burst=40)
+
+# Websocket行情，价格变化时才检查挂单
+ws_url = os.getenv('BACKPACK_WS_URL', 'wss://ws.backpack.exchange')
+checkInterval = 60  # 行情没有触发时，也至少每隔这么多秒检查一次挂单(发现人为撤单等)
+staleAfter = 30  # 行情超过这么多秒没有更新视为中断，改用REST查询价格
+pollInterval = 3  # 行情中断期间REST查询价格的间隔(秒)
+market_feed = MarketDataFeed(pair_name, ws_url, stale_after=staleAfter, proxy=proxy,
+                             on_stale=lambda: send_message(f'{pair_name}行情推送中断，改用REST查询价格'),
+                             on_recover=lambda: send_message(f'{pair_name}行情推送已恢复'))
+# 本地盘口，挂单价格不穿过对手盘(避免吃单)
+depth_book = DepthBook(pair_name, public_api_client, ws_url, stale_after=staleAfter, proxy=proxy)
 
 # 初始化Telegram Bot
 # bot_token = os.getenv('BOT_TOKEN')
@@ -59,7 +95,13 @@ auth_api_client = AuthAPI(api_key=api_key, api_secret=api_secret, proxy=proxy)
 # 辅助变量
 buy_orders = []
 sell_orders = []
-last_refer_price = 0
+last_refer_ticks = 0  # 最近一次挂单的参考价(tick数)
+market_changes = queue.SimpleQueue()  # 后台刷新线程发现的交易对参数变化，由主循环处理
+# 本地余额/保证金账本，挂单、撤单和成交时更新，每隔 reconcile_interval 秒才查询一次REST余额
+ledger = Ledger(reconcile_interval=300)
+ledger.add_market(pair_name, baseAsset, quoteAsset, marketType)
+# 参考价和挂单记录在状态日志中，重启时恢复，不必撤销全部挂单重新开始
+journal = Journal(os.path.join(os.getenv('STATE_DIR', '.'), f'.journal_{pair_name}'))
 trade_side_trans = {'Bid': 'BUY', 'Ask': 'SELL'}
 
 def send_message(message):
@@ -70,25 +112,35 @@ def send_message(message):
     # if not dryRun:
     #     loop.run_until_complete(bot.send_message(chat_id=chat_id, text=message))
 
-def format_price(price):
-    """价格抹零，格式化为priceStep的整数倍"""
-    return float(price) // priceStep * priceStep
+def grid_ticks(price):
+    """价格抹零，换算为priceStep整数倍的tick数"""
+    return precision.to_ticks(price) // stepTicks * stepTicks
 
 def get_balance():
     """获取资产余额"""
     balance = {}
-    raw_collaterals = auth_api_client.get_collaterals()['collateral']
-    collaterals = {}
-    for each in raw_collaterals:
-        symbol = each['symbol']
-        collaterals[symbol] = float(each['lendQuantity'])
+    collaterals = auth_api_client.get_collaterals().assets
     balances = auth_api_client.get_balances()
     for each in [baseAsset, quoteAsset]:
-        balance[each] = {'free': float(balances[each]['available']), 'locked': float(balances[each]['locked'])}
+        balance[each] = {'free': balances[each].available, 'locked': balances[each].locked}
         if each in collaterals.keys():
-            balance[each]['free'] += collaterals[each]
+            balance[each]['free'] += collaterals[each].lend_quantity
     return balance
 
+def refresh_ledger(open_orders):
+    """从REST核对账本，open_orders 为当前挂单"""
+    if marketType == 'SPOT':
+        balance = get_balance()
+        balances = {each: balance[each]['free'] + balance[each]['locked'] for each in [baseAsset, quoteAsset]}
+        drift = ledger.load_snapshot({pair_name: open_orders}, balances=balances)
+    else:
+        positions = auth_api_client.get_open_futures_positions() or []
+        position = sum(float(each['netQuantity']) for each in positions if each['symbol'] == pair_name)
+        drift = ledger.load_snapshot({pair_name: open_orders}, collateral=auth_api_client.get_collaterals(),
+                                     positions={pair_name: position})
+    if drift:
+        print(f"账本与交易所不一致，已按REST修正: {drift}")
+
 def wait_asset_unlock(base_balance, quote_balance, attempts=10, wait_time=1):
     """检查是否所有挂单已取消，资金解锁"""
     for attempt in range(attempts):
@@ -106,46 +158,51 @@ def wait_asset_unlock(base_balance, quote_balance, attempts=10, wait_time=1):
     print("资金未能全部解锁，退出程序。")
     return False
 
-def place_order(side, price, quantity):
-    """挂单函数"""
+def place_orders(orders):
+    """批量挂单函数，orders为(side, price, quantity)列表，返回与之一一对应的订单，失败为None"""
+    batch = [{'symbol': pair_name, 'side': side, 'orderType': 'Limit', 'price': price, 'quantity': quantity,
+              'timeInForce': 'GTC'} for side, price, quantity in orders]
     try:
-        order = auth_api_client.place_order(
-            symbol=pair_name,
-            side=side,
-            orderType='Limit',
-            price=(price // unitPrice * unitPrice),
-            quantity=(quantity // unitQuantity * unitQuantity),
-            timeInForce='GTC'
-        )
-        return order
+        results = auth_api_client.place_batch_orders_chunked(batch)
     except Exception as e:
         send_message(f"挂单失败!\n{str(e)}")
-        return None
+        return [None] * len(orders)
+    placed = []
+    for (side, price, quantity), result in zip(orders, results):
+        if isinstance(result, Order):
+            ledger.reserve(pair_name, result.id, side, price, quantity)
+            placed.append(result)
+        else:
+            send_message(f"挂单失败!\nside: {side} price: {price} quantity: {quantity}\n{result}")
+            placed.append(None)
+    return placed
 
 def update_orders(current_price):
     """检查并更新买卖挂单，保持每侧 3 个挂单"""
-    global buy_orders, sell_orders, last_refer_price
+    global buy_orders, sell_orders, last_refer_ticks
 
-    # 获取余额
+    # 检查是否有挂单成交，当前挂单和最近成交并发查询(同一个HTTP/2连接，一次往返)
+    open_orders, fill_history = auth_api_client.gather(
+        functools.partial(auth_api_client.get_open_orders, symbol=pair_name, marketType=marketType),
+        functools.partial(auth_api_client.get_fill_history, symbol=pair_name, marketType=marketType))
+    # 余额取自本地账本，定期或账本发现不一致时才从REST核对
+    refreshed = ledger.due()
+    if refreshed:
+        refresh_ledger(open_orders)
     if marketType == 'SPOT':
-        balance = get_balance()
-        base_balance = (balance[baseAsset]['free'] + balance[baseAsset]['locked']) if baseAsset in balance.keys() else 0
-        quote_balance = balance[quoteAsset]['free'] + balance[quoteAsset]['locked'] if quoteAsset in balance.keys() else 0
+        base_balance = ledger.total(baseAsset)
+        quote_balance = ledger.total(quoteAsset)
     else:
-        collaterals = auth_api_client.get_collaterals()
-        free_equity = float(collaterals['netEquityAvailable'])
-        leverage_factor = float(collaterals['imf'])
-
-    # 检查是否有挂单成交
-    open_orders = auth_api_client.get_open_orders(symbol=pair_name, marketType=marketType)
-    open_orders = [order['id'] for order in open_orders]
+        free_equity = ledger.equity_available
+        leverage_factor = ledger.imf
+    open_orders = [order.id for order in open_orders]
     filled_orders = set(buy_orders + sell_orders) - set(open_orders)
 
     # 获取最后一笔成交信息作为初始数据
-    last_trade = auth_api_client.get_fill_history(symbol=pair_name, marketType=marketType)[0]
-    last_trade_side = last_trade['side']
-    last_trade_qty = float(last_trade['quantity'])
-    last_trade_price = float(last_trade['price'])
+    last_trade = fill_history[0]
+    last_trade_side = last_trade.side
+    last_trade_qty = last_trade.quantity
+    last_trade_price = last_trade.price
 
     # 挂单没有减少，分情况处理
     if not filled_orders:
@@ -155,10 +212,10 @@ def update_orders(current_price):
             return
         # 只有买单一侧有挂单(仓位已清空，追高接货)
         elif buy_orders:
-            if current_price >= (last_refer_price + priceStep):
+            if precision.to_ticks(current_price) >= (last_refer_ticks + stepTicks):
                 # 风控
-                if current_price < (last_trade_price + 10 * priceStep):
-                    refer_price = (last_refer_price + priceStep)
+                if precision.to_ticks(current_price) < (precision.to_ticks(last_trade_price) + 10 * stepTicks):
+                    refer_ticks = (last_refer_ticks + stepTicks)
                 else:
                     print('价格偏离最近成交价太远，停止挂买单')
                     return
@@ -167,30 +224,36 @@ def update_orders(current_price):
                 return
         # 买卖两侧均无挂单(首次启动)
         else:
-            refer_price = format_price(last_trade_price)
+            refer_ticks = grid_ticks(last_trade_price)
     # 挂单减少(成交或取消)
     else:
         # 由于耗时较长，先取消剩余挂单
         auth_api_client.cancel_open_orders(symbol=pair_name)
+        ledger.release_symbol(pair_name)
         # 由于数据库订单状态更新缓慢，不确认消失的订单是成交还是取消，一律当作成交
-        refer_price = last_refer_price
+        refer_ticks = last_refer_ticks
         filled_message = ''
-        for order in filled_orders:
-            filled_order_info = auth_api_client.get_orders(orderId=order)
+        filled_orders = list(filled_orders)
+        filled_infos = auth_api_client.gather(
+            *[functools.partial(auth_api_client.get_orders, orderId=order) for order in filled_orders])
+        for order, filled_order_info in zip(filled_orders, filled_infos):
             while not filled_order_info:
                 print('aaa')
                 time.sleep(1)
                 filled_order_info = auth_api_client.get_orders(orderId=order)
             order_info = filled_order_info[0]
-            # if order_info['status'] == 'Filled':  # 不检查，全部视为成交
-            filled_trade_side = order_info['side']
-            filled_trade_qty = float(order_info['quantity'])
-            filled_trade_price = float(order_info['price'])
+            # 账本按实际成交数量结算，刚核对过的账本已包含这些成交
+            if order_info.executed_quantity and not refreshed:
+                ledger.settle(pair_name, order, order_info.side, order_info.price, order_info.executed_quantity)
+            # if order_info.status == 'Filled':  # 不检查，全部视为成交
+            filled_trade_side = order_info.side
+            filled_trade_qty = order_info.quantity
+            filled_trade_price = order_info.price
             filled_message += f"{trade_side_trans[filled_trade_side]} {filled_trade_qty}{baseAsset} at {filled_trade_price}"
             if filled_trade_side == 'Bid':
-                refer_price -= priceStep
+                refer_ticks -= stepTicks
             else:
-                refer_price += priceStep
+                refer_ticks += stepTicks
             last_trade_side = filled_trade_side
             last_trade_qty = filled_trade_qty
 
@@ -201,6 +264,7 @@ def update_orders(current_price):
 
     # 取消剩余挂单
     auth_api_client.cancel_open_orders(symbol=pair_name)
+    ledger.release_symbol(pair_name)
 
     # 发送成交信息
     if filled_orders and filled_message:
@@ -210,77 +274,160 @@ def update_orders(current_price):
     sell_orders.clear()
 
     if last_trade_side == 'Bid':
-        initial_buy_qty = last_trade_qty + buyIncrement
-        initial_sell_qty = initialSellQuantity
+        initial_buy_lots = precision.to_lots(last_trade_qty) + buyIncrementLots
+        initial_sell_lots = initialSellLots
     else:
-        initial_buy_qty = initialBuyQuantity
-        initial_sell_qty = last_trade_qty + sellIncrement
+        initial_buy_lots = initialBuyLots
+        initial_sell_lots = precision.to_lots(last_trade_qty) + sellIncrementLots
 
-    # 买单：往下挂 priceStep 整数倍的价格
+    # 买单：往下挂 priceStep 整数倍的价格，先按余额确定整个网格，再一次性批量提交
+    new_orders = []
     for i in range(numOrders):
-        buy_price = ((refer_price - (i + 1) * priceStep) // unitPrice * unitPrice)
-        buy_qty = ((initial_buy_qty + i * buyIncrement) // unitQuantity * unitQuantity)
+        buy_ticks = refer_ticks - (i + 1) * stepTicks
+        buy_lots = initial_buy_lots + i * buyIncrementLots
+        buy_price, buy_qty = precision.price(buy_ticks), precision.qty(buy_lots)
+        if depth_book.crosses('Bid', buy_price):
+            print(f"买入价{buy_price}不低于卖一价{depth_book.best_ask()}，跳过该档")
+            continue
         if marketType == 'SPOT':
             if quote_balance < buy_price * buy_qty:
                 send_message(f"{quoteAsset}余额: {quote_balance}，无法在{buy_price}买入{buy_qty}{baseAsset}")
                 break
+            quote_balance -= (buy_price * buy_qty)
         else:
             if free_equity < (buy_price * buy_qty * leverage_factor):
                 send_message(f"保证金余额: {free_equity}USD，无法在{buy_price}买入多单{buy_qty}{baseAsset}")
                 break
-        if dryRun:
-            print(f'在{buy_price}买入{buy_qty}{baseAsset}挂单成功')
-            continue
-        order = place_order('Bid', buy_price, buy_qty)
-        if order:
-            print(f'在{buy_price}买入{buy_qty}{baseAsset}挂单成功')
-            buy_orders.append(order['id'])
-            if marketType == 'SPOT':
-                quote_balance -= (buy_price * buy_qty)
-            else:
-                free_equity -= (buy_price * buy_qty * leverage_factor)
+            free_equity -= (buy_price * buy_qty * leverage_factor)
+        new_orders.append(('Bid', precision.price_str(buy_ticks), precision.qty_str(buy_lots)))
 
     # 卖单：往上挂 priceStep 整数倍的价格
     for i in range(numOrders):
-        sell_price = ((refer_price + (i + 1) * priceStep) // unitPrice * unitPrice)
-        sell_qty = ((initial_sell_qty + i * sellIncrement) // unitQuantity * unitQuantity)
+        sell_ticks = refer_ticks + (i + 1) * stepTicks
+        sell_lots = initial_sell_lots + i * sellIncrementLots
+        sell_price, sell_qty = precision.price(sell_ticks), precision.qty(sell_lots)
+        if depth_book.crosses('Ask', sell_price):
+            print(f"卖出价{sell_price}不高于买一价{depth_book.best_bid()}，跳过该档")
+            continue
         if marketType == 'SPOT':
             if base_balance < sell_qty:
                 print(f"{baseAsset}余额: {base_balance}，无法在{sell_price}卖出{sell_qty}{baseAsset}")
                 break
+            base_balance -= sell_qty
         else:
             if free_equity < (sell_price * sell_qty * leverage_factor):
                 send_message(f"保证金余额: {free_equity}USD，无法在{sell_price}买入空单{sell_qty}{baseAsset}")
                 break
-        if dryRun:
-            print(f'在{sell_price}卖出{sell_qty}{baseAsset}挂单成功')
-            continue
-        order = place_order('Ask', sell_price, sell_qty)
-        if order:
-            print(f'在{sell_price}卖出{sell_qty}{baseAsset}挂单成功')
-            sell_orders.append(order['id'])
-            if marketType == 'SPOT':
-                base_balance -= sell_qty
-            else:
-                free_equity -= (sell_price * sell_qty * leverage_factor)
+            free_equity -= (sell_price * sell_qty * leverage_factor)
+        new_orders.append(('Ask', precision.price_str(sell_ticks), precision.qty_str(sell_lots)))
+
+    side_names = {'Bid': '买入', 'Ask': '卖出'}
+    if dryRun:
+        for side, price, qty in new_orders:
+            print(f'在{price}{side_names[side]}{qty}{baseAsset}挂单成功')
+    else:
+        for (side, price, qty), order in zip(new_orders, place_orders(new_orders)):
+            if order:
+                print(f'在{price}{side_names[side]}{qty}{baseAsset}挂单成功')
+                (buy_orders if side == 'Bid' else sell_orders).append(order.id)
+
+    # 记录参考价，连同挂单写入状态日志
+    last_refer_ticks = refer_ticks
+    journal.set('refer_price', precision.price_str(refer_ticks))
+    journal.set('buy_orders', buy_orders)
+    journal.set('sell_orders', sell_orders)
+
+def restore_state():
+    """
+    从状态日志恢复参考价和挂单，并与交易所的当前挂单核对
+    停机期间消失的挂单保留在记录中，由 update_orders 按成交处理
+    """
+    global last_refer_ticks
+    refer_price = journal.get('refer_price')
+    if refer_price is None:
+        return
+    open_orders = {order.id for order in auth_api_client.get_open_orders(symbol=pair_name, marketType=marketType)}
+    buy_orders[:] = journal.get('buy_orders', [])
+    sell_orders[:] = journal.get('sell_orders', [])
+    last_refer_ticks = grid_ticks(refer_price)
+    gone = len(set(buy_orders + sell_orders) - open_orders)
+    print(f"从状态日志恢复: 参考价{refer_price}，买单{len(buy_orders)}个，卖单{len(sell_orders)}个，其中{gone}个已不在盘口")
+
+def price_triggered(current_price):
+    """价格到达最近的买单/卖单价(或只剩买单时上涨一格)，挂单可能需要更新"""
+    if not (buy_orders or sell_orders):
+        return True
+    current_ticks = precision.to_ticks(current_price)
+    return current_ticks <= last_refer_ticks - stepTicks or current_ticks >= last_refer_ticks + stepTicks
 
-    # 记录参考价
-    last_refer_price = (refer_price // unitPrice * unitPrice)
+def on_market_change(symbol, old_market, new_market):
+    """后台刷新线程发现交易对参数变化时调用，只放入队列，由主循环在两次挂单更新之间处理"""
+    if symbol == pair_name:
+        market_changes.put(new_market)
+
+def apply_market_changes():
+    """在主循环中更新最小价格/数量单位，不与 update_orders 同时修改全局参数"""
+    global unitPrice, unitQuantity, precision, stepTicks, last_refer_ticks
+    global initialBuyLots, buyIncrementLots, initialSellLots, sellIncrementLots
+    while not market_changes.empty():
+        new_market = Market.from_dict(market_changes.get_nowait())
+        unitPrice = float(new_market.tick_size)
+        unitQuantity = float(new_market.step_size)
+        # tick/lot 大小变化后重新换算，参考价按新的 tick 表示
+        refer_price = precision.price_str(last_refer_ticks)
+        precision = Precision.from_market(new_market)
+        stepTicks = precision.to_ticks(priceStep, ROUND_HALF_UP)
+        initialBuyLots, buyIncrementLots, initialSellLots, sellIncrementLots = [
+            precision.to_lots(each) for each in [initialBuyQuantity, buyIncrement, initialSellQuantity, sellIncrement]]
+        last_refer_ticks = grid_ticks(refer_price)
+        send_message(f"{pair_name}交易对参数变化: 状态{new_market.order_book_state}，"
+                     f"最小价格单位{unitPrice}，最小数量单位{unitQuantity}")
 
 def main():
     """主程序：实时更新价格，执行网格交易"""
     # send_message('程序启动')
+    # 启动时间校准
+    try:
+        clock.sync()
+    except Exception as e:
+        print(f"时间校准失败，使用本地时间: {e}")
+    clock.start()
+    # 提前建立连接，空闲时定期 ping 保持连接，成交后的第一个请求不必重新握手
+    try:
+        auth_api_client.prewarm()
+    except Exception as e:
+        print(f"预先建立连接失败: {e}")
+    auth_api_client.start_keepalive()
+    # 后台核对本地缓存的交易对信息
+    market_cache.on_change(on_market_change)
+    market_cache.start()
+    # kill -USR1 <pid> 打印各接口耗时统计，设置 METRICS_PORT 时以 Prometheus 格式提供
+    metrics.dump_on_signal()
+    if os.getenv('METRICS_PORT'):
+        metrics.serve(int(os.getenv('METRICS_PORT')))
+    market_feed.start()
+    depth_book.start()
+    restore_state()
+    version = 0
+    last_check = 0
     while True:
         try:
-            # 获取最新价格
-            current_price = float(public_api_client.get_recent_trades(symbol=pair_name)[0]['price'])
+            apply_market_changes()
+            # 等待新的行情推送，最多等待 checkInterval 秒；行情中断时不会有推送，按 pollInterval 轮询REST
+            version = market_feed.wait(version, timeout=pollInterval if market_feed.is_stale() else checkInterval)
+            if market_feed.is_stale():
+                # 行情中断，退回到REST查询最新价格
+                current_price = float(public_api_client.get_recent_trades(symbol=pair_name)[0]['price'])
+            else:
+                current_price = market_feed.price
+            # 价格没有触及最近的挂单价，也没到定期检查时间，不调用REST
+            if not price_triggered(current_price) and time.monotonic() - last_check < checkInterval:
+                continue
             print(f"最新价格: {current_price}")
 
             # 更新挂单
             update_orders(current_price)
-
-            # 间隔 3 秒更新价格
-            time.sleep(3)
+            last_check = time.monotonic()
 
         except Exception as e:
             traceback.print_exc()
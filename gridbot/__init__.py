@@ -0,0 +1,3 @@
+'''
+Grid strategy building blocks shared by grid.py and ws_grid.py
+'''
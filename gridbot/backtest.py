@@ -0,0 +1,280 @@
+"""
+网格策略回测
+
+把历史K线或成交价格展开成价格路径，按 ws_grid 的规则(以最后成交为锚点挂 numOrders 档，
+同方向连续成交时数量递增)计算成交，输出每组参数的盈亏、持仓、手续费和挂撤单数量。
+
+价格路径先换算成以 priceStep 为单位的档位，依次触及的档位序列与锚点无关，
+用 NumPy 一次算出；不受资金约束时相邻两次触及的档位就是一笔成交，数量、盈亏也都能向量化计算。
+资金不足时挂单会被截断，这时退回到逐笔成交调用 build_ladder/diff_levels 的 replay。
+
+    python -m gridbot.backtest --symbol SOL_USDC_PERP --interval 1m --days 30 --steps 0.5,1,2 --orders 3,5
+"""
+import argparse
+import concurrent.futures
+import itertools
+import math
+import os
+import time
+from collections import namedtuple
+import numpy as np
+from api import consts as c
+from .ladder import Level, build_ladder, diff_levels
+
+
+GridConfig = namedtuple('GridConfig', ['price_step', 'num_orders', 'initial_buy_qty', 'buy_increment',
+                                       'initial_sell_qty', 'sell_increment'])
+
+Result = namedtuple('Result', ['config', 'pnl', 'position', 'max_position', 'min_position', 'volume', 'fees',
+                               'buys', 'sells', 'placed', 'cancelled'])
+
+
+def kline_path(klines):
+    """
+    K线展开为价格路径，每根K线按 开-低-高-收(阳线) 或 开-高-低-收(阴线) 的顺序走
+    klines: get_k_lines 返回的列表
+    """
+    ohlc = np.array([[each['open'], each['high'], each['low'], each['close']] for each in klines], dtype=float)
+    if not len(ohlc):
+        return np.empty(0)
+    rising = ohlc[:, 3] >= ohlc[:, 0]
+    path = np.empty((len(ohlc), 4))
+    path[:, 0] = ohlc[:, 0]
+    path[:, 1] = np.where(rising, ohlc[:, 2], ohlc[:, 1])
+    path[:, 2] = np.where(rising, ohlc[:, 1], ohlc[:, 2])
+    path[:, 3] = ohlc[:, 3]
+    return path.ravel()
+
+def trade_path(trades):
+    """历史成交按成交编号排序后的价格路径"""
+    return np.array([each['price'] for each in sorted(trades, key=lambda each: each['id'])], dtype=float)
+
+def load_klines(public_api, symbol, interval, start_time, end_time=None):
+    """分段请求 get_k_lines，start_time/end_time 为秒级时间戳"""
+    end_time = end_time or int(time.time())
+    span = c.KLINE_INTERVALS[interval] * c.K_LINES_LIMIT
+    klines = []
+    for window_start in range(int(start_time), int(end_time), span):
+        klines.extend(public_api.get_k_lines(symbol, interval, window_start, min(window_start + span, end_time)))
+    return klines
+
+def load_trades(public_api, symbol, limit=None):
+    """通过 iter_historical_trades 读取最近的历史成交，limit 为空时读取全部"""
+    return list(itertools.islice(public_api.iter_historical_trades(symbol=symbol), limit))
+
+def touches(path, price_step):
+    """
+    价格路径依次触及的档位(相对起点，以 price_step 为单位)，相邻两项恰好相差一档
+    相邻两个价格点之间按直线经过，跳空时中间的每一档都算触及
+    """
+    units = np.round((np.asarray(path, dtype=float) - path[0]) / price_step, 9)
+    prev, curr = units[:-1], units[1:]
+    up = curr > prev
+    first = np.where(up, np.ceil(prev), np.floor(prev)).astype(np.int64)
+    last = np.where(up, np.floor(curr), np.ceil(curr)).astype(np.int64)
+    step = np.where(up, 1, -1)
+    count = np.maximum((last - first) * step + 1, 0)
+    count[curr == prev] = 0
+    offsets = np.repeat(np.cumsum(count) - count, count)
+    levels = np.repeat(first, count) + np.repeat(step, count) * (np.arange(count.sum()) - offsets)
+    levels = np.concatenate(([0], levels))
+    return levels[np.concatenate(([True], levels[1:] != levels[:-1]))]
+
+def _summarize(config, prices, quantities, is_buy, last_price, maker_fee, placed, cancelled):
+    """由成交序列计算盈亏，持仓按最后价格计价"""
+    notional = prices * quantities
+    position = np.cumsum(np.where(is_buy, quantities, -quantities))
+    fees = maker_fee * notional.sum()
+    cash = np.where(is_buy, -notional, notional).sum() - fees
+    final_position = position[-1] if len(position) else 0.0
+    return Result(config, float(cash + final_position * last_price), float(final_position),
+                  float(max(position.max(), 0)) if len(position) else 0.0,
+                  float(min(position.min(), 0)) if len(position) else 0.0,
+                  float(notional.sum()), float(fees), int(is_buy.sum()), int((~is_buy).sum()), int(placed), int(cancelled))
+
+def backtest(path, config, maker_fee=0.0, quote_balance=None, base_balance=None, levels=None):
+    """
+    回测一组参数，假设价格触及挂单价即全部成交，每次成交后立即按新锚点补齐挂单
+    quote_balance/base_balance 为现货的初始资金，为空时不限制；
+    资金始终够挂最近一档时直接用向量化结果，否则交给 replay 逐笔计算
+    levels: 已算好的 touches(path, config.price_step)，扫参数时同一 price_step 复用
+    """
+    path = np.asarray(path, dtype=float)
+    if levels is None:
+        levels = touches(path, config.price_step)
+    moves = np.diff(levels)
+    n = len(moves)
+    is_buy = moves < 0
+    prices = path[0] + levels[1:] * config.price_step
+    # 同方向连续成交的序号，决定每笔成交的数量
+    starts = np.concatenate(([True], moves[1:] != moves[:-1])) if n else np.zeros(0, dtype=bool)
+    start_index = np.flatnonzero(starts)
+    run_id = np.cumsum(starts) - 1
+    position_in_run = np.arange(n) - start_index[run_id] if n else np.zeros(0, dtype=np.int64)
+    quantities = np.where(is_buy, config.initial_buy_qty + position_in_run * config.buy_increment,
+                          config.initial_sell_qty + position_in_run * config.sell_increment)
+
+    if (quote_balance is not None or base_balance is not None) and n:
+        notional = prices * quantities
+        quote = (np.inf if quote_balance is None else quote_balance) + np.concatenate(
+            ([0], np.cumsum(np.where(is_buy, -notional, notional) - maker_fee * notional)[:-1]))
+        base = (np.inf if base_balance is None else base_balance) + np.concatenate(
+            ([0], np.cumsum(np.where(is_buy, quantities, -quantities))[:-1]))
+        if np.any(np.where(is_buy, quote < notional, base < quantities)):
+            return replay(path, config, maker_fee, quote_balance, base_balance, levels)
+
+    # 挂撤单数量：成交一侧只补最远一档；另一侧整体平移，数量递增不为0时整侧撤掉重挂，
+    # 只有刚结束的反向连续成交恰好一笔时与原挂单重合
+    run_length = np.diff(np.append(start_index, n))
+    previous_run = np.zeros(n, dtype=np.int64)
+    previous_run[start_index[1:]] = run_length[:-1]
+    opposite_increment = np.where(is_buy, config.sell_increment, config.buy_increment)
+    shifted = np.where((opposite_increment != 0) & (previous_run != 1), config.num_orders, 1)
+    placed = 2 * config.num_orders + n + shifted.sum()
+    return _summarize(config, prices, quantities, is_buy, path[-1], maker_fee, placed, shifted.sum())
+
+def replay(path, config, maker_fee=0.0, quote_balance=None, base_balance=None, levels=None):
+    """
+    逐笔成交的回测，每次成交后像 ws_grid.update_orders 一样按余额截断网格、用 diff_levels 调整挂单
+    backtest 的参考实现，资金不足时也由它处理
+    """
+    path = np.asarray(path, dtype=float)
+    if levels is None:
+        levels = touches(path, config.price_step)
+    quote = math.inf if quote_balance is None else quote_balance
+    base = math.inf if base_balance is None else base_balance
+    # 价格用档位序号表示，真实价格为 path[0] + 序号 * price_step
+    to_price = lambda index: float(path[0]) + index * config.price_step
+    # 起始时两侧都从初始数量开始挂
+    last_side, last_qty, anchor = 'Ask', config.initial_sell_qty - config.sell_increment, 0
+    live = []
+    placed = cancelled = 0
+    fills = []
+
+    def refresh():
+        nonlocal live, placed, cancelled
+        bids, asks = build_ladder(last_side, last_qty, anchor, 1, config.num_orders, config.initial_buy_qty,
+                                  config.buy_increment, config.initial_sell_qty, config.sell_increment)
+        desired = []
+        quote_left, base_left = quote, base
+        for _, index, qty in bids:
+            if quote_left < to_price(index) * qty:
+                break
+            quote_left -= to_price(index) * qty
+            desired.append(Level('Bid', index, round(qty, 10)))
+        for _, index, qty in asks:
+            if base_left < qty:
+                break
+            base_left -= qty
+            desired.append(Level('Ask', index, round(qty, 10)))
+        to_cancel, to_place = diff_levels(desired, live)
+        cancelled_ids = set(map(id, to_cancel))
+        live = [each for each in live if id(each) not in cancelled_ids] + [level._asdict() for level in to_place]
+        placed += len(to_place)
+        cancelled += len(to_cancel)
+
+    refresh()
+    for index in levels[1:]:
+        side = 'Bid' if index == anchor - 1 else 'Ask' if index == anchor + 1 else None
+        order = next((each for each in live if each['side'] == side and each['price'] == index), None)
+        if order is None:
+            continue
+        live.remove(order)
+        price, qty = to_price(index), order['quantity']
+        if side == 'Bid':
+            quote -= price * qty * (1 + maker_fee)
+            base += qty
+        else:
+            quote += price * qty * (1 - maker_fee)
+            base -= qty
+        fills.append((price, qty, side == 'Bid'))
+        last_side, last_qty, anchor = side, qty, index
+        refresh()
+
+    prices, quantities, is_buy = (np.array(each) for each in zip(*fills)) if fills else (np.zeros(0),) * 3
+    return _summarize(config, prices, quantities, is_buy.astype(bool), path[-1], maker_fee, placed, cancelled)
+
+# 进程池中每个进程只在启动时接收一次价格路径
+_worker = {}
+
+def _init_worker(path, options):
+    _worker.update(path=path, options=options, step=None, levels=None)
+
+def _run_chunk(configs):
+    results = []
+    for config in configs:
+        if config.price_step != _worker['step']:
+            _worker['step'], _worker['levels'] = config.price_step, touches(_worker['path'], config.price_step)
+        results.append(backtest(_worker['path'], config, levels=_worker['levels'], **_worker['options']))
+    return results
+
+def grid_configs(price_steps, num_orders, initial_buy_qtys, buy_increments, initial_sell_qtys, sell_increments):
+    """各参数取值的全部组合"""
+    return [GridConfig(*each) for each in itertools.product(price_steps, num_orders, initial_buy_qtys, buy_increments,
+                                                            initial_sell_qtys, sell_increments)]
+
+def sweep(path, configs, maker_fee=0.0, quote_balance=None, base_balance=None, workers=None, chunk_size=64):
+    """
+    在进程池中回测多组参数，返回与 configs 顺序一致的结果
+    参数按 price_step 排序后分块，同一块内相同 price_step 的档位序列只计算一次
+    """
+    path = np.asarray(path, dtype=float)
+    options = {'maker_fee': maker_fee, 'quote_balance': quote_balance, 'base_balance': base_balance}
+    order = sorted(range(len(configs)), key=lambda i: configs[i].price_step)
+    chunks = [[configs[i] for i in order[start:start + chunk_size]] for start in range(0, len(order), chunk_size)]
+    if workers == 1:
+        _init_worker(path, options)
+        chunk_results = map(_run_chunk, chunks)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                          initargs=(path, options))
+        with executor:
+            chunk_results = list(executor.map(_run_chunk, chunks))
+    results = [None] * len(configs)
+    for i, result in zip(order, itertools.chain.from_iterable(chunk_results)):
+        results[i] = result
+    return results
+
+def main():
+    from api.Public_api import PublicAPI
+
+    parse_list = lambda value: [float(each) for each in value.split(',')]
+    parser = argparse.ArgumentParser(description='网格参数回测')
+    parser.add_argument('--symbol', required=True)
+    parser.add_argument('--interval', default='1m', choices=sorted(c.KLINE_INTERVALS))
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--steps', type=parse_list, required=True, help='priceStep，逗号分隔')
+    parser.add_argument('--orders', type=lambda value: [int(each) for each in value.split(',')], default=[3])
+    parser.add_argument('--buy-qty', type=parse_list, default=[1.0])
+    parser.add_argument('--buy-inc', type=parse_list, default=[0.0])
+    parser.add_argument('--sell-qty', type=parse_list, default=[1.0])
+    parser.add_argument('--sell-inc', type=parse_list, default=[0.0])
+    parser.add_argument('--fee', type=float, default=0.0, help='maker 手续费率')
+    parser.add_argument('--quote-balance', type=float)
+    parser.add_argument('--base-balance', type=float)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    public_api = PublicAPI(base_url=os.getenv('BACKPACK_API_URL'))
+    end_time = int(time.time())
+    klines = load_klines(public_api, args.symbol, args.interval, end_time - int(args.days * 86400), end_time)
+    path = kline_path(klines)
+    if not len(path):
+        print(f'{args.symbol}在最近{args.days:g}天没有K线数据')
+        return
+    configs = grid_configs(args.steps, args.orders, args.buy_qty, args.buy_inc, args.sell_qty, args.sell_inc)
+    started = time.perf_counter()
+    results = sweep(path, configs, args.fee, args.quote_balance, args.base_balance, args.workers)
+    print(f'{len(klines)}根K线，{len(configs)}组参数，用时{time.perf_counter() - started:.1f}秒')
+    print(f"{'step':>8}{'orders':>7}{'buy':>8}{'+buy':>7}{'sell':>8}{'+sell':>7}{'pnl':>12}{'position':>10}"
+          f"{'fees':>10}{'fills':>8}{'placed':>8}")
+    for result in sorted(results, key=lambda each: each.pnl, reverse=True)[:args.top]:
+        print(f'{result.config.price_step:>8g}{result.config.num_orders:>7}{result.config.initial_buy_qty:>8g}'
+              f'{result.config.buy_increment:>7g}{result.config.initial_sell_qty:>8g}{result.config.sell_increment:>7g}'
+              f'{result.pnl:>12.2f}{result.position:>10g}{result.fees:>10.2f}{result.buys + result.sells:>8}'
+              f'{result.placed:>8}')
+
+
+if __name__ == '__main__':
+    main()
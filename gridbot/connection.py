@@ -0,0 +1,126 @@
+import asyncio
+import json
+import random
+import time
+import traceback
+import websockets
+from api import codec
+from api.metrics import registry as metrics
+
+
+class ConnectionManager(object):
+    """
+    Websocket 长连接管理：断线后立即重连，连续失败时按随机抖动的指数退避等待(最多 max_delay 秒)，
+    重连后重新订阅，并把断线前最后确认连接正常的时间交给 on_connect，只补齐断线期间缺失的数据
+    每隔 ping_interval 秒发送 ping，ping_timeout 秒内没有 pong 视为连接已断，不等 TCP 超时直接重连
+    metrics(标签 connection=name)：ws_ping_rtt_seconds ping往返时间，ws_message_lag_seconds 事件时间(E)到收到的延迟，
+    ws_downtime_seconds 每次断线到重新订阅完成的时间，ws_reconnects_total 断线次数
+    streams: 订阅的频道；get_signature: 私有频道的签名函数；clock: api.clock.ClockSync，用于换算交易所时间
+    on_message(stream, data): 每条推送，data 为 api.codec 解码后的结果
+    on_connect(since): 每次订阅后调用的协程，首次为 None，重连时为断线前最后收到消息或 pong 的交易所时间(毫秒)
+    """
+
+    def __init__(self, url, streams, on_message, on_connect=None, get_signature=None, clock=None, ping_interval=5,
+                 ping_timeout=3, max_delay=2.0, name='ws', metrics_registry=metrics):
+        self.url = url
+        self.streams = streams
+        self.on_message = on_message
+        self.on_connect = on_connect
+        self.get_signature = get_signature
+        self.clock = clock
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.max_delay = max_delay
+        self.name = name
+        self.metrics = metrics_registry
+        self.connected = False
+        self.last_alive = None  # 最后一次确认连接正常的交易所时间(毫秒)，首次订阅完成前为 None
+        self._disconnected_at = None
+        self._failures = 0
+
+    def server_time(self):
+        return self.clock.timestamp() if self.clock is not None else int(time.time() * 1000)
+
+    async def run_forever(self):
+        while True:
+            reason = 'closed'
+            try:
+                await self._session()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                reason = type(e).__name__
+                print(f"{self.name}连接中断: {reason} {e}")
+            self.connected = False
+            if self._disconnected_at is None:
+                self._disconnected_at = time.monotonic()
+            if self.metrics is not None:
+                self.metrics.inc('ws_reconnects_total', connection=self.name, reason=reason)
+            # 第一次立即重连，之后随机等待，避免与其他客户端同时重连
+            delay = random.uniform(0, min(self.max_delay, 0.1 * 2 ** self._failures)) if self._failures else 0
+            self._failures += 1
+            await asyncio.sleep(delay)
+
+    async def _session(self):
+        # 心跳由本类负责，关闭握手最多等待 1 秒
+        async with websockets.connect(self.url, ping_interval=None, close_timeout=1) as ws:
+            request = {'method': 'SUBSCRIBE', 'params': self.streams}
+            if self.get_signature is not None:
+                request['signature'] = self.get_signature()
+            await ws.send(json.dumps(request))
+            # 订阅之后再同步，期间的推送在接收缓冲区中等待
+            if self.on_connect is not None:
+                await self.on_connect(self.last_alive)
+            self.connected = True
+            self._failures = 0
+            self._mark_alive()
+            if self._disconnected_at is not None:
+                if self.metrics is not None:
+                    self.metrics.observe('ws_downtime_seconds', time.monotonic() - self._disconnected_at,
+                                         connection=self.name)
+                self._disconnected_at = None
+            heartbeat = asyncio.ensure_future(self._heartbeat(ws))
+            try:
+                while True:
+                    message = await ws.recv()
+                    self._mark_alive()
+                    try:
+                        stream, data = codec.default.decode_frame(message)
+                        self._observe_lag(data)
+                        self.on_message(stream, data)
+                    except Exception as e:
+                        # 单条消息处理出错不断开连接
+                        print(f"{self.name}消息处理错误: {e}\n{traceback.format_exc()}")
+            finally:
+                heartbeat.cancel()
+
+    async def _heartbeat(self, ws):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            started = time.perf_counter()
+            try:
+                pong_waiter = await ws.ping()
+                await asyncio.wait_for(pong_waiter, self.ping_timeout)
+            except asyncio.TimeoutError:
+                print(f"{self.name} {self.ping_timeout}秒未收到pong，重新连接")
+                if self.metrics is not None:
+                    self.metrics.inc('ws_ping_timeouts_total', connection=self.name)
+                await ws.close()  # recv() 随即抛出 ConnectionClosed
+                return
+            except websockets.ConnectionClosed:
+                return
+            self._mark_alive()
+            if self.metrics is not None:
+                self.metrics.observe('ws_ping_rtt_seconds', time.perf_counter() - started, connection=self.name)
+
+    def _mark_alive(self):
+        self.last_alive = self.server_time()
+
+    def _observe_lag(self, data):
+        # 事件时间 E 为交易所时间(微秒)
+        if self.metrics is None:
+            return
+        event_time = getattr(data, 'event_time', None) if not isinstance(data, dict) else data.get('E')
+        if event_time:
+            lag = self.server_time() / 1000 - int(event_time) / 1000000
+            self.metrics.observe('ws_message_lag_seconds', max(lag, 0), connection=self.name)
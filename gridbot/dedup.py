@@ -0,0 +1,143 @@
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from api.metrics import registry as metrics
+
+
+class DedupStore(object):
+    """
+    有界的已处理事件记录(订单号等)，判断和登记都是 O(1)
+    超过 max_size 时淘汰最久未用到的记录，登记超过 ttl 秒(None 不过期)的记录视为过期，
+    再次命中的记录在内存中重新计时。指定 path 时每次登记(add)追加写入本地文件，重启时加载，
+    交易所重放的旧成交不会被重复处理；文件行数超过 max_size 两倍时整理重写
+    命中/未命中次数和当前大小记录在 metrics 中(标签 store=name)
+    """
+
+    def __init__(self, name, path=None, max_size=10000, ttl=7 * 86400, metrics_registry=metrics):
+        self.name = name
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.metrics = metrics_registry
+        self._entries = OrderedDict()  # key -> 过期时间(time.time())，最久未用到的在前
+        self._lock = threading.Lock()
+        self._file = None
+        self._lines = 0
+        if path is not None:
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        key = str(key)
+        with self._lock:
+            expires = self._entries.get(key)
+            hit = expires is not None and expires > time.time()
+            if hit:
+                self._touch(key, persist=False)  # 命中只在内存中刷新，不写文件
+            elif expires is not None:
+                del self._entries[key]
+                self._count_eviction('ttl')
+            size = len(self._entries)
+        if self.metrics is not None:
+            self.metrics.inc('dedup_lookups_total', store=self.name, result='hit' if hit else 'miss')
+            self.metrics.set('dedup_size', size, store=self.name)
+        return hit
+
+    def add(self, key):
+        """登记一个已处理的事件"""
+        with self._lock:
+            self._touch(str(key))
+            self._evict()
+            size = len(self._entries)
+        if self.metrics is not None:
+            self.metrics.set('dedup_size', size, store=self.name)
+
+    def seen(self, key):
+        """处理过返回 True，否则登记并返回 False"""
+        if key in self:
+            return True
+        self.add(key)
+        return False
+
+    def _touch(self, key, persist=True):
+        expires = time.time() + self.ttl if self.ttl is not None else float('inf')
+        self._entries[key] = expires
+        self._entries.move_to_end(key)
+        if persist:
+            self._append(key, expires)
+
+    def _evict(self):
+        now = time.time()
+        while self._entries:
+            key, expires = next(iter(self._entries.items()))
+            if len(self._entries) > self.max_size:
+                self._count_eviction('lru')
+            elif expires <= now:
+                self._count_eviction('ttl')
+            else:
+                break
+            del self._entries[key]
+
+    def _count_eviction(self, reason):
+        if self.metrics is not None:
+            self.metrics.inc('dedup_evictions_total', store=self.name, reason=reason)
+
+    # 持久化
+
+    def load(self):
+        """读取本地文件，后写入的行覆盖先写入的，文件损坏的行忽略"""
+        entries = OrderedDict()
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        key, expires = line.split()
+                        entries[key] = float(expires)
+                    except ValueError:
+                        continue
+                    entries.move_to_end(key)
+        except OSError:
+            pass
+        with self._lock:
+            self._entries = entries
+            self._evict()
+            self._compact()
+
+    def _append(self, key, expires):
+        if self.path is None:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self._file.write(f'{key} {expires!r}\n')
+        self._file.flush()
+        self._lines += 1
+        if self._lines > 2 * self.max_size:
+            self._compact()
+
+    def _compact(self):
+        # 只保留当前记录，写入临时文件后原子替换
+        if self.path is None:
+            return
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.dedup-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.writelines(f'{key} {expires!r}\n' for key, expires in self._entries.items())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._lines = len(self._entries)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
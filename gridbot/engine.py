@@ -0,0 +1,230 @@
+import asyncio
+import concurrent.futures
+import inspect
+import os
+import time
+from api import codec
+from api.metrics import registry as metrics
+from .connection import ConnectionManager
+from .ledger import Ledger
+from .strategy import GridStrategy
+
+
+class GridEngine(object):
+    """
+    在一个进程中运行多个交易对的网格策略
+    所有策略共用一个 AsyncAuthAPI(同一个HTTP/2连接池)、一个Websocket连接和一个消息通知函数，
+    Websocket推送(订单和盘口)按交易对分发给对应的策略
+    auth_api 需设置 typed = True，余额、订单等返回 api.models 对象
+    """
+
+    def __init__(self, auth_api, public_api, ws_url, market_cache, clock=None, send_message=print, dry_run=False,
+                 state_dir=None):
+        self.auth_api = auth_api
+        self.public_api = public_api
+        self.ws_url = ws_url
+        self.market_cache = market_cache
+        self.clock = clock
+        self._send_message = send_message
+        self.dry_run = dry_run
+        self.state_dir = state_dir  # 已处理成交等状态文件所在目录，None 时只保存在内存中
+        self.strategies = {}  # 交易对 -> GridStrategy
+        self.ledger = Ledger()  # 所有交易对共用的余额/保证金账本，由订单推送更新
+        self._ledger_lock = asyncio.Lock()
+        self.connection = None  # 订单推送连接，start_listen 中创建
+        self.loop = None  # 运行中的事件循环，其他线程的通知经由它转交
+        self.backfill_margin = 1000  # 重连补齐成交时多往前查询的毫秒数
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        market_cache.on_change(self.on_market_change)
+
+    def add_strategy(self, **config):
+        """按配置创建并登记一个 GridStrategy，参数见 GridStrategy.__init__"""
+        strategy = GridStrategy(self, **config)
+        if strategy.symbol in self.strategies:
+            raise ValueError(f'Duplicate grid for {strategy.symbol}.')
+        self.strategies[strategy.symbol] = strategy
+        return strategy
+
+    def send_message(self, message):
+        self._send_message(message)
+
+    def state_path(self, name):
+        """状态文件路径，未设置 state_dir 时返回 None"""
+        return os.path.join(self.state_dir, name) if self.state_dir is not None else None
+
+    async def safe_api_call(self, func, *args, **kwargs):
+        """
+        安全的API调用，带重试和超时处理
+        重试次数记在 call_retries_total{call=函数名}，与按接口("METHOD /path")统计的 retries_total 分开
+        """
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                result = func(*args, **kwargs)
+                # 同时支持同步客户端(PublicAPI)和异步客户端(AsyncAuthAPI)
+                if inspect.isawaitable(result):
+                    result = await result
+                return result
+            except Exception as e:
+                metrics.inc('call_retries_total', call=func.__name__, reason=type(e).__name__)
+                if attempt < max_retries - 1:
+                    wait_time = self.retry_delay(func, e, attempt)
+                    print(f"API调用失败，{wait_time}秒后重试 ({attempt + 1}/{max_retries}): {str(e)}")
+                    await asyncio.sleep(wait_time)
+                else:
+                    raise e
+
+    def retry_delay(self, func, error, attempt):
+        """重试前的等待时间，限频(429)时按交易所给出的 Retry-After 等待，其余错误指数退避"""
+        response = getattr(error, 'response', None)
+        if response is not None and response.status_code == 429:
+            # 客户端限速器已经暂停发送，直接重新排队即可
+            if getattr(getattr(func, '__self__', None), 'rate_limiter', None) is not None:
+                return 0
+            try:
+                return float(response.headers.get('Retry-After') or 1)
+            except ValueError:
+                return 1
+        return 2 ** attempt
+
+    async def get_balance(self, *assets):
+        """获取资产余额(含借贷抵押)，添加超时和重试机制"""
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                collateral, balances = await asyncio.gather(self.auth_api.get_collaterals(),
+                                                            self.auth_api.get_balances())
+                return self.merge_balance(assets, collateral, balances)
+            except Exception as e:
+                metrics.inc('call_retries_total', call='get_balance', reason=type(e).__name__)
+                if attempt < max_retries - 1:
+                    print(f"获取余额失败，重试 ({attempt + 1}/{max_retries}): {e}")
+                    await asyncio.sleep(2 ** attempt)  # 指数退避
+                else:
+                    raise e
+
+    @staticmethod
+    def merge_balance(assets, collateral, balances):
+        """现货余额加上借出(lend)的数量，返回 {资产: {'free': 可用, 'locked': 冻结}}"""
+        balance = {each: {'free': 0.0, 'locked': 0.0} for each in assets}
+        for each in assets:
+            if each in balances:
+                balance[each]['free'] = balances[each].available
+                balance[each]['locked'] = balances[each].locked
+            if each in collateral.assets:
+                balance[each]['free'] += collateral.assets[each].lend_quantity
+        return balance
+
+    async def refresh_ledger(self):
+        """从REST核对账本：现货余额、保证金、合约持仓和各策略的本地挂单"""
+        async with self._ledger_lock:
+            ledger = self.ledger
+            # 多个策略同时发现需要核对时只拉取一次
+            if not ledger.due():
+                return
+            # get_collaterals 只查询一次，现货余额和合约保证金共用；没有现货交易对时不查询现货余额
+            spot_assets = ledger.spot_assets
+            calls = [self.safe_api_call(self.auth_api.get_collaterals)]
+            if spot_assets:
+                calls.append(self.safe_api_call(self.auth_api.get_balances))
+            if ledger.has_perp:
+                calls.append(self.safe_api_call(self.auth_api.get_open_futures_positions))
+            results = await asyncio.gather(*calls)
+            collateral = results[0]
+            balances = None
+            if spot_assets:
+                balances = {asset: each['free'] + each['locked']
+                            for asset, each in self.merge_balance(spot_assets, collateral, results[1]).items()}
+            positions = None
+            if ledger.has_perp:
+                positions = {symbol: 0.0 for symbol in ledger.positions}
+                for each in results[-1] or []:
+                    if each['symbol'] in positions:
+                        positions[each['symbol']] = float(each['netQuantity'])
+            else:
+                collateral = None
+            open_orders = {symbol: list(strategy.order_book.orders.values())
+                           for symbol, strategy in self.strategies.items()}
+            drift = ledger.load_snapshot(open_orders, balances=balances, collateral=collateral, positions=positions)
+            if drift:
+                print(f"账本与交易所不一致，已按REST修正: {drift}")
+
+    def get_signature(self):
+        """生成Websocket连接所需签名"""
+        timestamp = self.clock.timestamp() if self.clock is not None else int(time.time() * 1000)
+        return self.auth_api.signer.ws_signature(timestamp)
+
+    def on_market_change(self, symbol, old_market, new_market):
+        """
+        后台刷新发现交易对参数变化时通知对应的策略
+        由 MarketCache 的刷新线程调用，交给事件循环放入该策略的任务队列，与挂单更新依次执行
+        """
+        strategy = self.strategies.get(symbol)
+        if strategy is None:
+            return
+        if self.loop is None:
+            self.apply_market_change(strategy, new_market)  # 事件循环尚未运行，没有并发的挂单更新
+        else:
+            self.loop.call_soon_threadsafe(strategy.add_task, self.apply_market_change, strategy, new_market)
+
+    def apply_market_change(self, strategy, new_market):
+        try:
+            strategy.on_market_change(new_market)
+        except ValueError as e:
+            self.send_message(f"{strategy.symbol}交易对参数变化后网格参数不再有效: {e}")
+
+    async def start_listen(self):
+        """
+        在同一个Websocket连接上订阅全部交易对的订单推送和盘口(depth)，断线后由 ConnectionManager 立即重连，
+        交易对增加时连接数不变
+        """
+        self.loop = asyncio.get_running_loop()
+        # 空闲时定期 ping 交易所，成交推送到达时HTTP连接仍然可用
+        self.auth_api.start_keepalive()
+        streams = [f'account.orderUpdate.{symbol}' for symbol in self.strategies] + \
+                  [f'depth.{symbol}' for symbol in self.strategies]
+        self.connection = ConnectionManager(self.ws_url, streams, self.on_message, on_connect=self.on_connect,
+                                            get_signature=self.get_signature, clock=self.clock, name='engine')
+        await self.connection.run_forever()
+
+    async def on_connect(self, since):
+        """
+        每次订阅后调用：先加载各交易对的盘口快照，首次连接时各策略以最近成交为锚点挂单，
+        重连时保留挂单，只补上断线前最后收到消息(since，毫秒)之后的成交
+        """
+        results = await asyncio.gather(*[strategy.depth_book.resync() for strategy in self.strategies.values()],
+                                       return_exceptions=True)
+        for symbol, result in zip(self.strategies, results):
+            if isinstance(result, Exception):
+                print(f"{symbol}盘口快照加载失败，暂不做穿价检查: {result}")
+        if since is not None:
+            since -= self.backfill_margin
+            print(f"重新连接，补齐{since}之后的成交")
+        await asyncio.gather(*[strategy.start(since) for strategy in self.strategies.values()])
+
+    def on_message(self, stream, update):
+        """按交易对分发订单推送和盘口推送"""
+        if stream and stream.startswith('depth.'):
+            strategy = self.strategies.get(stream[len('depth.'):])
+            # 出现序号缺口时在后台重新加载快照，期间的推送由盘口缓存
+            if strategy is not None and update and strategy.depth_book.on_event(update):
+                asyncio.ensure_future(strategy.depth_book.resync())
+            return
+        if not isinstance(update, codec.OrderUpdate):
+            return  # 订阅确认等非订单推送
+        self.ledger.apply(update)
+        strategy = self.strategies.get(update.symbol)
+        if strategy is not None:
+            strategy.on_order_update(update)
+
+    def run(self, loop):
+        """运行直到被中断，断线重连由 start_listen 负责"""
+        # 启动时提前建立HTTP连接
+        try:
+            loop.run_until_complete(self.auth_api.prewarm())
+        except Exception as e:
+            print(f"预先建立连接失败: {e}")
+        try:
+            loop.run_until_complete(self.start_listen())
+        except KeyboardInterrupt:
+            self.send_message("程序被用户中断")
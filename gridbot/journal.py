@@ -0,0 +1,168 @@
+import os
+import tempfile
+import threading
+import time
+from api import codec
+from api.metrics import registry as metrics
+
+
+class Journal(object):
+    """
+    追加写入的策略状态日志(write-ahead log)，状态是一个 key -> value 字典
+    每次 set/delete 先写入一行 JSON 再更新内存中的状态，后台线程每隔 fsync_interval 秒
+    把新写入的内容一次性 fsync 到磁盘(批量提交)；写入超过 compact_every 行后
+    把当前状态写成一行快照，原子替换日志文件
+    重启时 replay 快照和其后的记录即可恢复状态，崩溃时写了一半的最后一行会被忽略
+    path 为 None 时只在内存中保存
+    """
+
+    def __init__(self, path, fsync_interval=0.05, compact_every=1000, metrics_registry=metrics):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.metrics = metrics_registry
+        self.state = {}
+        self._records = 0  # 上次快照之后写入的记录数
+        self._file = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if path is not None:
+            self.replay()
+            self._file = open(path, 'ab')
+            self._file.truncate(self._valid_size)
+            self._thread = threading.Thread(target=self._sync_forever, name=f'journal-{os.path.basename(path)}',
+                                            daemon=True)
+            self._thread.start()
+
+    def get(self, key, default=None):
+        return self.state.get(key, default)
+
+    def set(self, key, value):
+        # 保存编码再解码后的副本，调用方之后原地修改传入的列表/字典不会改变已记录的状态
+        value = codec.default.loads(codec.default.dumps(value))
+        if self.state.get(key) == value:
+            return
+        self._write({'op': 'set', 'k': key, 'v': value})
+        self.state[key] = value
+        self._maybe_compact()
+
+    def delete(self, key):
+        if key not in self.state:
+            return
+        self._write({'op': 'del', 'k': key})
+        del self.state[key]
+        self._maybe_compact()
+
+    def replay(self):
+        """从日志文件恢复状态，返回恢复出的状态"""
+        state = {}
+        records = 0
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = b''
+        # 崩溃时未写完的最后一行(没有换行符)丢弃，打开文件时截掉
+        self._valid_size = data.rfind(b'\n') + 1
+        for line in data[:self._valid_size].splitlines():
+            try:
+                record = codec.default.loads(line)
+            except codec.DECODE_ERRORS:
+                continue
+            self._apply(state, record)
+            records += 1
+        self.state, self._records = state, records
+        return state
+
+    @staticmethod
+    def _apply(state, record):
+        op = record.get('op')
+        if op == 'snapshot':
+            state.clear()
+            state.update(record['state'])
+        elif op == 'set':
+            state[record['k']] = record['v']
+        elif op == 'del':
+            state.pop(record['k'], None)
+
+    def _write(self, record):
+        if self.path is None:
+            return
+        with self._lock:
+            self._file.write(codec.default.dumps(record) + b'\n')
+            self._file.flush()  # 进程崩溃不丢失，掉电最多丢失最近 fsync_interval 秒
+            self._dirty = True
+            self._records += 1
+        if self.metrics is not None:
+            self.metrics.inc('journal_records_total', journal=os.path.basename(self.path))
+
+    def _maybe_compact(self):
+        # 快照要包含刚写入的记录，所以在更新内存状态之后检查
+        if self.path is not None and self._records >= self.compact_every:
+            self.compact()
+
+    def sync(self):
+        """立即 fsync 已写入的记录"""
+        with self._lock:
+            if not self._dirty or self._file is None:
+                return
+            self._dirty = False
+            fd = self._file.fileno()
+            started = time.perf_counter()
+            os.fsync(fd)
+        if self.metrics is not None:
+            self.metrics.observe('journal_fsync_seconds', time.perf_counter() - started,
+                                 journal=os.path.basename(self.path))
+
+    def _sync_forever(self):
+        while not self._stop.wait(self.fsync_interval):
+            try:
+                self.sync()
+            except (OSError, ValueError) as e:
+                print(f'journal {self.path} fsync error: {e}')
+
+    def compact(self):
+        """把当前状态写成一条快照记录，原子替换日志文件"""
+        if self.path is None:
+            return
+        with self._lock:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(prefix='.journal-', dir=directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(codec.default.dumps({'op': 'snapshot', 'state': self.state}) + b'\n')
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            self._sync_directory(directory)
+            self._file.close()
+            self._file = open(self.path, 'ab')
+            self._dirty = False
+            self._records = 1
+
+    @staticmethod
+    def _sync_directory(directory):
+        # 文件替换本身也需要落盘，POSIX 以外的系统不支持时跳过
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def close(self):
+        self._stop.set()
+        if self._file is not None:
+            self.sync()
+            with self._lock:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,44 @@
+from collections import namedtuple, Counter
+from decimal import Decimal
+
+
+Level = namedtuple('Level', ['side', 'price', 'quantity'])
+
+def build_ladder(last_side, last_qty, last_price, price_step, num_orders, initial_buy_qty, buy_increment,
+                 initial_sell_qty, sell_increment):
+    """以最后一笔成交为锚点计算买卖两侧挂单，返回(bids, asks)，均由近到远排列"""
+    if last_side == 'Bid':
+        first_buy_qty = last_qty + buy_increment
+        first_sell_qty = initial_sell_qty
+    else:
+        first_buy_qty = initial_buy_qty
+        first_sell_qty = last_qty + sell_increment
+    bids = [Level('Bid', last_price - (i + 1) * price_step, first_buy_qty + i * buy_increment) for i in range(num_orders)]
+    asks = [Level('Ask', last_price + (i + 1) * price_step, first_sell_qty + i * sell_increment) for i in range(num_orders)]
+    return bids, asks
+
+def level_key(side, price, quantity):
+    """价格和数量统一为规范化的Decimal，交易所返回的'150.50'与本地的'150.5'视为同一档"""
+    return (side, Decimal(str(price)).normalize(), Decimal(str(quantity)).normalize())
+
+def diff_levels(desired, live):
+    """
+    比较目标挂单与当前挂单
+    desired: Level列表; live: 交易所订单列表(含id/side/price/quantity)
+    返回(需要撤销的订单, 需要新挂的Level)，价格数量都相同的挂单保留不动
+    """
+    wanted = Counter(level_key(*level) for level in desired)
+    to_cancel = []
+    for order in live:
+        key = level_key(order['side'], order['price'], order['quantity'])
+        if wanted[key] > 0:
+            wanted[key] -= 1
+        else:
+            to_cancel.append(order)
+    to_place = []
+    for level in desired:
+        key = level_key(*level)
+        if wanted[key] > 0:
+            wanted[key] -= 1
+            to_place.append(level)
+    return to_cancel, to_place
@@ -0,0 +1,195 @@
+import time
+from api.metrics import registry as metrics
+from api.models import Order
+from .dedup import DedupStore
+
+
+class Ledger(object):
+    """
+    本地余额/保证金账本，从REST取一次快照，之后按挂单(冻结)、撤单(释放)、成交(结算)更新，
+    下单前的余额检查只查内存，不再每次调用 get_collaterals / get_balances
+    现货记录每种资产的总额(free + locked)，冻结金额由账本中的挂单计算；
+    合约记录账户可用保证金(netEquityAvailable)、初始保证金率(imf)和各交易对的净持仓，
+    合约挂单冻结 价格*数量*imf(统一账户中现货挂单冻结全部金额)，成交后按持仓绝对值的变化占用或释放保证金
+    已实现盈亏、资金费等推送中没有的变化由定期核对修正：超过 reconcile_interval 秒，
+    或发现异常(余额为负、推送缺失)时 due() 返回 True，需要重新拉取快照
+    """
+
+    def __init__(self, reconcile_interval=300, tolerance=1e-6, metrics_registry=metrics):
+        self.reconcile_interval = reconcile_interval
+        self.tolerance = tolerance
+        self.metrics = metrics_registry
+        self.markets = {}  # 交易对 -> (base, quote, marketType)
+        self.totals = {}  # 资产 -> 总额
+        self.equity_available = 0.0
+        self.imf = 0.0
+        self.positions = {}  # 合约交易对 -> 净持仓
+        self.orders = {}  # 订单号 -> [交易对, side, 价格, 未成交数量]
+        self.needs_snapshot = True
+        self.snapshot_time = 0
+        self._closed = DedupStore('ledger.closed', max_size=1000, ttl=None, metrics_registry=metrics_registry)
+        self._trades = DedupStore('ledger.trades', max_size=1000, ttl=None, metrics_registry=metrics_registry)
+
+    def add_market(self, symbol, base_asset, quote_asset, market_type):
+        self.markets[symbol] = (base_asset, quote_asset, market_type)
+        if market_type == 'SPOT':
+            self.totals.setdefault(base_asset, 0.0)
+            self.totals.setdefault(quote_asset, 0.0)
+        else:
+            self.positions.setdefault(symbol, 0.0)
+        self.needs_snapshot = True
+
+    @property
+    def spot_assets(self):
+        return sorted(self.totals)
+
+    @property
+    def has_perp(self):
+        return bool(self.positions)
+
+    def due(self):
+        """需要从REST核对时返回 True"""
+        return self.needs_snapshot or time.monotonic() - self.snapshot_time > self.reconcile_interval
+
+    # 查询
+
+    def total(self, asset):
+        return self.totals.get(asset, 0.0)
+
+    def locked(self, asset):
+        """现货挂单冻结的数量：买单冻结计价资产，卖单冻结基础资产"""
+        locked = 0.0
+        for symbol, side, price, remaining in self.orders.values():
+            base, quote, market_type = self.markets[symbol]
+            if market_type != 'SPOT':
+                continue
+            if side == 'Bid' and quote == asset:
+                locked += price * remaining
+            elif side == 'Ask' and base == asset:
+                locked += remaining
+        return locked
+
+    def free(self, asset):
+        return self.total(asset) - self.locked(asset)
+
+    # 快照
+
+    def load_snapshot(self, open_orders, balances=None, collateral=None, positions=None):
+        """
+        用REST结果重建账本，返回与账本原有数值的偏差 {名称: 偏差}
+        open_orders 为 {交易对: 挂单列表(dict 或 api.models.Order)}，balances 为 {资产: 总额}，
+        collateral 为 get_collaterals 的结果(api.models.Collateral)，positions 为 {合约交易对: 净持仓}
+        """
+        drift = {}
+        if self.snapshot_time:
+            for asset, value in (balances or {}).items():
+                if asset in self.totals:
+                    drift[asset] = value - self.totals[asset]
+            for symbol, value in (positions or {}).items():
+                if symbol in self.positions:
+                    drift[symbol] = value - self.positions[symbol]
+            if collateral is not None:
+                drift['equity'] = collateral.net_equity_available - self.equity_available
+        for asset, value in (balances or {}).items():
+            if asset in self.totals:
+                self.totals[asset] = value
+        if collateral is not None:
+            self.equity_available = collateral.net_equity_available or 0.0
+            self.imf = collateral.imf or 0.0
+        for symbol, value in (positions or {}).items():
+            if symbol in self.positions:
+                self.positions[symbol] = value
+        # 快照中的可用保证金已扣除挂单冻结，重建挂单时不再扣除
+        self.orders.clear()
+        for symbol, orders in open_orders.items():
+            for order in orders:
+                order = order.to_dict() if isinstance(order, Order) else order
+                remaining = float(order['quantity']) - float(order.get('executedQuantity') or 0)
+                self.orders[order['id']] = [symbol, order['side'], float(order['price']), remaining]
+        self.needs_snapshot = False
+        self.snapshot_time = time.monotonic()
+        drift = {name: value for name, value in drift.items() if abs(value) > self.tolerance}
+        if self.metrics is not None:
+            self.metrics.inc('ledger_reconciles_total', result='drift' if drift else 'ok')
+            for name, value in drift.items():
+                self.metrics.set('ledger_drift', value, item=name)
+        return drift
+
+    # 推送更新
+
+    def reserve(self, symbol, order_id, side, price, quantity):
+        """登记新挂单并冻结资金，REST返回和推送先到的一方生效"""
+        if order_id in self.orders or order_id in self._closed:
+            return
+        price, quantity = float(price), float(quantity)
+        self.orders[order_id] = [symbol, side, price, quantity]
+        self.equity_available -= self._margin(symbol, price, quantity)
+        self._check()
+
+    def release(self, order_id):
+        """订单撤销/过期，释放剩余冻结"""
+        order = self.orders.pop(order_id, None)
+        self._closed.add(order_id)
+        if order is None:
+            return
+        symbol, _, price, remaining = order
+        self.equity_available += self._margin(symbol, price, remaining)
+
+    def release_symbol(self, symbol):
+        """撤销某交易对全部挂单后调用"""
+        for order_id in [key for key, order in self.orders.items() if order[0] == symbol]:
+            self.release(order_id)
+
+    def settle(self, symbol, order_id, side, price, quantity, fee=0.0, fee_symbol=None, trade_id=None):
+        """结算一笔成交，trade_id 重复的成交只结算一次"""
+        if trade_id is not None and self._trades.seen(trade_id):
+            return
+        base, quote, market_type = self.markets[symbol]
+        price, quantity = float(price), float(quantity)
+        order = self.orders.get(order_id)
+        if order is not None:
+            # 成交部分的挂单冻结先释放
+            self.equity_available += self._margin(symbol, order[2], quantity)
+            order[3] -= quantity
+            if order[3] <= self.tolerance:
+                del self.orders[order_id]
+                self._closed.add(order_id)
+        sign = 1 if side == 'Bid' else -1
+        if market_type == 'SPOT':
+            self.totals[base] += sign * quantity
+            self.totals[quote] -= sign * price * quantity
+            if fee and fee_symbol in self.totals:
+                self.totals[fee_symbol] -= float(fee)
+        else:
+            # 再按持仓变化占用或释放保证金
+            old = self.positions[symbol]
+            self.positions[symbol] = old + sign * quantity
+            self.equity_available -= (abs(self.positions[symbol]) - abs(old)) * price * self.imf
+            if fee and fee_symbol == quote:
+                self.equity_available -= float(fee)
+        self._check()
+
+    def _margin(self, symbol, price, quantity):
+        # 挂单冻结的保证金
+        if self.markets[symbol][2] == 'SPOT':
+            return price * quantity
+        return price * quantity * self.imf
+
+    def apply(self, update):
+        """处理一条 account.orderUpdate 推送(api.codec.OrderUpdate)，未登记的交易对忽略"""
+        if update.symbol not in self.markets:
+            return
+        if update.event == 'orderAccepted':
+            remaining = float(update.quantity or 0) - float(update.executed_quantity or 0)
+            self.reserve(update.symbol, update.order_id, update.side, update.price or 0, remaining)
+        elif update.event == 'orderFill':
+            self.settle(update.symbol, update.order_id, update.side, update.fill_price, update.fill_quantity,
+                        float(update.fee or 0), update.fee_symbol, update.trade_id)
+        elif update.event in ('orderCancelled', 'orderExpired'):
+            self.release(update.order_id)
+
+    def _check(self):
+        # 余额为负说明账本与交易所不一致(漏掉推送或快照与推送重叠)，下次使用前重新核对
+        if any(value < -self.tolerance for value in self.totals.values()) or \
+                (self.has_perp and self.equity_available < -self.tolerance):
+            self.needs_snapshot = True
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from api.metrics import registry as metrics
+
+
+# Telegram 单条消息的最大长度
+MAX_MESSAGE_LENGTH = 4096
+
+class Notifier(object):
+    """
+    非阻塞的消息通知(Telegram等)
+    send() 可以在任何线程调用，只把消息放入有界队列后立即返回，不会给交易路径增加延迟；
+    专用线程中的发送任务收到消息后再等待 window 秒，把这段时间内的消息合并成一条发送，
+    相同的消息只保留一条并注明次数，两次发送至少间隔 min_interval 秒，
+    被限频(异常带 retry_after，如 telegram.error.RetryAfter)时按要求等待后重试
+    队列满时丢弃新消息，丢弃的条数附在下一条消息末尾
+    sender 为发送一条文本的协程函数，例如 lambda text: bot.send_message(chat_id=chat_id, text=text)
+    """
+
+    def __init__(self, sender, window=2.0, min_interval=1.0, max_queue=1000, max_retries=3,
+                 metrics_registry=metrics):
+        self.sender = sender
+        self.window = window
+        self.min_interval = min_interval
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.metrics = metrics_registry
+        self._queue = deque()  # (放入时间, 消息)
+        self._dropped = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._thread = None
+        self._task = None
+        self._last_sent = 0
+
+    def send(self, message):
+        """放入队列，队列满时丢弃"""
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                self._dropped += 1
+                dropped = True
+            else:
+                self._queue.append((time.monotonic(), str(message)))
+                dropped = False
+            size = len(self._queue)
+        if self.metrics is not None:
+            if dropped:
+                self.metrics.inc('notifier_messages_total', result='dropped')
+            self.metrics.set('notifier_queue_size', size)
+        if not dropped and self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                pass  # 已停止
+
+    # 发送线程
+
+    def start(self):
+        if self._thread is not None:
+            return
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name='notifier', daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def stop(self, timeout=10):
+        """发送完队列中剩余的消息后停止"""
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._task.cancel)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self, ready):
+        # Python 3.9 的 asyncio.Event() 绑定当前线程的事件循环，先设置好本线程的循环再创建
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self._send_forever())
+        self._loop = loop
+        if self._queue:
+            self._wakeup.set()
+        ready.set()
+        try:
+            loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop = None
+            # 停止前把剩余消息发出去，不再合并等待
+            loop.run_until_complete(self._flush())
+            loop.close()
+
+    async def _send_forever(self):
+        while True:
+            await self._wakeup.wait()
+            # 等待一个窗口，合并期间到达的消息
+            await asyncio.sleep(self.window)
+            self._wakeup.clear()
+            await self._flush()
+
+    async def _flush(self):
+        with self._lock:
+            batch = list(self._queue)
+            self._queue.clear()
+            dropped, self._dropped = self._dropped, 0
+        if not batch and not dropped:
+            return
+        if self.metrics is not None:
+            self.metrics.set('notifier_queue_size', 0)
+            if batch:
+                # 最早一条消息在队列中等待的时间
+                self.metrics.observe('notifier_lag_seconds', time.monotonic() - batch[0][0])
+        for text in self.format(batch, dropped):
+            await self._deliver(text)
+
+    def format(self, batch, dropped=0):
+        """合并一批消息，相同消息只保留第一条并注明次数，按长度限制拆分"""
+        counts = {}
+        for _, message in batch:
+            counts[message] = counts.get(message, 0) + 1
+        if self.metrics is not None and len(batch) > len(counts):
+            self.metrics.inc('notifier_messages_total', len(batch) - len(counts), result='coalesced')
+        lines = [message if count == 1 else f'{message} (x{count})' for message, count in counts.items()]
+        if dropped:
+            lines.append(f'另有{dropped}条消息因积压被丢弃')
+        texts, current = [], ''
+        for line in lines:
+            line = line[:MAX_MESSAGE_LENGTH]
+            if current and len(current) + 1 + len(line) > MAX_MESSAGE_LENGTH:
+                texts.append(current)
+                current = line
+            else:
+                current = f'{current}\n{line}' if current else line
+        if current:
+            texts.append(current)
+        return texts
+
+    async def _deliver(self, text):
+        for attempt in range(self.max_retries):
+            wait = self._last_sent + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._last_sent = time.monotonic()
+            try:
+                await self.sender(text)
+                if self.metrics is not None:
+                    self.metrics.inc('notifier_messages_total', result='sent')
+                return
+            except Exception as e:
+                if self.metrics is not None:
+                    self.metrics.inc('notifier_send_errors_total', error=type(e).__name__)
+                retry_after = getattr(e, 'retry_after', None)
+                if retry_after is None or attempt == self.max_retries - 1:
+                    print(f"发送通知失败: {e}")
+                    return
+                # 被限频，按要求的时间(秒数或 timedelta)等待后重试
+                if hasattr(retry_after, 'total_seconds'):
+                    retry_after = retry_after.total_seconds()
+                await asyncio.sleep(retry_after)
@@ -0,0 +1,94 @@
+from decimal import Decimal
+from api.models import Order
+from .dedup import DedupStore
+
+
+# 订单不再挂在盘口上的状态
+CLOSED_STATUS = ('Filled', 'Cancelled', 'Expired', 'TriggerFailed')
+
+class LocalOrderBook(object):
+    """
+    由 account.orderUpdate 推送维护的本地挂单状态，按订单号索引
+    订单统一保存为 REST 接口的格式(id/side/price/quantity/executedQuantity/status)，
+    只有重连或发现推送缺失时才需要重新拉取 REST 快照
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.orders = {}
+        self.levels = {'Bid': {}, 'Ask': {}}  # side -> {价格: {订单号}}
+        self.needs_snapshot = True
+        self._closed = DedupStore(f'{symbol}.closed', max_size=1000, ttl=None)  # 最近关闭的订单号，用于识别重复推送
+
+    def load_snapshot(self, open_orders):
+        """用 REST get_open_orders 的结果重建本地状态"""
+        self.orders.clear()
+        self.levels = {'Bid': {}, 'Ask': {}}
+        for order in open_orders:
+            self.add(order)
+        self.needs_snapshot = False
+
+    def add(self, order):
+        """登记新挂单(dict 或 api.models.Order)，REST 返回和推送的 New 事件先到的一方生效"""
+        order = order.to_dict() if isinstance(order, Order) else dict(order)
+        if order['id'] in self.orders or order['id'] in self._closed:
+            return
+        order['price_key'] = Decimal(order['price'])
+        self.orders[order['id']] = order
+        self.levels[order['side']].setdefault(order['price_key'], set()).add(order['id'])
+
+    def remove(self, order_id):
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return None
+        level = self.levels[order['side']][order['price_key']]
+        level.discard(order_id)
+        if not level:
+            del self.levels[order['side']][order['price_key']]
+        self._closed.add(order_id)
+        return order
+
+    def mark_cancelling(self, order_id):
+        """程序自己发出的撤单，推送确认前不再算作挂单"""
+        if order_id in self.orders:
+            self.orders[order_id]['cancelRequested'] = True
+
+    def unmark_cancelling(self, order_id):
+        """撤单请求失败，订单仍在盘口上，重新算作挂单"""
+        if order_id in self.orders:
+            self.orders[order_id].pop('cancelRequested', None)
+
+    def apply(self, update):
+        """
+        处理一条 orderUpdate 推送(api.codec.OrderUpdate)，返回该订单此前的本地状态(未知订单返回 None)
+        对未知订单的成交/撤单推送说明中间有缺失，标记需要重新拉取快照
+        """
+        order_id = update.order_id
+        status = update.status
+        order = self.orders.get(order_id)
+        if order is None:
+            # 已关闭订单的重复推送直接忽略
+            if order_id in self._closed:
+                return None
+            if status == 'New':
+                self.add({'id': order_id, 'side': update.side, 'price': update.price, 'quantity': update.quantity,
+                          'executedQuantity': update.executed_quantity or '0', 'status': status})
+            else:
+                self.needs_snapshot = True
+            return None
+        previous = dict(order)
+        if update.executed_quantity is not None:
+            order['executedQuantity'] = update.executed_quantity
+        order['status'] = status
+        if status in CLOSED_STATUS:
+            self.remove(order_id)
+        return previous
+
+    def open_orders(self, side=None):
+        """当前有效挂单，不含已发出撤单请求的订单"""
+        return [order for order in self.orders.values()
+                if not order.get('cancelRequested') and (side is None or order['side'] == side)]
+
+    def level(self, side, price):
+        """某一价格档位上的挂单"""
+        return [self.orders[each] for each in self.levels[side].get(Decimal(str(price)), ())]
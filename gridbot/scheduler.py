@@ -0,0 +1,57 @@
+import asyncio
+from collections import OrderedDict
+from api.metrics import registry as metrics
+
+
+class CoalescingScheduler(object):
+    """
+    只保留最新状态的任务队列，提供 asyncio.Queue 的 put_nowait / get / qsize / empty，没有 task_done / join
+    每个任务带一个 key，同一 key 的任务在等待执行期间再次提交时合并为一个，只保留最新的参数，
+    排队位置不变；正在执行的任务不受影响，执行完后再执行合并后的最新任务
+    不同 key 的任务按首次提交的顺序执行
+    metrics(标签 scheduler=name)：scheduler_queue_depth 等待执行的任务数，
+    scheduler_tasks_total{result} 提交(submitted)/被合并(coalesced)/取出执行(executed)的任务数，
+    scheduler_coalescing_ratio 被合并的任务占提交任务的比例
+    """
+
+    def __init__(self, name, metrics_registry=metrics):
+        self.name = name
+        self.metrics = metrics_registry
+        self._pending = OrderedDict()  # key -> 最新的任务
+        self._wakeup = asyncio.Event()
+        self._submitted = 0
+        self._coalesced = 0
+
+    def qsize(self):
+        return len(self._pending)
+
+    def empty(self):
+        return not self._pending
+
+    def put_nowait(self, item, key=None):
+        """提交任务，key 为 None 时以 item 本身为 key"""
+        key = item if key is None else key
+        self._submitted += 1
+        coalesced = key in self._pending
+        if coalesced:
+            self._coalesced += 1
+        self._pending[key] = item  # 已有的 key 保持原来的位置
+        self._wakeup.set()
+        if self.metrics is not None:
+            self.metrics.inc('scheduler_tasks_total', scheduler=self.name, result='submitted')
+            if coalesced:
+                self.metrics.inc('scheduler_tasks_total', scheduler=self.name, result='coalesced')
+            self.metrics.set('scheduler_coalescing_ratio', self._coalesced / self._submitted, scheduler=self.name)
+            self.metrics.set('scheduler_queue_depth', len(self._pending), scheduler=self.name)
+        return coalesced
+
+    async def get(self):
+        """取出最早提交的 key 的最新任务，队列为空时等待"""
+        while not self._pending:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        _, item = self._pending.popitem(last=False)
+        if self.metrics is not None:
+            self.metrics.inc('scheduler_tasks_total', scheduler=self.name, result='executed')
+            self.metrics.set('scheduler_queue_depth', len(self._pending), scheduler=self.name)
+        return item
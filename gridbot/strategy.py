@@ -0,0 +1,412 @@
+import asyncio
+import traceback
+from decimal import Decimal, ROUND_HALF_UP
+from api.depth_book import DepthBook
+from api.models import Market, Order
+from api.precision import Precision
+from .dedup import DedupStore
+from .journal import Journal
+from .ladder import Level, build_ladder, diff_levels, level_key
+from .order_book import CLOSED_STATUS, LocalOrderBook
+from .scheduler import CoalescingScheduler
+
+
+trade_side_trans = {'SPOT': {'Bid': 'BUY', 'Ask': 'SELL'}, 'PERP': {'Bid': 'LONG', 'Ask': 'SHORT'}}
+
+def format_decimal(value, unit_value):
+    """统一浮点数小数位数"""
+    value = Decimal(str(value))
+    unit_value = Decimal(str(unit_value))
+    return str(value.quantize(unit_value, rounding=ROUND_HALF_UP))
+
+
+class GridStrategy(object):
+    """
+    单个交易对的网格策略，状态都保存在实例上
+    与交易所的连接、Websocket推送和消息通知由 GridEngine 统一提供，
+    每个策略有自己的任务队列，按顺序处理本交易对的挂单更新，
+    等待期间到达的多次更新合并为一次，按最新的成交计算网格
+    """
+
+    def __init__(self, engine, base_asset, quote_asset, market_type, price_step, num_orders, initial_buy_qty,
+                 buy_increment, initial_sell_qty, sell_increment):
+        self.engine = engine
+        self.base_asset = base_asset
+        self.quote_asset = quote_asset
+        self.market_type = market_type
+        self.price_step = price_step
+        self.num_orders = num_orders
+        self.initial_buy_qty = initial_buy_qty
+        self.buy_increment = buy_increment
+        self.initial_sell_qty = initial_sell_qty
+        self.sell_increment = sell_increment
+        if market_type == 'SPOT':
+            self.symbol = base_asset + '_' + quote_asset
+        elif market_type == 'PERP':
+            self.symbol = base_asset + '_' + quote_asset + '_PERP'
+        else:
+            raise ValueError('Invalid market type. It should be SPOT or PERP.')
+        market = Market.from_dict(engine.market_cache.get(self.symbol))
+        if market.order_book_state != 'Open':
+            raise ValueError(f'Invalid trade pair: {self.symbol}.')
+        self.set_market(market)
+        engine.ledger.add_market(self.symbol, base_asset, quote_asset, market_type)
+
+        # 本地盘口，挂单价格不穿过对手盘；推送来自 engine 的共用连接，不单独建立连接
+        self.depth_book = DepthBook(self.symbol, engine.public_api, engine.ws_url)
+        self.order_book = LocalOrderBook(self.symbol)  # 由订单推送维护的本地挂单，记录程序本身取消的订单，防止触发订单取消事件进入死循环
+        # 记录成交的订单号，防止websocket重复发送(或重启后重放)导致重复挂单
+        self.filled_orders = DedupStore(f'{self.symbol}.fills', path=engine.state_path(f'.filled_orders_{self.symbol}'))
+        # 策略状态日志：最近成交和程序挂出的订单，重启时据此与交易所核对，不必撤销全部挂单
+        self.journal = Journal(engine.state_path(f'.journal_{self.symbol}'))
+        self.last_trade = None  # 最近一笔成交 (side, quantity, price)
+        self.event_handlers = {'orderFill': self.on_fill, 'orderCancelled': self.on_cancel}  # 推送事件类型(e) -> 处理函数
+        self.task_queue = CoalescingScheduler(self.symbol)
+        self._consumer = None
+
+    def set_market(self, market):
+        """读取并检查最小价格/数量单位，market 为 api.models.Market"""
+        unit_price = market.tick_size
+        unit_quantity = market.step_size
+        if unit_price > self.price_step:
+            raise ValueError(f'{self.symbol}: grid price step should be greater than the minimum price: {unit_price}.')
+        for each in [self.initial_buy_qty, self.buy_increment, self.initial_sell_qty, self.sell_increment]:
+            if (each > 0) and (each < unit_quantity):
+                raise ValueError(f'{self.symbol}: all quantity related params should be greater the minimum quantity: '
+                                 f'{unit_quantity}.')
+        self.unit_price, self.unit_quantity = unit_price, unit_quantity
+        # 网格参数换算为整数 tick/lot，只在这里换算一次
+        self.precision = Precision.from_market(market)
+        self.step_ticks = self.precision.to_ticks(self.price_step, ROUND_HALF_UP)
+        self.quantity_lots = tuple(self.precision.to_lots(each, ROUND_HALF_UP) for each in
+                                   [self.initial_buy_qty, self.buy_increment, self.initial_sell_qty, self.sell_increment])
+
+    def send_message(self, message):
+        self.engine.send_message(message)
+
+    # 任务队列
+
+    def add_task(self, func, *args, **kwargs):
+        """
+        添加任务到本策略的队列（非阻塞），同一函数尚未执行的任务只保留最新的参数
+        快速行情中连续成交时只按最后一笔成交重新挂单一次；每笔成交对余额的影响已由账本逐笔结算，
+        执行时读取的是全部成交之后的余额
+        """
+        self.task_queue.put_nowait((func, args, kwargs), key=func.__name__)
+
+    def ensure_consumer(self):
+        """确保任务消费者正在运行"""
+        if self._consumer is None or self._consumer.done():
+            if self._consumer is not None:
+                self.send_message(f"{self.symbol}重启任务消费者...")
+            self._consumer = asyncio.ensure_future(self.task_consumer())
+
+    async def task_consumer(self):
+        """任务消费者，按顺序执行队列中的任务"""
+        while True:
+            func, args, kwargs = await self.task_queue.get()
+            # 协程直接在事件循环中执行，同步函数放到线程池，添加异常处理
+            try:
+                if asyncio.iscoroutinefunction(func):
+                    await func(*args, **kwargs)
+                else:
+                    await asyncio.get_running_loop().run_in_executor(self.engine.executor, lambda: func(*args, **kwargs))
+            except Exception as e:
+                # 记录任务执行错误，但不让消费者崩溃
+                self.send_message(f"{self.symbol}任务执行失败: {func.__name__} - {str(e)}")
+                print(f"Task execution error: {traceback.format_exc()}")
+
+    # 交易所操作
+
+    async def place_orders(self, orders):
+        """批量挂单函数，orders为已格式化的(side, price, quantity)列表，返回与之一一对应的订单，失败为None"""
+        batch = [{'symbol': self.symbol, 'side': side, 'orderType': 'Limit', 'price': price,
+                  'quantity': quantity, 'timeInForce': 'GTC'} for side, price, quantity in orders]
+        engine = self.engine
+        results = [None] * len(batch)
+        pending = list(range(len(batch)))
+        max_retries = 3
+        try:
+            for attempt in range(max_retries):
+                for index, result in zip(pending, await engine.auth_api.place_batch_orders_chunked(
+                        [batch[index] for index in pending])):
+                    results[index] = result
+                # 失败的分组只有被限频(429)时确定没有下单，只重新提交这些订单，已成功的分组不会重复挂单
+                pending = [index for index in pending if isinstance(results[index], dict) and
+                           results[index].get('error') and results[index].get('code') == 429]
+                if not pending or attempt == max_retries - 1:
+                    break
+                # 客户端限速器已按 Retry-After 暂停发送，没有限速器时指数退避
+                await asyncio.sleep(0 if getattr(engine.auth_api, 'rate_limiter', None) is not None else 2 ** attempt)
+        except Exception as e:
+            self.send_message(f"{self.symbol}批量挂单失败!\n{str(e)}")
+            return [None] * len(orders)
+        # 服务器错误、超时的分组可能已经下单，下次更新前重新拉取挂单快照，避免重复挂单
+        if any(isinstance(result, dict) and result.get('error') and result.get('code') != 429 for result in results):
+            self.order_book.needs_snapshot = True
+            engine.ledger.needs_snapshot = True
+        placed = []
+        for (side, price, quantity), result in zip(orders, results):
+            if isinstance(result, Order):
+                self.order_book.add(result)
+                self.engine.ledger.reserve(self.symbol, result.id, side, price, quantity)
+                self.journal.set(f'order:{result.id}', [side, price, quantity])
+                placed.append(result)
+            else:
+                self.send_message(f"{self.symbol}挂单失败!\nside: {side} price: {price} quantity: {quantity}\n{result}")
+                placed.append(None)
+        return placed
+
+    async def cancel_orders(self, orders):
+        """按订单号并发撤单，暂时性错误按 safe_api_call 重试，仍然失败(通常是刚好成交)时恢复为挂单"""
+        engine = self.engine
+        for each in orders:
+            self.order_book.mark_cancelling(each['id'])
+        results = await asyncio.gather(
+            *[engine.safe_api_call(engine.auth_api.cancel_open_order, symbol=self.symbol, orderId=each['id'])
+              for each in orders],
+            return_exceptions=True)
+        for order, result in zip(orders, results):
+            if isinstance(result, Exception):
+                # 订单可能仍在盘口上，不能再当作已撤销，否则下次会在同一档位重复挂单；已成交的由推送移除
+                self.order_book.unmark_cancelling(order['id'])
+                print(f"撤单失败 {order['id']}: {result}")
+
+    async def refresh_order_book(self):
+        """从REST拉取挂单快照重建本地订单状态"""
+        open_orders = await self.engine.safe_api_call(self.engine.auth_api.get_open_orders, symbol=self.symbol,
+                                                      marketType=self.market_type)
+        self.order_book.load_snapshot(open_orders)
+
+    async def update_orders(self, last_trade_side, last_trade_qty, last_trade_price):
+        """计算目标网格，与当前挂单对比后只撤销和新挂有变化的档位"""
+        base_asset, quote_asset = self.base_asset, self.quote_asset
+        try:
+            # 本地订单状态缺失(启动、重连或推送中断)时才拉取REST快照，推送缺失时账本也要核对
+            if self.order_book.needs_snapshot:
+                await self.refresh_order_book()
+                self.engine.ledger.needs_snapshot = True
+            # 余额取自本地账本，只在定期核对或发现不一致时查询REST
+            ledger = self.engine.ledger
+            if ledger.due():
+                await self.engine.refresh_ledger()
+            if self.market_type == 'SPOT':
+                # 现货余额按 free + locked 计算，已有挂单锁定的资金也计入可用于网格的资金
+                base_balance = ledger.total(base_asset)
+                quote_balance = ledger.total(quote_asset)
+            else:
+                leverage_factor = ledger.imf
+                free_equity = ledger.equity_available
+            open_orders = self.order_book.open_orders()
+            if self.market_type == 'PERP':
+                # 已有挂单占用的保证金加回可用保证金
+                free_equity += sum(
+                    float(each['price']) * (float(each['quantity']) - float(each.get('executedQuantity') or 0)) * leverage_factor
+                    for each in open_orders)
+
+            # 网格在整数 tick/lot 上计算，只在生成订单时转换为交易所要求的字符串
+            p = self.precision
+            anchor = p.to_ticks(last_trade_price, ROUND_HALF_UP) // self.step_ticks * self.step_ticks
+            bids, asks = build_ladder(last_trade_side, p.to_lots(last_trade_qty, ROUND_HALF_UP), anchor, self.step_ticks,
+                                      self.num_orders, *self.quantity_lots)
+
+            # 已经挂在盘口上的档位不做穿价检查，盘口数据滞后时也不会因此撤掉挂单
+            resting = {level_key(each['side'], each['price'], each['quantity']) for each in open_orders}
+
+            # 买单：往下挂 priceStep 整数倍的价格，按余额确定整个网格
+            desired = []
+            for _, buy_ticks, buy_lots in bids:
+                buy_price, buy_qty = p.price(buy_ticks), p.qty(buy_lots)
+                if level_key('Bid', p.price_str(buy_ticks), p.qty_str(buy_lots)) not in resting and \
+                        self.depth_book.crosses('Bid', buy_price):
+                    print(f'{self.symbol}买入价{p.price_str(buy_ticks)}不低于卖一价{self.depth_book.best_ask()}，跳过该档')
+                    continue
+                if self.market_type == 'SPOT':
+                    if quote_balance < buy_price * buy_qty:
+                        self.send_message(f'{quote_asset}余额: {format_decimal(quote_balance, self.unit_price)}，'
+                                          f'无法在{p.price_str(buy_ticks)}买入{p.qty_str(buy_lots)}{base_asset}')
+                        break
+                    quote_balance -= (buy_price * buy_qty)
+                else:
+                    if free_equity < (buy_price * buy_qty * leverage_factor):
+                        self.send_message(f'保证金余额: {format_decimal(free_equity, self.unit_price)}USD，'
+                                          f'无法在{p.price_str(buy_ticks)}做多{p.qty_str(buy_lots)}{base_asset}')
+                        break
+                    free_equity -= (buy_price * buy_qty * leverage_factor)
+                desired.append(Level('Bid', p.price_str(buy_ticks), p.qty_str(buy_lots)))
+
+            # 卖单：往上挂 priceStep 整数倍的价格
+            for _, sell_ticks, sell_lots in asks:
+                sell_price, sell_qty = p.price(sell_ticks), p.qty(sell_lots)
+                if level_key('Ask', p.price_str(sell_ticks), p.qty_str(sell_lots)) not in resting and \
+                        self.depth_book.crosses('Ask', sell_price):
+                    print(f'{self.symbol}卖出价{p.price_str(sell_ticks)}不高于买一价{self.depth_book.best_bid()}，跳过该档')
+                    continue
+                if self.market_type == 'SPOT':
+                    if base_balance < sell_qty:
+                        self.send_message(f'{base_asset}余额: {format_decimal(base_balance, self.unit_price)}，'
+                                          f'无法在{p.price_str(sell_ticks)}卖出{p.qty_str(sell_lots)}{base_asset}')
+                        break
+                    base_balance -= sell_qty
+                else:
+                    if free_equity < (sell_price * sell_qty * leverage_factor):
+                        self.send_message(f'保证金余额: {format_decimal(free_equity, self.unit_price)}USD，'
+                                          f'无法在{p.price_str(sell_ticks)}做空{p.qty_str(sell_lots)}{base_asset}')
+                        break
+                    free_equity -= (sell_price * sell_qty * leverage_factor)
+                desired.append(Level('Ask', p.price_str(sell_ticks), p.qty_str(sell_lots)))
+
+            # 只撤销和新挂有变化的档位，未变化的挂单保留排队位置
+            to_cancel, to_place = diff_levels(desired, open_orders)
+            side_names = {'Bid': '买入/做多', 'Ask': '卖出/做空'}
+            if self.engine.dry_run:
+                for each in to_cancel:
+                    print(f"撤销挂单 {each['side']} {each['price']} {each['quantity']}")
+                for side, price, qty in to_place:
+                    print(f'在{price}{side_names[side]}{qty}{base_asset}挂单成功')
+                return
+            # 先撤单释放资金，再批量挂单
+            if to_cancel:
+                await self.cancel_orders(to_cancel)
+            for (side, price, qty), order in zip(to_place, await self.place_orders(to_place)):
+                if order:
+                    print(f'在{price}{side_names[side]}{qty}{base_asset}挂单成功')
+
+        except Exception as e:
+            self.send_message(f"{self.symbol}更新订单失败: {str(e)}")
+            print(f"Update orders error: {traceback.format_exc()}")
+            # 不重新抛出异常，避免任务消费者崩溃
+
+    # 由 GridEngine 调用
+
+    async def start(self, since=None):
+        """
+        (重新)连接时调用：以最近成交为锚点更新网格
+        状态日志中有上次运行的记录时保留当前挂单，与交易所核对后只调整有变化的档位，
+        否则(首次运行)取消当前挂单后重新挂单；断线重连时 since 为断线前最后收到推送的时间(毫秒)，
+        只查询此后的成交
+        """
+        try:
+            if self.journal.get('last_trade') is not None:
+                await self.warm_start(since)
+            else:
+                await self.cold_start()
+        except Exception as e:
+            self.send_message(f"{self.symbol}初始化失败: {str(e)}")
+            raise
+        self.ensure_consumer()
+        self.add_task(self.update_orders, *self.last_trade)
+
+    async def cold_start(self):
+        """取消当前挂单，同时获取最近成交记录"""
+        engine = self.engine
+        _, last_trade = await asyncio.gather(
+            engine.safe_api_call(engine.auth_api.cancel_open_orders, symbol=self.symbol),
+            engine.safe_api_call(engine.auth_api.get_fill_history, symbol=self.symbol, marketType=self.market_type))
+        self.forget_orders()
+        if last_trade:
+            self.record_trade(last_trade[0].order_id, last_trade[0].side, last_trade[0].quantity, last_trade[0].price)
+        else:
+            recent_trades = await engine.safe_api_call(engine.public_api.get_recent_trades, symbol=self.symbol)
+            self.record_trade(None, 'Ask', self.initial_sell_qty, float(recent_trades[0]['price']))
+        # 订阅之后再拉取挂单快照，之后的变化都由推送更新
+        self.order_book.needs_snapshot = True
+
+    async def warm_start(self, since=None):
+        """
+        按状态日志恢复(或断线重连)：以交易所的挂单为准重建本地订单，补上停机/断线期间完全成交的订单
+        since 不为 None 时只查询此后(毫秒)的成交
+        """
+        engine = self.engine
+        open_orders, fills = await asyncio.gather(
+            engine.safe_api_call(engine.auth_api.get_open_orders, symbol=self.symbol, marketType=self.market_type),
+            engine.safe_api_call(engine.auth_api.get_fill_history, symbol=self.symbol, marketType=self.market_type,
+                                 fromTime=since))
+        self.order_book.load_snapshot(open_orders)
+        # 期间的推送可能缺失，账本也需要核对
+        engine.ledger.needs_snapshot = True
+        live = {each.id for each in open_orders}
+        self.forget_orders(keep=live)
+        last_fill_id = self.journal.get('last_fill_id')
+        missed = {}  # 订单号 -> [side, 成交数量, 价格]，最新成交的订单在前
+        for fill in fills or []:
+            if fill.order_id == last_fill_id:
+                break
+            # 仍在盘口上的订单只是部分成交，已处理过的订单跳过
+            if fill.order_id in live or fill.order_id in self.filled_orders:
+                continue
+            # 成交记录每笔成交一行，同一订单的多笔成交合并
+            if fill.order_id in missed:
+                missed[fill.order_id][1] += fill.quantity
+            else:
+                missed[fill.order_id] = [fill.side, fill.quantity, fill.price]
+        period = '停机' if since is None else '断线'
+        if missed:
+            # 期间有订单完全成交，以最新成交的订单为锚点，并登记订单号避免推送重放时重复处理
+            for order_id in missed:
+                self.filled_orders.add(order_id)
+            latest_id = next(iter(missed))
+            side, quantity, price = missed[latest_id]
+            # 只查询了 since 之后的成交，订单之前的部分成交不在其中，数量和价格以订单本身为准
+            orders = await engine.safe_api_call(engine.auth_api.get_orders, orderId=latest_id)
+            if orders:
+                quantity, price = orders[0].quantity, orders[0].price
+            self.record_trade(latest_id, side, quantity, price)
+            self.send_message(f"{self.symbol}{period}期间成交{len(missed)}个订单，最近一个: "
+                              f"{trade_side_trans[self.market_type][side]} {quantity}{self.base_asset} at {price}")
+        else:
+            self.last_trade = tuple(self.journal.get('last_trade'))
+        print(f"{self.symbol}{period}后恢复，保留{len(open_orders)}个挂单")
+
+    def record_trade(self, order_id, side, quantity, price):
+        """更新最近成交并写入状态日志"""
+        self.last_trade = (side, quantity, price)
+        self.journal.set('last_trade', list(self.last_trade))
+        self.journal.set('last_fill_id', order_id)
+
+    def forget_orders(self, keep=()):
+        """从状态日志中删除已不在盘口上的订单"""
+        for key in [each for each in self.journal.state if each.startswith('order:')]:
+            if key[len('order:'):] not in keep:
+                self.journal.delete(key)
+
+    def on_order_update(self, update):
+        """处理本交易对的一条 account.orderUpdate 推送(api.codec.OrderUpdate)，按事件类型分发"""
+        # 定期检查任务消费者状态
+        self.ensure_consumer()
+        previous = self.order_book.apply(update)
+        if update.status in CLOSED_STATUS:
+            self.journal.delete(f'order:{update.order_id}')
+        handler = self.event_handlers.get(update.event)
+        if handler is not None:
+            handler(update, previous)
+
+    def on_fill(self, update, previous):
+        """成交推送，订单完全成交后以成交价为锚点更新网格"""
+        if update.status != 'Filled':
+            return
+        # 已处理的成交订单(websocket服务器重复发送)
+        if update.order_id in self.filled_orders:
+            return
+        # 新的成交订单
+        self.record_trade(update.order_id, update.side, float(update.quantity), float(update.price))
+        side, qty, price = self.last_trade
+        self.add_task(self.update_orders, *self.last_trade)
+        # 通知不阻塞，直接发送，不排在更新挂单之前
+        self.send_message(f"{trade_side_trans[self.market_type][side]} {qty}{self.base_asset} at {price}")
+        self.filled_orders.add(update.order_id)
+
+    def on_cancel(self, update, previous):
+        """撤单推送"""
+        # 程序本身更新订单时取消的订单(或本地未记录的订单)，不处理
+        if previous is None or previous.get('cancelRequested'):
+            return
+        # 人为取消的订单，按推送中记录的最近成交重新挂单补上，无需再查询REST
+        self.add_task(self.update_orders, *self.last_trade)
+
+    def on_market_change(self, market_info):
+        """交易对参数变化时更新最小价格/数量单位"""
+        market = Market.from_dict(market_info)
+        self.set_market(market)
+        self.send_message(f"{self.symbol}交易对参数变化: 状态{market.order_book_state}，"
+                          f"最小价格单位{self.unit_price}，最小数量单位{self.unit_quantity}")
@@ -0,0 +1,5 @@
+'''
+Local mock of the Backpack exchange (REST + WebSocket) for offline load tests and benchmarks
+'''
+from .engine import MatchingEngine, Market, MockError
+from .server import MockExchange
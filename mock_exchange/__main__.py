@@ -0,0 +1,38 @@
+'''
+Run a local mock exchange:
+
+    python -m mock_exchange --port 8000 --ws-port 8001 --simulate SOL_USDC:150
+
+then start a bot with BACKPACK_API_URL=http://127.0.0.1:8000 BACKPACK_WS_URL=ws://127.0.0.1:8001
+'''
+import argparse
+import threading
+from .server import MockExchange
+from .simulator import MarketSimulator
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local mock of the Backpack exchange')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--ws-port', type=int, default=8001)
+    parser.add_argument('--clock-offset', type=int, default=0, help='exchange clock offset in ms')
+    parser.add_argument('--simulate', action='append', default=[], metavar='SYMBOL:PRICE',
+                        help='drive a random-walk market for SYMBOL starting at PRICE')
+    parser.add_argument('--volatility', type=float, default=0.001)
+    parser.add_argument('--interval', type=float, default=0.5)
+    args = parser.parse_args()
+
+    exchange = MockExchange(host=args.host, port=args.port, ws_port=args.ws_port, clock_offset=args.clock_offset).start()
+    for each in args.simulate:
+        symbol, price = each.split(':')
+        MarketSimulator(exchange.engine, symbol, price, volatility=args.volatility, interval=args.interval).start()
+    print(f'REST: {exchange.api_url}  WebSocket: {exchange.ws_url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        exchange.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,507 @@
+import bisect
+import itertools
+import threading
+import time
+from collections import deque
+from decimal import Decimal
+
+
+class MockError(Exception):
+
+    def __init__(self, code, message, status=400):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+def now_us():
+    return int(time.time() * 1000000)
+
+def fmt(value):
+    # Decimal -> exchange style string without exponent
+    return format(value.normalize(), 'f') if value else '0'
+
+
+class Market(object):
+
+    def __init__(self, symbol, tick_size, step_size, market_type=None, imf='0.02', min_quantity=None):
+        self.symbol = symbol
+        parts = symbol.split('_')
+        self.base = parts[0]
+        self.quote = parts[1]
+        self.market_type = market_type or ('PERP' if symbol.endswith('_PERP') else 'SPOT')
+        self.tick_size = Decimal(tick_size)
+        self.step_size = Decimal(step_size)
+        self.min_quantity = Decimal(min_quantity) if min_quantity else self.step_size
+        self.imf = Decimal(imf)
+
+    def to_dict(self):
+        return {'symbol': self.symbol, 'baseSymbol': self.base, 'quoteSymbol': self.quote,
+                'marketType': self.market_type, 'orderBookState': 'Open', 'createdAt': '2024-01-01T00:00:00',
+                'filters': {'price': {'tickSize': fmt(self.tick_size), 'minPrice': fmt(self.tick_size), 'maxPrice': None},
+                            'quantity': {'stepSize': fmt(self.step_size), 'minQuantity': fmt(self.min_quantity),
+                                         'maxQuantity': None}},
+                'imfFunction': None, 'mmfFunction': None, 'fundingInterval': 28800000 if self.market_type == 'PERP' else None}
+
+
+class Order(object):
+
+    __slots__ = ('id', 'client_id', 'account', 'market', 'side', 'order_type', 'price', 'quantity', 'quote_quantity',
+                 'executed', 'executed_quote', 'status', 'time_in_force', 'post_only', 'reduce_only', 'created_at',
+                 'locked')
+
+    def remaining(self):
+        return self.quantity - self.executed
+
+    def to_dict(self):
+        return {'id': self.id, 'clientId': self.client_id, 'symbol': self.market.symbol, 'side': self.side,
+                'orderType': self.order_type, 'price': fmt(self.price) if self.price is not None else None,
+                'quantity': fmt(self.quantity), 'executedQuantity': fmt(self.executed),
+                'executedQuoteQuantity': fmt(self.executed_quote), 'quoteQuantity': fmt(self.quote_quantity)
+                if self.quote_quantity is not None else None, 'status': self.status, 'timeInForce': self.time_in_force,
+                'postOnly': self.post_only, 'reduceOnly': self.reduce_only, 'selfTradePrevention': 'RejectTaker',
+                'createdAt': self.created_at // 1000, 'triggerPrice': None, 'triggerQuantity': None}
+
+
+class Account(object):
+
+    def __init__(self, key, balances):
+        self.key = key
+        self.balances = {asset: {'available': Decimal(str(qty)), 'locked': Decimal(0)} for asset, qty in balances.items()}
+        self.positions = {}  # PERP symbol -> [net quantity, entry price]
+        self.fills = []  # (time ms, fill)
+        self.orders = {}  # order history, id -> Order
+        self.settings = {'autoBorrowSettlements': True, 'autoLend': False, 'autoRealizePnl': True,
+                         'autoRepayBorrows': True, 'leverageLimit': '10'}
+
+    def balance(self, asset):
+        return self.balances.setdefault(asset, {'available': Decimal(0), 'locked': Decimal(0)})
+
+
+class BookSide(object):
+    # Price levels in priority order (bids high to low, asks low to high), FIFO queue per level
+
+    def __init__(self, side):
+        self.side = side
+        self.prices = []  # sorted ascending
+        self.levels = {}
+        self.touched = set()  # prices changed since the last depth event
+
+    def best(self):
+        if not self.prices:
+            return None
+        return self.prices[-1] if self.side == 'Bid' else self.prices[0]
+
+    def add(self, order):
+        self.touched.add(order.price)
+        if order.price not in self.levels:
+            bisect.insort(self.prices, order.price)
+            self.levels[order.price] = deque()
+        self.levels[order.price].append(order)
+
+    def remove(self, order):
+        level = self.levels.get(order.price)
+        if level is None:
+            return
+        try:
+            level.remove(order)
+        except ValueError:
+            return
+        self.touched.add(order.price)
+        if not level:
+            self._drop(order.price)
+
+    def _drop(self, price):
+        self.touched.add(price)
+        del self.levels[price]
+        self.prices.pop(bisect.bisect_left(self.prices, price))
+
+    def crosses(self, taker_side, price):
+        best = self.best()
+        if best is None:
+            return False
+        if price is None:
+            return True
+        return best <= price if taker_side == 'Bid' else best >= price
+
+    def depth(self, limit=None):
+        prices = self.prices if self.side == 'Ask' else self.prices[::-1]
+        if limit:
+            prices = prices[:limit]
+        return [(price, self.size(price)) for price in prices]
+
+    def size(self, price):
+        level = self.levels.get(price)
+        return sum(each.remaining() for each in level) if level else Decimal(0)
+
+
+class MatchingEngine(object):
+    '''
+    Price-time priority limit order books plus the account state the REST and
+    WebSocket layers expose. All methods are thread-safe.
+    listeners are called as listener(account_key, stream, data); account_key is
+    None for public streams.
+    '''
+
+    def __init__(self, markets, initial_balances=None, maker_fee='0', taker_fee='0'):
+        self.markets = {each.symbol: each for each in markets}
+        self.initial_balances = initial_balances if initial_balances is not None else {'USDC': 100000}
+        self.maker_fee = Decimal(maker_fee)
+        self.taker_fee = Decimal(taker_fee)
+        self.accounts = {}
+        self.books = {symbol: {'Bid': BookSide('Bid'), 'Ask': BookSide('Ask')} for symbol in self.markets}
+        self.trades = {symbol: deque(maxlen=1000) for symbol in self.markets}
+        self.last_price = {}
+        self.open_orders = {}  # id -> Order
+        self._tops = {symbol: None for symbol in self.markets}  # last published best bid/ask
+        self._ticker_ids = {symbol: 0 for symbol in self.markets}
+        self.update_ids = {symbol: 0 for symbol in self.markets}  # depth sequence, lastUpdateId of the REST snapshot
+        self.listeners = []
+        self.lock = threading.RLock()
+        self._order_ids = itertools.count(int(time.time() * 1000) * 1000)
+        self._trade_ids = itertools.count(1)
+
+    # Accounts
+
+    def account(self, key):
+        with self.lock:
+            if key not in self.accounts:
+                self.accounts[key] = Account(key, self.initial_balances)
+            return self.accounts[key]
+
+    def deposit(self, key, asset, quantity):
+        with self.lock:
+            self.account(key).balance(asset)['available'] += Decimal(str(quantity))
+
+    def market(self, symbol):
+        if symbol not in self.markets:
+            raise MockError('INVALID_MARKET', f'Market {symbol} not found', 404)
+        return self.markets[symbol]
+
+    # Orders
+
+    def place_order(self, key, symbol, side, orderType, price=None, quantity=None, quoteQuantity=None, timeInForce='GTC',
+                    postOnly=False, reduceOnly=False, clientId=None, **kwargs):
+        with self.lock:
+            market = self.market(symbol)
+            account = self.account(key)
+            if side not in ('Bid', 'Ask'):
+                raise MockError('INVALID_CLIENT_REQUEST', f'Invalid side {side}')
+            order = Order()
+            order.id = str(next(self._order_ids))
+            order.client_id = int(clientId) if clientId is not None else None
+            order.account = account
+            order.market = market
+            order.side = side
+            order.order_type = 'Limit' if orderType == 'Limit' else 'Market'
+            order.price = self._check_price(market, price) if order.order_type == 'Limit' else None
+            order.quote_quantity = Decimal(str(quoteQuantity)) if quoteQuantity is not None else None
+            if quantity is not None:
+                order.quantity = self._check_quantity(market, quantity)
+            elif order.order_type == 'Market' and order.quote_quantity is not None:
+                order.quantity = None
+            else:
+                raise MockError('INVALID_CLIENT_REQUEST', 'Quantity is required')
+            order.executed = Decimal(0)
+            order.executed_quote = Decimal(0)
+            order.status = 'New'
+            order.time_in_force = timeInForce or 'GTC'
+            order.post_only = postOnly in (True, 'true')
+            order.reduce_only = reduceOnly in (True, 'true')
+            order.created_at = now_us()
+            if order.quantity is None:
+                # Market buy by quote quantity: size it against the current book
+                order.quantity = self._quantity_for_quote(order)
+            opposite = self.books[symbol]['Ask' if side == 'Bid' else 'Bid']
+            if order.post_only and opposite.crosses(side, order.price):
+                raise MockError('INVALID_ORDER', 'Order would immediately match and take')
+            if order.time_in_force == 'FOK' and self._fillable(order, opposite) < order.quantity:
+                raise MockError('INVALID_ORDER', 'Fill or kill order cannot be filled')
+            self._lock_funds(order)
+            account.orders[order.id] = order
+            self._emit_order(order, 'orderAccepted')
+            self._match(order, opposite)
+            if order.status in ('New', 'PartiallyFilled'):
+                if order.order_type == 'Limit' and order.time_in_force == 'GTC':
+                    self.books[symbol][side].add(order)
+                    self.open_orders[order.id] = order
+                else:
+                    self._close(order, 'Expired', 'orderExpired')
+            self._emit_book(market)
+            return order.to_dict()
+
+    def cancel_order(self, key, symbol, orderId=None, clientId=None):
+        with self.lock:
+            market = self.market(symbol)
+            order = self._find_open(key, market, orderId, clientId)
+            if order is None:
+                raise MockError('RESOURCE_NOT_FOUND', 'Order not found', 404)
+            self.books[symbol][order.side].remove(order)
+            self._close(order, 'Cancelled', 'orderCancelled')
+            self._emit_book(market)
+            return order.to_dict()
+
+    def cancel_orders(self, key, symbol, orderType=None):
+        with self.lock:
+            market = self.market(symbol)
+            orders = [each for each in self.open_orders.values() if each.account.key == key and each.market is market]
+            result = []
+            for order in orders:
+                self.books[symbol][order.side].remove(order)
+                self._close(order, 'Cancelled', 'orderCancelled')
+                result.append(order.to_dict())
+            self._emit_book(market)
+            return result
+
+    def get_open_order(self, key, symbol, orderId=None, clientId=None):
+        with self.lock:
+            order = self._find_open(key, self.market(symbol), orderId, clientId)
+            if order is None:
+                raise MockError('RESOURCE_NOT_FOUND', 'Order not found', 404)
+            return order.to_dict()
+
+    def get_open_orders(self, key, symbol=None, marketType=None):
+        with self.lock:
+            return [each.to_dict() for each in self.open_orders.values()
+                    if each.account.key == key and (symbol is None or each.market.symbol == symbol)
+                    and (marketType is None or each.market.market_type == marketType)]
+
+    # Matching
+
+    def _check_price(self, market, price):
+        if price is None:
+            raise MockError('INVALID_CLIENT_REQUEST', 'Price is required for limit orders')
+        price = Decimal(str(price))
+        if price <= 0 or price % market.tick_size:
+            raise MockError('INVALID_PRICE', f'Price {price} is not a multiple of the tick size {fmt(market.tick_size)}')
+        return price
+
+    def _check_quantity(self, market, quantity):
+        quantity = Decimal(str(quantity))
+        if quantity < market.min_quantity or quantity % market.step_size:
+            raise MockError('INVALID_QUANTITY', f'Quantity {quantity} is not a multiple of the step size '
+                            f'{fmt(market.step_size)}')
+        return quantity
+
+    def _quantity_for_quote(self, order):
+        book = self.books[order.market.symbol]['Ask' if order.side == 'Bid' else 'Bid']
+        budget = order.quote_quantity
+        quantity = Decimal(0)
+        for price, available in book.depth():
+            take = min(available, (budget / price).quantize(order.market.step_size, rounding='ROUND_DOWN'))
+            quantity += take
+            budget -= take * price
+            if take < available:
+                break
+        return quantity
+
+    def _fillable(self, order, opposite):
+        total = Decimal(0)
+        for price, available in opposite.depth():
+            if order.price is not None and ((order.side == 'Bid' and price > order.price) or
+                                            (order.side == 'Ask' and price < order.price)):
+                break
+            total += available
+        return total
+
+    def _match(self, taker, opposite):
+        market = taker.market
+        while taker.remaining() > 0 and opposite.crosses(taker.side, taker.price):
+            price = opposite.best()
+            level = opposite.levels[price]
+            maker = level[0]
+            quantity = min(taker.remaining(), maker.remaining())
+            trade_id = next(self._trade_ids)
+            self._fill(maker, price, quantity, trade_id, True)
+            self._fill(taker, price, quantity, trade_id, False)
+            opposite.touched.add(price)
+            if maker.remaining() == 0:
+                level.popleft()
+                if not level:
+                    opposite._drop(price)
+            self._record_trade(market, price, quantity, taker, maker, trade_id)
+
+    def _fill(self, order, price, quantity, trade_id, is_maker):
+        market = order.market
+        account = order.account
+        quote_value = price * quantity
+        fee_rate = self.maker_fee if is_maker else self.taker_fee
+        order.executed += quantity
+        order.executed_quote += quote_value
+        if market.market_type == 'PERP':
+            fee_symbol = market.quote
+            fee = quote_value * fee_rate
+            self._release(order, quantity)
+            self._settle_position(account, market, order.side, price, quantity)
+            account.balance(fee_symbol)['available'] -= fee
+        elif order.side == 'Bid':
+            fee_symbol = market.base
+            fee = quantity * fee_rate
+            self._release(order, quantity)
+            account.balance(market.quote)['available'] -= quote_value
+            account.balance(market.base)['available'] += quantity - fee
+        else:
+            fee_symbol = market.quote
+            fee = quote_value * fee_rate
+            self._release(order, quantity)
+            account.balance(market.base)['available'] -= quantity
+            account.balance(market.quote)['available'] += quote_value - fee
+        order.status = 'Filled' if order.remaining() == 0 else 'PartiallyFilled'
+        if order.status == 'Filled':
+            self.open_orders.pop(order.id, None)
+        timestamp = now_us()
+        account.fills.append((timestamp // 1000, {'tradeId': trade_id, 'orderId': order.id, 'symbol': market.symbol, 'side': order.side,
+                              'price': fmt(price), 'quantity': fmt(quantity), 'fee': fmt(fee), 'feeSymbol': fee_symbol,
+                              'isMaker': is_maker, 'clientId': order.client_id, 'systemOrderType': None,
+                              'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(timestamp / 1000000))
+                              + '.%03d' % (timestamp // 1000 % 1000)}))
+        self._emit_order(order, 'orderFill', fill=(trade_id, price, quantity, fee, fee_symbol, is_maker))
+
+    def _settle_position(self, account, market, side, price, quantity):
+        position = account.positions.setdefault(market.symbol, [Decimal(0), Decimal(0)])
+        signed = quantity if side == 'Bid' else -quantity
+        net, entry = position
+        if net == 0 or (net > 0) == (signed > 0):
+            total = net + signed
+            position[1] = (entry * abs(net) + price * quantity) / abs(total)
+            position[0] = total
+            return
+        closed = min(abs(net), quantity)
+        pnl = (price - entry) * closed * (1 if net > 0 else -1)
+        account.balance(market.quote)['available'] += pnl
+        position[0] = net + signed
+        if position[0] == 0:
+            position[1] = Decimal(0)
+        elif (position[0] > 0) != (net > 0):
+            position[1] = price
+
+    def _lock_funds(self, order):
+        market = order.market
+        if market.market_type == 'PERP':
+            reference = order.price if order.price is not None else self.last_price.get(market.symbol, Decimal(0))
+            amount = reference * order.quantity * market.imf
+            asset = market.quote
+        elif order.side == 'Bid':
+            reference = order.price if order.price is not None else self._worst_price(order)
+            amount = reference * order.quantity
+            asset = market.quote
+        else:
+            amount = order.quantity
+            asset = market.base
+        balance = order.account.balance(asset)
+        if balance['available'] < amount:
+            raise MockError('INSUFFICIENT_FUNDS', f'Insufficient {asset} balance')
+        balance['available'] -= amount
+        balance['locked'] += amount
+        order.locked = amount
+
+    def _worst_price(self, order):
+        depth = self.books[order.market.symbol]['Ask'].depth()
+        remaining = order.quantity
+        for price, available in depth:
+            remaining -= available
+            if remaining <= 0:
+                return price
+        return depth[-1][0] if depth else Decimal(0)
+
+    def _release(self, order, quantity):
+        # Unlock the share of the reserved funds that belongs to the filled quantity
+        market = order.market
+        asset = market.base if market.market_type == 'SPOT' and order.side == 'Ask' else market.quote
+        remaining = order.remaining()  # already reduced by this fill
+        amount = order.locked if remaining <= 0 else order.locked * quantity / (remaining + quantity)
+        order.locked -= amount
+        balance = order.account.balance(asset)
+        balance['locked'] -= amount
+        balance['available'] += amount
+
+    def _close(self, order, status, event):
+        if order.locked:
+            market = order.market
+            asset = market.base if market.market_type == 'SPOT' and order.side == 'Ask' else market.quote
+            balance = order.account.balance(asset)
+            balance['locked'] -= order.locked
+            balance['available'] += order.locked
+            order.locked = Decimal(0)
+        order.status = status
+        self.open_orders.pop(order.id, None)
+        self._emit_order(order, event)
+
+    def _find_open(self, key, market, order_id, client_id):
+        for order in self.open_orders.values():
+            if order.account.key != key or order.market is not market:
+                continue
+            if (order_id is not None and order.id == str(order_id)) or (
+                    client_id is not None and order.client_id == int(client_id)):
+                return order
+        return None
+
+    def _record_trade(self, market, price, quantity, taker, maker, trade_id):
+        timestamp = now_us()
+        trade = {'id': trade_id, 'price': fmt(price), 'quantity': fmt(quantity), 'quoteQuantity': fmt(price * quantity),
+                 'timestamp': timestamp // 1000, 'isBuyerMaker': maker.side == 'Bid'}
+        self.trades[market.symbol].appendleft(trade)
+        self.last_price[market.symbol] = price
+        self._publish(None, f'trade.{market.symbol}', {
+            'e': 'trade', 'E': timestamp, 's': market.symbol, 'p': fmt(price), 'q': fmt(quantity),
+            'b': maker.id if maker.side == 'Bid' else taker.id, 'a': maker.id if maker.side == 'Ask' else taker.id,
+            't': trade_id, 'T': timestamp, 'm': maker.side == 'Bid'})
+
+    # Events
+
+    def _emit_order(self, order, event, fill=None):
+        timestamp = now_us()
+        data = {'e': event, 'E': timestamp, 's': order.market.symbol, 'c': order.client_id, 'S': order.side,
+                'o': order.order_type.upper(), 'f': order.time_in_force, 'q': fmt(order.quantity),
+                'p': fmt(order.price) if order.price is not None else None, 'X': order.status, 'i': order.id,
+                'z': fmt(order.executed), 'Z': fmt(order.executed_quote), 'V': 'RejectTaker', 'T': timestamp}
+        if order.quote_quantity is not None:
+            data['Q'] = fmt(order.quote_quantity)
+        if fill is not None:
+            trade_id, price, quantity, fee, fee_symbol, is_maker = fill
+            data.update({'t': trade_id, 'L': fmt(price), 'l': fmt(quantity), 'n': fmt(fee), 'N': fee_symbol,
+                         'm': is_maker})
+        self._publish(order.account.key, f'account.orderUpdate.{order.market.symbol}', data)
+
+    def _emit_book(self, market):
+        self._emit_depth(market)
+        self._emit_book_ticker(market)
+
+    def _emit_depth(self, market):
+        # depth.<symbol> with the new size of every level changed by one operation, '0' for removed levels
+        changes = {}
+        for side in ('Bid', 'Ask'):
+            book = self.books[market.symbol][side]
+            changes[side] = [[fmt(price), fmt(book.size(price))] for price in sorted(book.touched)]
+            book.touched.clear()
+        if not (changes['Bid'] or changes['Ask']):
+            return
+        self.update_ids[market.symbol] += 1
+        update_id = str(self.update_ids[market.symbol])
+        timestamp = now_us()
+        self._publish(None, f'depth.{market.symbol}', {
+            'e': 'depth', 'E': timestamp, 's': market.symbol, 'a': changes['Ask'], 'b': changes['Bid'],
+            'U': update_id, 'u': update_id, 'T': timestamp})
+
+    def _emit_book_ticker(self, market):
+        # bookTicker.<symbol> whenever the best bid or ask (price or size) changes
+        tops = []
+        for side in ('Bid', 'Ask'):
+            book = self.books[market.symbol][side]
+            best = book.best()
+            tops.append((best, book.size(best) if best is not None else None))
+        if tops == self._tops[market.symbol]:
+            return
+        self._tops[market.symbol] = tops
+        self._ticker_ids[market.symbol] += 1
+        (bid, bid_size), (ask, ask_size) = tops
+        timestamp = now_us()
+        self._publish(None, f'bookTicker.{market.symbol}', {
+            'e': 'bookTicker', 'E': timestamp, 's': market.symbol, 'a': fmt(ask) if ask is not None else None,
+            'A': fmt(ask_size) if ask is not None else None, 'b': fmt(bid) if bid is not None else None,
+            'B': fmt(bid_size) if bid is not None else None, 'u': str(self._ticker_ids[market.symbol]), 'T': timestamp})
+
+    def _publish(self, key, stream, data):
+        for listener in self.listeners:
+            listener(key, stream, data)
@@ -0,0 +1,490 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+import nacl.exceptions
+import nacl.signing
+import websockets
+from api import consts as c
+from api import utils
+from .engine import MatchingEngine, Market, MockError, fmt
+
+
+DEFAULT_MARKETS = [Market('SOL_USDC', '0.01', '0.01'), Market('SOL_USDC_PERP', '0.01', '0.01'),
+                   Market('BTC_USDC', '0.1', '0.00001'), Market('TAO_USDC_PERP', '0.01', '0.01')]
+
+
+def _make_handler(exchange):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        wbufsize = -1  # headers and body in one write, avoids Nagle / delayed-ACK stalls on keep-alive
+        disable_nagle_algorithm = True
+
+        def _handle(self):
+            parsed = urlsplit(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            if exchange.latency:
+                time.sleep(exchange.latency)
+            status, payload = exchange.handle(self.command, parsed.path, dict(parse_qsl(parsed.query)), body, self.headers)
+            if payload is None:
+                content, content_type = b'', 'text/plain'
+            elif isinstance(payload, str):
+                content, content_type = payload.encode(), 'text/plain'
+            else:
+                content, content_type = json.dumps(payload).encode(), 'application/json'
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = do_POST = do_DELETE = do_PATCH = _handle
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class MockExchange(object):
+    '''
+    Local stand-in for api.backpack.exchange and ws.backpack.exchange.
+    REST requests are checked the same way utils.pre_hash signs them (the API key
+    is the base64 Ed25519 verifying key), orders go through MatchingEngine and
+    account.orderUpdate events are pushed to subscribed WebSocket clients.
+
+        exchange = MockExchange().start()
+        client = AuthAPI(api_key, api_secret, base_url=exchange.api_url)
+    '''
+
+    def __init__(self, markets=None, host='127.0.0.1', port=0, ws_port=0, clock_offset=0,
+                 batch_limit=c.BATCH_ORDER_LIMIT, latency=0, **engine_kwargs):
+        self.engine = MatchingEngine(markets or DEFAULT_MARKETS, **engine_kwargs)
+        self.engine.listeners.append(self._on_event)
+        self.host = host
+        self.port = port
+        self.ws_port = ws_port
+        self.clock_offset = clock_offset  # ms, simulates an exchange clock ahead of (or behind) the local one
+        self.batch_limit = batch_limit
+        self.latency = latency  # seconds added to every REST response, simulates the network round trip
+        self._http = None
+        self._ws_loop = None
+        self._ws_server = None
+        self._connections = {}  # id -> {'queue', 'streams', 'key'}
+        self._endpoints = {(each.method, each.path): each for each in vars(c).values() if isinstance(each, c.Endpoint)}
+        self._handlers = {
+            c.ASSETS: self._assets, c.COLLATERAL: self._collateral_params, c.MARKETS: self._markets,
+            c.MARKET: self._market, c.TICKER: self._ticker, c.TICKERS: self._tickers, c.DEPTH: self._depth,
+            c.K_LINES: self._k_lines, c.MARK_PRICES: self._mark_prices, c.OPEN_INTEREST: self._open_interest,
+            c.STATUS: lambda key, params: {'status': 'Ok', 'message': None}, c.PING: lambda key, params: 'pong',
+            c.SYSTEM_TIME: lambda key, params: str(self.server_time()), c.RECENT_TRADES: self._recent_trades,
+            c.HISTORICAL_TRADES: self._historical_trades,
+            c.ACCOUNT: lambda key, params: dict(self.engine.account(key).settings),
+            c.UPDATE_ACCOUNT: self._update_account, c.CONVERT_DUST: lambda key, params: None,
+            c.MAX_BORROW_QUANT: lambda key, params: {'symbol': params.get('symbol'), 'maxBorrowQuantity': '0'},
+            c.MAX_ORDER_QUANT: self._max_order_quantity, c.MAX_WITHDRAW_QUANT: self._max_withdraw_quantity,
+            c.BALANCES: self._balances, c.COLLATERALS: self._collaterals,
+            c.DEPOSIT_ADDRESS: lambda key, params: {'address': f"mock-{params.get('blockchain')}-address"},
+            c.OPEN_POSITIONS: self._positions, c.FILLS: self._fills, c.ORDERS: self._orders,
+            c.OPEN_ORDER: lambda key, params: self.engine.get_open_order(key, **self._order_args(params)),
+            c.EXEC_ORDER: lambda key, params: self.engine.place_order(key, **params),
+            c.CANCEL_ORDER: lambda key, params: self.engine.cancel_order(key, **self._order_args(params)),
+            c.EXEC_ORDERS: self._place_batch_orders,
+            c.OPEN_ORDERS: lambda key, params: self.engine.get_open_orders(key, params.get('symbol'),
+                                                                           params.get('marketType')),
+            c.CANCEL_ORDERS: lambda key, params: self.engine.cancel_orders(key, params['symbol'], params.get('orderType')),
+        }
+        # Endpoints without simulated state answer with an empty history
+        for each in (c.BORROW_LEND_MARKETS, c.BORROW_LEND_MARKETS_HISTORY, c.FUNDING_RATES, c.BORROW_LEND_POS,
+                     c.DEPOSITS, c.WITHDRAWALS, c.BORROWS, c.INTERESTS, c.BORROW_POS_HISTORY, c.DUST_CONVERSIONS,
+                     c.FUNDINGS, c.PNLS, c.RFQS, c.QUOTES, c.SETTLEMENTS, c.STRATEGIES):
+            self._handlers[each] = lambda key, params: []
+
+    @property
+    def api_url(self):
+        return f'http://{self.host}:{self.port}'
+
+    @property
+    def ws_url(self):
+        return f'ws://{self.host}:{self.ws_port}'
+
+    def server_time(self):
+        return int(time.time() * 1000) + self.clock_offset
+
+    def start(self):
+        self._http = ThreadingHTTPServer((self.host, self.port), _make_handler(self))
+        self._http.daemon_threads = True
+        self.port = self._http.server_address[1]
+        threading.Thread(target=self._http.serve_forever, name='mock-rest', daemon=True).start()
+        started = threading.Event()
+        threading.Thread(target=self._run_ws, args=(started,), name='mock-ws', daemon=True).start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self._http is not None:
+            self._http.shutdown()
+            self._http.server_close()
+            self._http = None
+        if self._ws_loop is not None:
+            self._ws_loop.call_soon_threadsafe(self._ws_server.close)
+            self._ws_loop = None
+
+    # REST
+
+    def handle(self, method, path, query, body, headers):
+        endpoint = self._endpoints.get((method, path))
+        if endpoint is None:
+            return 404, {'code': 'NOT_FOUND', 'message': f'{method} {path} not found'}
+        try:
+            params = query if method == c.GET else (json.loads(body) if body else {})
+            key = self._authenticate(endpoint, headers, params) if endpoint.instruction else None
+            handler = self._handlers.get(endpoint)
+            if handler is None:
+                raise MockError('NOT_SUPPORTED', f'{endpoint.instruction} is not supported by the mock exchange')
+            return 200, handler(key, params)
+        except MockError as e:
+            return e.status, {'code': e.code, 'message': e.message}
+        except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+            return 400, {'code': 'INVALID_CLIENT_REQUEST', 'message': repr(e)}
+
+    def _authenticate(self, endpoint, headers, params):
+        key = headers.get(c.X_API_KEY)
+        signature = headers.get(c.X_SIGNATURE)
+        timestamp = headers.get(c.X_TIMESTAMP)
+        window = headers.get(c.X_WINDOW) or c.DEFAULT_WINDOW
+        if not (key and signature and timestamp):
+            raise MockError('UNAUTHORIZED', 'Missing authentication headers', 401)
+        if abs(self.server_time() - int(timestamp)) > int(window):
+            raise MockError('INVALID_CLIENT_REQUEST', 'Request has expired', 400)
+        if isinstance(params, list):
+            message = utils.pre_hash_batch_orders(endpoint.instruction, params, timestamp, window)
+        else:
+            message = utils.pre_hash(endpoint.instruction, params, timestamp, window)
+        self._verify(key, message, signature)
+        return key
+
+    def _verify(self, key, message, signature):
+        try:
+            nacl.signing.VerifyKey(base64.b64decode(key)).verify(message.encode(), base64.b64decode(signature))
+        except (ValueError, TypeError, nacl.exceptions.BadSignatureError, nacl.exceptions.ValueError):
+            raise MockError('UNAUTHORIZED', 'Invalid signature', 401)
+
+    @staticmethod
+    def _order_args(params):
+        return {'symbol': params['symbol'], 'orderId': params.get('orderId'), 'clientId': params.get('clientId')}
+
+    @staticmethod
+    def _page(items, params):
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 100))
+        return items[offset:offset + limit]
+
+    def _assets(self, key, params):
+        assets = sorted({each.base for each in self.engine.markets.values()} |
+                        {each.quote for each in self.engine.markets.values()})
+        return [{'symbol': each, 'tokens': []} for each in assets]
+
+    def _collateral_params(self, key, params):
+        return [{'symbol': each, 'imfFunction': None, 'mmfFunction': None, 'haircutFunction': None}
+                for each in sorted({each.quote for each in self.engine.markets.values()})]
+
+    def _markets(self, key, params):
+        return [each.to_dict() for each in self.engine.markets.values()]
+
+    def _market(self, key, params):
+        return self.engine.market(params['symbol']).to_dict()
+
+    def _ticker(self, key, params):
+        with self.engine.lock:
+            trades = list(self.engine.trades[self.engine.market(params['symbol']).symbol])
+        prices = [Decimal(each['price']) for each in trades]
+        first = prices[-1] if prices else Decimal(0)
+        last = prices[0] if prices else Decimal(0)
+        return {'symbol': params['symbol'], 'firstPrice': fmt(first), 'lastPrice': fmt(last),
+                'priceChange': fmt(last - first), 'priceChangePercent': fmt((last - first) / first) if first else '0',
+                'high': fmt(max(prices)) if prices else '0', 'low': fmt(min(prices)) if prices else '0',
+                'volume': fmt(sum(Decimal(each['quantity']) for each in trades)),
+                'quoteVolume': fmt(sum(Decimal(each['quoteQuantity']) for each in trades)), 'trades': str(len(trades))}
+
+    def _tickers(self, key, params):
+        return [self._ticker(key, {'symbol': symbol}) for symbol in self.engine.markets]
+
+    def _depth(self, key, params):
+        symbol = self.engine.market(params['symbol']).symbol
+        with self.engine.lock:
+            book = self.engine.books[symbol]
+            asks = book['Ask'].depth()
+            bids = book['Bid'].depth()[::-1]
+            update_id = self.engine.update_ids[symbol]
+        return {'asks': [[fmt(price), fmt(qty)] for price, qty in asks],
+                'bids': [[fmt(price), fmt(qty)] for price, qty in bids],
+                'lastUpdateId': str(update_id), 'timestamp': int(time.time() * 1000)}
+
+    def _k_lines(self, key, params):
+        symbol = self.engine.market(params['symbol']).symbol
+        seconds = c.KLINE_INTERVALS[params['interval']]
+        start = int(params['startTime'])
+        end = int(params.get('endTime') or time.time())
+        with self.engine.lock:
+            trades = list(self.engine.trades[symbol])[::-1]
+        bars = {}
+        for trade in trades:
+            ts = trade['timestamp'] // 1000
+            if not start <= ts < end:
+                continue
+            bar_start = ts - ts % seconds
+            price, quantity = Decimal(trade['price']), Decimal(trade['quantity'])
+            bar = bars.setdefault(bar_start, [price, price, price, price, Decimal(0), Decimal(0), 0])
+            bar[1] = max(bar[1], price)
+            bar[2] = min(bar[2], price)
+            bar[3] = price
+            bar[4] += quantity
+            bar[5] += price * quantity
+            bar[6] += 1
+        strftime = lambda ts: time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))
+        return [{'start': strftime(bar_start), 'end': strftime(bar_start + seconds), 'open': fmt(bar[0]),
+                 'high': fmt(bar[1]), 'low': fmt(bar[2]), 'close': fmt(bar[3]), 'volume': fmt(bar[4]),
+                 'quoteVolume': fmt(bar[5]), 'trades': str(bar[6])} for bar_start, bar in sorted(bars.items())]
+
+    def _mark_prices(self, key, params):
+        result = []
+        for market in self.engine.markets.values():
+            if market.market_type != 'PERP' or params.get('symbol') not in (None, market.symbol):
+                continue
+            price = fmt(self.engine.last_price.get(market.symbol, Decimal(0)))
+            result.append({'symbol': market.symbol, 'markPrice': price, 'indexPrice': price, 'fundingRate': '0',
+                           'nextFundingTimestamp': int(time.time() * 1000) + 3600000})
+        return result
+
+    def _open_interest(self, key, params):
+        result = []
+        with self.engine.lock:
+            for market in self.engine.markets.values():
+                if market.market_type != 'PERP' or params.get('symbol') not in (None, market.symbol):
+                    continue
+                total = sum(account.positions.get(market.symbol, [Decimal(0)])[0] for account in
+                            self.engine.accounts.values() if account.positions.get(market.symbol, [0])[0] > 0)
+                result.append({'symbol': market.symbol, 'openInterest': fmt(Decimal(total)),
+                               'timestamp': int(time.time() * 1000)})
+        return result
+
+    def _recent_trades(self, key, params):
+        symbol = self.engine.market(params['symbol']).symbol
+        with self.engine.lock:
+            return list(self.engine.trades[symbol])[:int(params.get('limit', 100))]
+
+    def _historical_trades(self, key, params):
+        symbol = self.engine.market(params['symbol']).symbol
+        with self.engine.lock:
+            return self._page(list(self.engine.trades[symbol]), params)
+
+    def _update_account(self, key, params):
+        self.engine.account(key).settings.update(params)
+        return None
+
+    def _max_order_quantity(self, key, params):
+        market = self.engine.market(params['symbol'])
+        with self.engine.lock:
+            account = self.engine.account(key)
+            if params['side'] == 'Ask' and market.market_type == 'SPOT':
+                quantity = account.balance(market.base)['available']
+            else:
+                price = Decimal(params['price']) if params.get('price') else self.engine.last_price.get(market.symbol)
+                available = account.balance(market.quote)['available']
+                if market.market_type == 'PERP':
+                    available /= market.imf
+                quantity = available / price if price else Decimal(0)
+        quantity = quantity.quantize(market.step_size, rounding='ROUND_DOWN')
+        return {'symbol': market.symbol, 'side': params['side'], 'maxOrderQuantity': fmt(quantity)}
+
+    def _max_withdraw_quantity(self, key, params):
+        with self.engine.lock:
+            available = self.engine.account(key).balance(params['symbol'])['available']
+        return {'symbol': params['symbol'], 'maxWithdrawalQuantity': fmt(available)}
+
+    def _balances(self, key, params):
+        with self.engine.lock:
+            return {asset: {'available': fmt(balance['available']), 'locked': fmt(balance['locked']), 'staked': '0'}
+                    for asset, balance in self.engine.account(key).balances.items()}
+
+    def _mark(self, asset):
+        # Quote value of one unit of an asset, from the last trade of its first market
+        for market in self.engine.markets.values():
+            if market.base == asset and market.symbol in self.engine.last_price:
+                return self.engine.last_price[market.symbol]
+        return Decimal(1) if any(each.quote == asset for each in self.engine.markets.values()) else Decimal(0)
+
+    def _collaterals(self, key, params):
+        with self.engine.lock:
+            account = self.engine.account(key)
+            collateral = []
+            equity = Decimal(0)
+            locked = Decimal(0)
+            for asset, balance in account.balances.items():
+                mark = self._mark(asset)
+                total = balance['available'] + balance['locked']
+                equity += total * mark
+                locked += balance['locked'] * mark
+                collateral.append({'symbol': asset, 'assetMarkPrice': fmt(mark), 'totalQuantity': fmt(total),
+                                   'balanceNotional': fmt(total * mark), 'collateralWeight': '1',
+                                   'collateralValue': fmt(total * mark), 'openOrderQuantity': fmt(balance['locked']),
+                                   'lendQuantity': '0', 'availableQuantity': fmt(balance['available'])})
+            unrealized = Decimal(0)
+            exposure = Decimal(0)
+            imf = Decimal(0)
+            for symbol, (net, entry) in account.positions.items():
+                market = self.engine.markets[symbol]
+                mark = self.engine.last_price.get(symbol, entry)
+                unrealized += (mark - entry) * net
+                exposure += abs(net) * mark
+                locked += abs(net) * mark * market.imf
+                imf = max(imf, market.imf)
+            if not imf:
+                imf = max([each.imf for each in self.engine.markets.values() if each.market_type == 'PERP'] or [Decimal(0)])
+            equity += unrealized
+        return {'assetsValue': fmt(equity - unrealized), 'borrowLiability': '0', 'collateral': collateral,
+                'imf': fmt(imf), 'unsettledEquity': fmt(unrealized), 'liabilitiesValue': '0',
+                'marginFraction': fmt(equity / exposure) if exposure else None, 'mmf': fmt(imf / 2),
+                'netEquity': fmt(equity), 'netEquityAvailable': fmt(equity - locked), 'netEquityLocked': fmt(locked),
+                'netExposureFutures': fmt(exposure), 'pnlUnrealized': fmt(unrealized)}
+
+    def _positions(self, key, params):
+        with self.engine.lock:
+            account = self.engine.account(key)
+            result = []
+            for symbol, (net, entry) in account.positions.items():
+                if not net:
+                    continue
+                mark = self.engine.last_price.get(symbol, entry)
+                result.append({'symbol': symbol, 'netQuantity': fmt(net), 'netExposureQuantity': fmt(abs(net)),
+                               'entryPrice': fmt(entry), 'markPrice': fmt(mark),
+                               'pnlUnrealized': fmt((mark - entry) * net), 'pnlRealized': '0'})
+            return result
+
+    def _fills(self, key, params):
+        with self.engine.lock:
+            fills = list(self.engine.account(key).fills)
+        start = int(params['from']) if params.get('from') else None
+        end = int(params['to']) if params.get('to') else None
+        result = [fill for ts, fill in fills if (start is None or ts >= start) and (end is None or ts < end)
+                  and params.get('symbol') in (None, fill['symbol']) and params.get('orderId') in (None, fill['orderId'])
+                  and params.get('marketType') in (None, self.engine.markets[fill['symbol']].market_type)]
+        if params.get('sortDirection', 'Desc') == 'Desc':
+            result.reverse()
+        return self._page(result, params)
+
+    def _orders(self, key, params):
+        with self.engine.lock:
+            orders = [each.to_dict() for each in self.engine.account(key).orders.values()
+                      if params.get('orderId') in (None, each.id) and params.get('symbol') in (None, each.market.symbol)
+                      and params.get('marketType') in (None, each.market.market_type)]
+        if params.get('sortDirection', 'Desc') == 'Desc':
+            orders.reverse()
+        return self._page(orders, params)
+
+    def _place_batch_orders(self, key, orders):
+        if len(orders) > self.batch_limit:
+            raise MockError('INVALID_CLIENT_REQUEST', f'Batch size above the limit of {self.batch_limit} orders')
+        results = []
+        for order in orders:
+            try:
+                results.append(self.engine.place_order(key, **order))
+            except MockError as e:
+                results.append({'code': e.code, 'message': e.message})
+        return results
+
+    # WebSocket
+
+    # Simulates a network failure: cuts every WebSocket connection, or with silent=True stops reading
+    # from them, like a peer that vanished without closing (pings go unanswered)
+    def drop_connections(self, silent=False):
+        def drop():
+            for connection in list(self._connections.values()):
+                transport = connection['ws'].transport
+                if silent:
+                    transport.pause_reading()
+                    connection['streams'].clear()
+                else:
+                    transport.abort()
+        if self._ws_loop is not None:
+            self._ws_loop.call_soon_threadsafe(drop)
+
+    def _run_ws(self, started):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        async def serve():
+            self._ws_server = await websockets.serve(self._ws_handler, self.host, self.ws_port)
+            self.ws_port = list(self._ws_server.sockets)[0].getsockname()[1]
+            self._ws_loop = loop
+            started.set()
+            await self._ws_server.wait_closed()
+
+        loop.run_until_complete(serve())
+
+    async def _ws_handler(self, ws, path=None):
+        connection = {'queue': asyncio.Queue(), 'streams': set(), 'key': None, 'ws': ws}
+        self._connections[id(connection)] = connection
+        sender = asyncio.ensure_future(self._ws_sender(ws, connection['queue']))
+        try:
+            async for message in ws:
+                try:
+                    request = json.loads(message)
+                except ValueError:
+                    continue
+                streams = request.get('params') or []
+                if request.get('method') == 'SUBSCRIBE':
+                    if any(each.startswith('account.') for each in streams):
+                        try:
+                            connection['key'] = self._ws_authenticate(request.get('signature'))
+                        except MockError as e:
+                            await ws.send(json.dumps({'id': request.get('id'),
+                                                      'error': {'code': 4006, 'message': e.message}}))
+                            continue
+                    connection['streams'].update(streams)
+                elif request.get('method') == 'UNSUBSCRIBE':
+                    connection['streams'].difference_update(streams)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._connections.pop(id(connection), None)
+            sender.cancel()
+
+    def _ws_authenticate(self, signature):
+        if not signature or len(signature) != 4:
+            raise MockError('UNAUTHORIZED', 'Missing signature')
+        key, sign, timestamp, window = signature
+        if abs(self.server_time() - int(timestamp)) > int(window):
+            raise MockError('UNAUTHORIZED', 'Signature has expired')
+        self._verify(key, f'instruction=subscribe&timestamp={timestamp}&window={window}', sign)
+        return key
+
+    async def _ws_sender(self, ws, queue):
+        while True:
+            await ws.send(await queue.get())
+
+    def _on_event(self, key, stream, data):
+        loop = self._ws_loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._dispatch, key, stream, data)
+
+    def _dispatch(self, key, stream, data):
+        frame = None
+        for connection in list(self._connections.values()):
+            streams = connection['streams']
+            if key is not None:
+                # account.orderUpdate covers every symbol, account.orderUpdate.<symbol> only one
+                if connection['key'] != key or (stream not in streams and stream.rsplit('.', 1)[0] not in streams):
+                    continue
+            elif stream not in streams:
+                continue
+            if frame is None:
+                frame = json.dumps({'stream': stream, 'data': data})
+            connection['queue'].put_nowait(frame)
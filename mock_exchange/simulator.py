@@ -0,0 +1,50 @@
+import random
+import threading
+from decimal import Decimal, ROUND_DOWN
+from .engine import MockError
+
+
+class MarketSimulator(object):
+    '''
+    Random-walk price driver. Every interval it moves the price and sends an
+    IOC order from its own account through the book up (or down) to the new
+    price, filling any resting orders it crosses and printing a trade.
+    '''
+
+    def __init__(self, engine, symbol, price, volatility=0.001, quantity='1', interval=0.5, account='mock-simulator',
+                 seed=None):
+        self.engine = engine
+        self.market = engine.market(symbol)
+        self.price = Decimal(str(price))
+        self.volatility = volatility
+        self.quantity = Decimal(quantity)
+        self.interval = interval
+        self.account = account
+        self.random = random.Random(seed)
+        self._stop = threading.Event()
+        for asset in (self.market.base, self.market.quote):
+            engine.deposit(account, asset, 10 ** 12)
+
+    def step(self):
+        move = Decimal(str(self.random.gauss(0, self.volatility)))
+        price = (self.price * (1 + move)).quantize(self.market.tick_size, rounding=ROUND_DOWN)
+        if price <= 0:
+            return
+        side = 'Bid' if price >= self.price else 'Ask'
+        self.price = price
+        try:
+            self.engine.place_order(self.account, self.market.symbol, side, 'Limit', price=price,
+                                    quantity=self.quantity, timeInForce='IOC')
+        except MockError:
+            pass
+
+    def start(self):
+        threading.Thread(target=self._run, name=f'mock-simulator-{self.market.symbol}', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.step()